@@ -0,0 +1,163 @@
+"""
+Semantic answer cache for near-duplicate questions (/search, /image-qa).
+
+Answers are stored under (endpoint, scope, question embedding), where the
+scope fingerprints what the answer was computed from (the page set with its
+page versions, or an image and its summary). A new question in the same
+scope whose embedding has cosine similarity of at least
+SEMANTIC_CACHE_THRESHOLD with a stored question gets the stored answer, so
+"what does the auth flow do" and "explain the auth flow" cost one Gemini
+call. Questions are embedded with the search embedder (vector_index).
+
+Every entry also records the (page id, version) pairs behind it; a lookup
+that sees a page at another version deletes the entries built on the old
+one, so no answer outlives an edit of its pages.
+
+Tuning (environment variables):
+    SEMANTIC_CACHE_ENABLED     "0" turns the cache off (default "1")
+    SEMANTIC_CACHE_THRESHOLD   minimum cosine similarity for a hit (default 0.92)
+    SEMANTIC_CACHE_TTL         seconds an answer is reused (default 86400)
+    SEMANTIC_CACHE_DB          SQLite file (default .cache/semantic_answers.db)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cache_db import CACHE_DIR, open_cache_db
+from vector_index import vector_index
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") != "0"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+SEMANTIC_CACHE_DB = os.getenv("SEMANTIC_CACHE_DB", os.path.join(CACHE_DIR, "semantic_answers.db"))
+
+
+def scope_key(*parts) -> str:
+    """Fingerprint of what an answer was computed from."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+class SemanticAnswerCache:
+    def __init__(self, db_path: str = SEMANTIC_CACHE_DB, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: float = SEMANTIC_CACHE_TTL, enabled: bool = SEMANTIC_CACHE_ENABLED):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._conn = open_cache_db(db_path)
+        with self._lock:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "id INTEGER PRIMARY KEY, endpoint TEXT, scope TEXT, question TEXT, vector BLOB, "
+                "answer TEXT, created_at REAL);"
+                "CREATE INDEX IF NOT EXISTS answers_scope ON answers (endpoint, scope);"
+                "CREATE TABLE IF NOT EXISTS answer_pages (answer_id INTEGER, page_id TEXT, version INTEGER);"
+                "CREATE INDEX IF NOT EXISTS answer_pages_page ON answer_pages (page_id);"
+            )
+            self._conn.commit()
+
+    def _count(self, endpoint: str, counter: str, amount: int = 1):
+        with self._lock:
+            stats = self.counters.setdefault(endpoint, {"hits": 0, "misses": 0, "stores": 0, "invalidated": 0})
+            stats[counter] += amount
+
+    def _delete(self, answer_ids: List[int]):
+        for i in range(0, len(answer_ids), 500):
+            chunk = answer_ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            self._conn.execute(f"DELETE FROM answers WHERE id IN ({marks})", chunk)
+            self._conn.execute(f"DELETE FROM answer_pages WHERE answer_id IN ({marks})", chunk)
+
+    def invalidate_pages(self, endpoint: str, pages: List[Dict]):
+        """Drop answers built on any of these pages at a version other than the current one."""
+        stale = set()
+        with self._lock:
+            for page in pages:
+                rows = self._conn.execute(
+                    "SELECT answer_id FROM answer_pages WHERE page_id = ? AND version IS NOT ?",
+                    (str(page["id"]), page.get("version")),
+                ).fetchall()
+                stale.update(r[0] for r in rows)
+            if stale:
+                self._delete(sorted(stale))
+                self._conn.commit()
+        if stale:
+            self._count(endpoint, "invalidated", len(stale))
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        try:
+            return np.asarray(vector_index.embedder.embed_query(question), dtype=np.float32)
+        except Exception as e:
+            print(f"Semantic cache skipped, question embedding failed: {e}")
+            return None
+
+    def lookup(self, endpoint: str, scope: str, pages: List[Dict], question: str) -> Tuple[Optional[Dict], Any]:
+        """(stored answer or None, question vector to pass to store() and to the vector search)."""
+        if not self.enabled:
+            return None, None
+        self.invalidate_pages(endpoint, pages)
+        vector = self._embed(question)
+        if vector is None:
+            return None, None
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT vector, answer FROM answers WHERE endpoint = ? AND scope = ? AND created_at > ?",
+                (endpoint, scope, time.time() - self.ttl),
+            ).fetchall()
+        best, best_score = None, -1.0
+        for blob, answer in rows:
+            stored = np.frombuffer(blob, dtype=np.float32)
+            if stored.shape != vector.shape:
+                # Stored with another embedding model
+                continue
+            score = float(stored @ vector)
+            if score > best_score:
+                best, best_score = answer, score
+        if best is not None and best_score >= self.threshold:
+            self._count(endpoint, "hits")
+            answer = json.loads(best)
+            answer["semantic_cache"] = {"hit": True, "similarity": round(best_score, 4)}
+            return answer, vector
+        self._count(endpoint, "misses")
+        return None, vector
+
+    def store(self, endpoint: str, scope: str, pages: List[Dict], question: str, vector, answer: Dict):
+        if not self.enabled or vector is None:
+            return
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (endpoint, scope, question, vector, answer, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (endpoint, scope, question, np.asarray(vector, dtype=np.float32).tobytes(), json.dumps(answer), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT INTO answer_pages (answer_id, page_id, version) VALUES (?, ?, ?)",
+                [(cursor.lastrowid, str(p["id"]), p.get("version")) for p in pages],
+            )
+            self._conn.commit()
+        self._count(endpoint, "stores")
+
+    def purge_expired(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM answers WHERE created_at < ?", (time.time() - self.ttl,)
+            ).fetchall()
+            self._delete([r[0] for r in rows])
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            endpoints = {}
+            for endpoint, stats in self.counters.items():
+                lookups = stats["hits"] + stats["misses"]
+                endpoints[endpoint] = {**stats, "hit_rate": round(stats["hits"] / lookups, 3) if lookups else None}
+            return {"enabled": self.enabled, "threshold": self.threshold, "entries": entries, "endpoints": endpoints}
+
+
+answer_cache = SemanticAnswerCache()
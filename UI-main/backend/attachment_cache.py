@@ -0,0 +1,189 @@
+"""
+Content-addressed on-disk cache for downloaded attachments (videos, images, Excel).
+
+Files are stored under a SHA-256 of their cache key and streamed to disk in
+chunks, never buffered whole in memory. Keys are either the attachment id and
+version (immutable, so a hit needs no network at all) or the download URL; a
+URL that carries `version=`/`modificationDate=` is treated as immutable too,
+otherwise the entry is revalidated with If-None-Match/ETag after
+ATTACHMENT_REVALIDATE_TTL seconds. Total size is bounded by
+ATTACHMENT_CACHE_MAX_BYTES with least-recently-used eviction (file mtime is
+bumped on every hit). Files used within ATTACHMENT_EVICT_GRACE seconds are
+never evicted, since fetch() has handed their path to a request that may not
+have opened it yet (a video queued for ffmpeg, an Excel file waiting for the
+CPU pool); the cache can run over its budget until they age out.
+
+Tuning (environment variables):
+    ATTACHMENT_CACHE_DIR          cache directory (default .cache/attachments)
+    ATTACHMENT_CACHE_MAX_BYTES    disk budget (default 2 GB)
+    ATTACHMENT_REVALIDATE_TTL     seconds before a mutable URL is revalidated (default 300)
+    ATTACHMENT_EVICT_GRACE        seconds a fetched or hit file is protected from eviction (default 900)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit, parse_qs
+
+from cache_db import CACHE_DIR
+import http_pool
+
+ATTACHMENT_CACHE_DIR = os.getenv("ATTACHMENT_CACHE_DIR", os.path.join(CACHE_DIR, "attachments"))
+ATTACHMENT_CACHE_MAX_BYTES = int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+ATTACHMENT_REVALIDATE_TTL = float(os.getenv("ATTACHMENT_REVALIDATE_TTL", "300"))
+ATTACHMENT_EVICT_GRACE = float(os.getenv("ATTACHMENT_EVICT_GRACE", "900"))
+CHUNK_SIZE = 1024 * 1024
+
+
+class AttachmentDownloadError(Exception):
+    def __init__(self, url: str, status_code: int):
+        super().__init__(f"Download of {url} failed with HTTP {status_code}")
+        self.url = url
+        self.status_code = status_code
+
+
+def _is_immutable_url(url: str) -> bool:
+    query = parse_qs(urlsplit(url).query)
+    return "version" in query or "modificationDate" in query
+
+
+class AttachmentCache:
+    def __init__(self, directory: str = ATTACHMENT_CACHE_DIR, max_bytes: int = ATTACHMENT_CACHE_MAX_BYTES,
+                 evict_grace: float = ATTACHMENT_EVICT_GRACE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evict_grace = evict_grace
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.bytes_downloaded = 0
+        self._total_bytes = sum(
+            os.path.getsize(os.path.join(directory, name))
+            for name in os.listdir(directory) if not name.endswith((".json", ".part"))
+        )
+
+    def _paths(self, key: str, suffix: str):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, digest)
+        return base + suffix, base + ".json"
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _read_meta(self, meta_path: str) -> Optional[Dict]:
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _hit(self, path: str) -> str:
+        os.utime(path, None)
+        self.hits += 1
+        return path
+
+    def fetch(self, url: str, session=None, auth=None, cache_key: Optional[str] = None,
+              suffix: str = "") -> str:
+        """Return a local file path with the content of `url`, downloading it only if needed.
+
+        `cache_key` identifies immutable content (e.g. "attachment:<id>:<version>");
+        without it the URL is the key.
+        """
+        key = cache_key or f"url:{url}"
+        path, meta_path = self._paths(key, suffix)
+        immutable = cache_key is not None or _is_immutable_url(url)
+        with self._key_lock(key):
+            meta = self._read_meta(meta_path) if os.path.exists(path) else None
+            headers = {}
+            if meta is not None:
+                if immutable or time.time() - meta.get("validated_at", 0) < ATTACHMENT_REVALIDATE_TTL:
+                    return self._hit(path)
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+
+            session = session or http_pool.get_session(url)
+            response = session.get(url, auth=auth, headers=headers, stream=True)
+            try:
+                if response.status_code == 304 and meta is not None:
+                    meta["validated_at"] = time.time()
+                    self._write_meta(meta_path, meta)
+                    return self._hit(path)
+                if response.status_code != 200:
+                    raise AttachmentDownloadError(url, response.status_code)
+                old_size = os.path.getsize(path) if os.path.exists(path) else 0
+                size = self._stream_to_disk(response, path)
+            finally:
+                response.close()
+            self._write_meta(meta_path, {
+                "url": url,
+                "key": key,
+                "etag": response.headers.get("ETag"),
+                "size": size,
+                "validated_at": time.time(),
+            })
+            self.misses += 1
+            self.bytes_downloaded += size
+            with self._lock:
+                self._total_bytes += size - old_size
+        self._evict()
+        return path
+
+    def _stream_to_disk(self, response, path: str) -> int:
+        part_path = f"{path}.{threading.get_ident()}.part"
+        size = 0
+        with open(part_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    size += len(chunk)
+        os.replace(part_path, path)
+        return size
+
+    def _write_meta(self, meta_path: str, meta: Dict):
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    def _evict(self):
+        with self._lock:
+            if self._total_bytes <= self.max_bytes:
+                return
+            # Recently fetched or hit files (including the one just downloaded) may still be in use
+            cutoff = time.time() - self.evict_grace
+            files = []
+            for name in os.listdir(self.directory):
+                full = os.path.join(self.directory, name)
+                if name.endswith((".json", ".part")):
+                    continue
+                stat = os.stat(full)
+                if stat.st_mtime >= cutoff:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, full))
+            for _, size, full in sorted(files):
+                if self._total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(full)
+                    meta_path = os.path.splitext(full)[0] + ".json"
+                    if os.path.exists(meta_path):
+                        os.remove(meta_path)
+                    self._total_bytes -= size
+                except OSError as e:
+                    print(f"Attachment cache eviction failed for {full}: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "directory": self.directory,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_downloaded": self.bytes_downloaded,
+        }
+
+
+attachment_cache = AttachmentCache()
@@ -0,0 +1,108 @@
+"""
+Benchmark page parsing on large storage-format pages.
+
+Compares the old per-tool parsing (each tool building its own html.parser
+BeautifulSoup tree of the same body: search text, code extraction, impact
+analysis and classification) with one PageBundle parse per page using
+html.parser and lxml.
+
+Usage:
+    python benchmark_page_parse.py                 # synthetic pages
+    python benchmark_page_parse.py page1.html ...  # storage bodies saved to files
+    python benchmark_page_parse.py --sections 2000 --repeat 5
+"""
+import argparse
+import random
+import time
+
+from bs4 import BeautifulSoup
+
+import page_parse
+
+
+def synthetic_page(sections: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    words = ["deploy", "service", "config", "latency", "cache", "token", "cluster", "release", "schema", "client"]
+    parts = []
+    for i in range(sections):
+        sentence = " ".join(rng.choice(words) for _ in range(60))
+        parts.append(f"<h2>Section {i}</h2><p>{sentence} <strong>{rng.choice(words)}</strong> {sentence}</p>")
+        if i % 5 == 0:
+            code = "\n".join(f"if x{j} < {j} and y > 0: call(x{j}, '&')" for j in range(20))
+            parts.append(
+                '<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">python</ac:parameter>'
+                f"<ac:plain-text-body><![CDATA[{code}]]></ac:plain-text-body></ac:structured-macro>"
+            )
+        if i % 7 == 0:
+            rows = "".join(f"<tr><td>{r}</td><td>{rng.random():.3f}</td><td>{rng.choice(words)}</td></tr>" for r in range(15))
+            parts.append(f"<table><tbody><tr><th>id</th><th>value</th><th>tag</th></tr>{rows}</tbody></table>")
+        if i % 9 == 0:
+            parts.append(f'<ac:image><ri:attachment ri:filename="diagram-{i}.png" /></ac:image>')
+        if i % 11 == 0:
+            parts.append(f"<pre><code>curl -X POST /api/v1/items/{i}</code></pre>")
+    return "".join(parts)
+
+
+def per_tool_parses(body: str):
+    """What the tools did before the shared bundle: one html.parser tree each."""
+    BeautifulSoup(body, "html.parser").get_text(separator="\n")
+    soup = BeautifulSoup(body, "html.parser")
+    [t.get_text() for t in soup.find_all(["pre", "code"])]
+    soup = BeautifulSoup(body, "html.parser")
+    [b.find("ac:plain-text-body").text for b in soup.find_all("ac:structured-macro", {"ac:name": "code"})
+     if b.find("ac:plain-text-body")]
+    soup = BeautifulSoup(body, "html.parser")
+    soup.find_all(["ac:image", "img"]), soup.find("table")
+
+
+def timed(label: str, func, bodies, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for body in bodies:
+            func(body)
+        best = min(best, time.perf_counter() - started)
+    print(f"{label:<36} {best * 1000:9.1f} ms")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="storage-format bodies to parse")
+    parser.add_argument("--sections", type=int, default=1000, help="sections per synthetic page")
+    parser.add_argument("--pages", type=int, default=3, help="synthetic pages")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per variant (best is reported)")
+    args = parser.parse_args()
+
+    if args.files:
+        bodies = []
+        for path in args.files:
+            with open(path, encoding="utf-8") as f:
+                bodies.append(f.read())
+    else:
+        bodies = [synthetic_page(args.sections, seed) for seed in range(args.pages)]
+    print(f"{len(bodies)} pages, {sum(len(b) for b in bodies) / 1e6:.1f} MB of storage format\n")
+
+    baseline = timed("per-tool html.parser (4 parses)", per_tool_parses, bodies, args.repeat)
+    variants = [("bundle, html.parser (1 parse)", page_parse._parse_with_soup)]
+    if page_parse.etree is not None:
+        variants.append(("bundle, lxml (1 parse)", page_parse._parse_with_lxml))
+    else:
+        print("lxml is not installed; skipping the lxml variant")
+    for label, func in variants:
+        elapsed = timed(label, func, bodies, args.repeat)
+        print(f"{'':<36} {baseline / elapsed:9.1f}x faster")
+
+    if page_parse.etree is not None:
+        for body in bodies:
+            soup, fast = page_parse._parse_with_soup(body), page_parse._parse_with_lxml(body)
+            if (soup.code_macros, soup.code_blocks, soup.image_attachments, len(soup.tables)) != \
+                    (fast.code_macros, fast.code_blocks, fast.image_attachments, len(fast.tables)):
+                print("warning: lxml and html.parser bundles differ")
+                break
+    cached = page_parse.PageParseCache(offload_bytes=0)
+    timed("bundle from cache (repeat request)", cached.parse, bodies * 2, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""
+Where the backend keeps its on-disk caches, and how their SQLite files are opened.
+
+Each cache module stores its data under CACHE_DIR unless its own *_DB or
+*_DIR variable points elsewhere. open_cache_db() creates the parent
+directory, opens the file for use from several threads (callers serialize
+access with their own lock) and switches it to WAL, so readers are not
+blocked by a writer.
+
+Tuning (environment variables):
+    BACKEND_CACHE_DIR   root of the on-disk caches (default backend/.cache)
+"""
+import os
+import sqlite3
+
+CACHE_DIR = os.getenv("BACKEND_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+def open_cache_db(db_path: str) -> sqlite3.Connection:
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
@@ -0,0 +1,328 @@
+"""
+Local SQLite mirror of Confluence spaces with incremental delta sync.
+
+A space is crawled once (CQL `space = KEY and type = page`, following the
+search `_links.next` cursor), then each poll only asks for pages whose
+`lastmodified` falls inside the window since the previous sync. Page bodies
+(storage format), versions and attachment metadata are persisted so that
+`/spaces`, `/pages/{space_key}` and page-content reads can be answered
+locally, including while Confluence is slow or unavailable. Deleted pages
+are reconciled by a periodic id-only full listing.
+
+Configuration (environment variables):
+    CONFLUENCE_MIRROR_SPACES       comma-separated space keys to mirror ("*" for all);
+                                   the mirror is disabled when unset
+    CONFLUENCE_MIRROR_DB           SQLite file (default .cache/confluence_mirror.db)
+    CONFLUENCE_MIRROR_INTERVAL     seconds between delta polls (default 300)
+    CONFLUENCE_MIRROR_RECONCILE    seconds between deletion reconciles (default 86400)
+    CONFLUENCE_MIRROR_MAX_STALENESS  seconds a synced space is trusted for reads (default 900)
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from cache_db import CACHE_DIR, open_cache_db
+from page_index import fetch_space_pages
+
+MIRROR_SPACES = [s.strip() for s in os.getenv("CONFLUENCE_MIRROR_SPACES", "").split(",") if s.strip()]
+MIRROR_DB = os.getenv("CONFLUENCE_MIRROR_DB", os.path.join(CACHE_DIR, "confluence_mirror.db"))
+MIRROR_INTERVAL = float(os.getenv("CONFLUENCE_MIRROR_INTERVAL", "300"))
+MIRROR_RECONCILE = float(os.getenv("CONFLUENCE_MIRROR_RECONCILE", "86400"))
+MIRROR_MAX_STALENESS = float(os.getenv("CONFLUENCE_MIRROR_MAX_STALENESS", "900"))
+# Extra minutes added to every delta window; CQL `lastmodified` has minute granularity
+DELTA_OVERLAP_MINUTES = 5
+SEARCH_PAGE_SIZE = 50
+# Space keys are pasted into CQL, so anything outside Confluence's key alphabet is rejected
+SPACE_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_~]+$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spaces (
+    key TEXT PRIMARY KEY,
+    name TEXT,
+    last_sync_started REAL,
+    last_synced REAL,
+    last_reconciled REAL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id TEXT PRIMARY KEY,
+    space_key TEXT NOT NULL,
+    title TEXT NOT NULL,
+    version INTEGER,
+    last_modified TEXT,
+    body_storage TEXT,
+    synced_at REAL
+);
+CREATE INDEX IF NOT EXISTS pages_space_title ON pages (space_key, title);
+CREATE TABLE IF NOT EXISTS attachments (
+    id TEXT PRIMARY KEY,
+    page_id TEXT NOT NULL,
+    title TEXT,
+    media_type TEXT,
+    file_size INTEGER,
+    version INTEGER,
+    download_link TEXT
+);
+CREATE INDEX IF NOT EXISTS attachments_page ON attachments (page_id);
+"""
+
+
+def is_valid_space_key(space_key: str) -> bool:
+    return bool(SPACE_KEY_PATTERN.match(space_key or ""))
+
+
+class ConfluenceMirror:
+    def __init__(self, db_path: str = MIRROR_DB):
+        self.db_path = db_path
+        self._conn = open_cache_db(db_path)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._sync_locks: Dict[str, threading.Lock] = {}
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    # ---- reads -------------------------------------------------------
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def space_info(self, space_key: str) -> Optional[sqlite3.Row]:
+        rows = self._query("SELECT * FROM spaces WHERE key = ?", (space_key,))
+        return rows[0] if rows else None
+
+    def is_fresh(self, space_key: str, max_staleness: float = MIRROR_MAX_STALENESS) -> bool:
+        info = self.space_info(space_key)
+        return bool(info and info["last_synced"] and time.time() - info["last_synced"] <= max_staleness)
+
+    def get_spaces(self) -> List[Dict]:
+        return [{"name": r["name"], "key": r["key"]} for r in self._query("SELECT key, name FROM spaces ORDER BY name")]
+
+    def get_pages(self, space_key: str) -> List[Dict]:
+        rows = self._query(
+            "SELECT id, title, version FROM pages WHERE space_key = ? ORDER BY title", (space_key,)
+        )
+        return [{"id": r["id"], "title": r["title"], "version": r["version"]} for r in rows]
+
+    def get_page(self, page_id: str) -> Optional[Dict]:
+        rows = self._query("SELECT * FROM pages WHERE id = ?", (str(page_id),))
+        if not rows:
+            return None
+        row = rows[0]
+        return {
+            "id": row["id"],
+            "space_key": row["space_key"],
+            "title": row["title"],
+            "version": row["version"],
+            "body_storage": row["body_storage"],
+            "synced_at": row["synced_at"],
+        }
+
+    def get_attachments(self, page_id: str) -> List[Dict]:
+        rows = self._query("SELECT * FROM attachments WHERE page_id = ? ORDER BY title", (str(page_id),))
+        return [dict(r) for r in rows]
+
+    # ---- writes ------------------------------------------------------
+
+    def _upsert_page(self, space_key: str, content: Dict, now: float):
+        version = content.get("version") or {}
+        body = ((content.get("body") or {}).get("storage") or {}).get("value")
+        self._conn.execute(
+            "INSERT INTO pages (id, space_key, title, version, last_modified, body_storage, synced_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET space_key = excluded.space_key, title = excluded.title, "
+            "version = excluded.version, last_modified = excluded.last_modified, "
+            "body_storage = excluded.body_storage, synced_at = excluded.synced_at",
+            (content["id"], space_key, content["title"], version.get("number"), version.get("when"), body, now),
+        )
+
+    def _replace_attachments(self, page_id: str, attachments: List[Dict]):
+        self._conn.execute("DELETE FROM attachments WHERE page_id = ?", (page_id,))
+        for att in attachments:
+            extensions = att.get("extensions") or {}
+            self._conn.execute(
+                "INSERT OR REPLACE INTO attachments (id, page_id, title, media_type, file_size, version, download_link) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    att["id"],
+                    page_id,
+                    att.get("title"),
+                    extensions.get("mediaType") or (att.get("metadata") or {}).get("mediaType"),
+                    extensions.get("fileSize"),
+                    (att.get("version") or {}).get("number"),
+                    (att.get("_links") or {}).get("download"),
+                ),
+            )
+
+    # ---- sync engine -------------------------------------------------
+
+    def _sync_lock(self, space_key: str) -> threading.Lock:
+        with self._lock:
+            return self._sync_locks.setdefault(space_key, threading.Lock())
+
+    def _search_pages(self, confluence, cql: str):
+        """Yield page contents matching `cql`, following the search cursor."""
+        response = confluence.get(
+            "rest/api/content/search",
+            params={
+                "cql": cql,
+                "limit": SEARCH_PAGE_SIZE,
+                "expand": "body.storage,version,children.attachment.version",
+            },
+        )
+        while response:
+            for content in response.get("results", []):
+                yield content
+            next_link = (response.get("_links") or {}).get("next")
+            if not next_link:
+                break
+            response = confluence.get(next_link)
+
+    def _page_attachments(self, confluence, content: Dict) -> List[Dict]:
+        attachments = ((content.get("children") or {}).get("attachment")) or {}
+        results = list(attachments.get("results", []))
+        next_link = (attachments.get("_links") or {}).get("next")
+        while next_link:
+            more = confluence.get(next_link)
+            results.extend(more.get("results", []))
+            next_link = (more.get("_links") or {}).get("next")
+        return results
+
+    def sync_spaces(self, confluence) -> int:
+        spaces = []
+        start = 0
+        while True:
+            batch = confluence.get_all_spaces(start=start, limit=100).get("results", [])
+            if not batch:
+                break
+            spaces.extend(batch)
+            start += len(batch)
+        with self._lock:
+            for s in spaces:
+                self._conn.execute(
+                    "INSERT INTO spaces (key, name) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET name = excluded.name",
+                    (s["key"], s["name"]),
+                )
+            self._conn.commit()
+        return len(spaces)
+
+    def sync_space(self, confluence, space_key: str, full: bool = False) -> Dict:
+        """Crawl a space on first sync, afterwards fetch only recently modified pages."""
+        if not is_valid_space_key(space_key):
+            raise ValueError(f"Invalid space key: {space_key!r}")
+        with self._sync_lock(space_key):
+            started = time.time()
+            info = self.space_info(space_key)
+            cql = f'space = "{space_key}" and type = page'
+            mode = "full"
+            if info and info["last_sync_started"] and not full:
+                minutes = math.ceil((started - info["last_sync_started"]) / 60) + DELTA_OVERLAP_MINUTES
+                cql += f' and lastmodified >= now("-{minutes}m")'
+                mode = "delta"
+
+            updated = 0
+            for content in self._search_pages(confluence, cql):
+                attachments = self._page_attachments(confluence, content)
+                with self._lock:
+                    self._upsert_page(space_key, content, started)
+                    self._replace_attachments(content["id"], attachments)
+                    self._conn.commit()
+                updated += 1
+
+            removed = 0
+            last_reconciled = info["last_reconciled"] if info else None
+            if mode == "full" or not last_reconciled or started - last_reconciled > MIRROR_RECONCILE:
+                removed = self._reconcile(confluence, space_key)
+                last_reconciled = started
+
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO spaces (key, name, last_sync_started, last_synced, last_reconciled) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                    "last_sync_started = excluded.last_sync_started, last_synced = excluded.last_synced, "
+                    "last_reconciled = excluded.last_reconciled",
+                    (space_key, info["name"] if info else space_key, started, time.time(), last_reconciled),
+                )
+                self._conn.commit()
+            return {
+                "space_key": space_key,
+                "mode": mode,
+                "pages_updated": updated,
+                "pages_removed": removed,
+                "duration_seconds": round(time.time() - started, 3),
+            }
+
+    def _reconcile(self, confluence, space_key: str) -> int:
+        """Drop mirrored pages that no longer exist in the space."""
+        live_ids = {p["id"] for p in fetch_space_pages(confluence, space_key)}
+        with self._lock:
+            stored = [r["id"] for r in self._conn.execute("SELECT id FROM pages WHERE space_key = ?", (space_key,))]
+            gone = [page_id for page_id in stored if page_id not in live_ids]
+            for page_id in gone:
+                self._conn.execute("DELETE FROM pages WHERE id = ?", (page_id,))
+                self._conn.execute("DELETE FROM attachments WHERE page_id = ?", (page_id,))
+            self._conn.commit()
+        return len(gone)
+
+    def status(self) -> Dict:
+        rows = self._query(
+            "SELECT s.key, s.last_synced, s.last_reconciled, COUNT(p.id) AS pages "
+            "FROM spaces s LEFT JOIN pages p ON p.space_key = s.key GROUP BY s.key ORDER BY s.key"
+        )
+        return {
+            "db_path": self.db_path,
+            "spaces": [dict(r) for r in rows],
+        }
+
+
+class MirrorSyncer:
+    """Background thread that keeps the configured spaces in sync."""
+
+    def __init__(self, mirror: ConfluenceMirror, confluence_factory, spaces: List[str],
+                 interval: float = MIRROR_INTERVAL):
+        self.mirror = mirror
+        self.confluence_factory = confluence_factory
+        self.spaces = spaces
+        self.interval = interval
+        self.last_results: Dict[str, Dict] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _space_keys(self, confluence) -> List[str]:
+        if self.spaces == ["*"]:
+            return [s["key"] for s in self.mirror.get_spaces()]
+        return self.spaces
+
+    def run_once(self):
+        confluence = self.confluence_factory()
+        self.mirror.sync_spaces(confluence)
+        for space_key in self._space_keys(confluence):
+            try:
+                self.last_results[space_key] = self.mirror.sync_space(confluence, space_key)
+            except Exception as e:
+                print(f"Mirror sync failed for space {space_key}: {e}")
+                self.last_results[space_key] = {"space_key": space_key, "error": str(e)}
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Mirror sync failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="confluence-mirror", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+mirror = ConfluenceMirror() if MIRROR_SPACES else None
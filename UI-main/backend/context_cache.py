@@ -0,0 +1,222 @@
+"""
+Session cache for repeated Q&A over the same context: the selected page set
+in /search, the transcript of a video in /video-summarizer.
+
+The first question over a context prepares it (page bodies fetched and
+cleaned, or the video transcribed) and stores it under a context_id derived
+from what it was built from (page ids + versions, attachment id + version);
+follow-up questions over the same input reuse the prepared documents
+without touching Confluence or AssemblyAI again.
+
+Only video transcripts are handed to a context model. /search page sets
+always go through retrieval: each question sends just the chunks that match
+it (vector_index), which stays smaller than the page set even when the set
+would qualify for Gemini cached content, so retrieval wins over caching for
+search and the session only saves the page fetches.
+
+How a transcript reaches Gemini depends on CONTEXT_CACHE_BACKEND:
+
+- "gemini" (default): a context of at least CONTEXT_CACHE_MIN_TOKENS is
+  registered once as Gemini cached content on one key; follow-up questions
+  send only the question and the cached tokens are billed at the reduced
+  rate. Smaller contexts, or a failed registration, fall back to sending the
+  context with every question.
+- "local": offline stand-in with the same flow; the context is kept here and
+  sent in front of each question as a separate part, as a cached-content
+  model would see it, capped at the caller's prompt budget since every
+  question pays for it in full.
+- "off": contexts are reused but always sent inline with the question.
+
+Tuning (environment variables):
+    CONTEXT_CACHE_BACKEND       gemini | local | off (default gemini)
+    CONTEXT_CACHE_MODEL         explicit model version used for cached content
+                                (default models/gemini-1.5-flash-8b-001)
+    CONTEXT_CACHE_MIN_TOKENS    smallest context registered with Gemini (default 32768)
+    CONTEXT_CACHE_MAX_TOKENS    largest context registered with Gemini (default 500000)
+    CONTEXT_CACHE_TTL           seconds a prepared context is kept (default 3600)
+    CONTEXT_CACHE_MAX_ENTRIES   prepared contexts kept in memory (default 64)
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.generativeai import protos
+
+from key_pool import key_pool
+from prompt_budget import estimate_tokens, truncate_to_tokens
+
+CONTEXT_CACHE_BACKEND = os.getenv("CONTEXT_CACHE_BACKEND", "gemini")
+CONTEXT_CACHE_MODEL = os.getenv("CONTEXT_CACHE_MODEL", "models/gemini-1.5-flash-8b-001")
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "32768"))
+CONTEXT_CACHE_MAX_TOKENS = int(os.getenv("CONTEXT_CACHE_MAX_TOKENS", "500000"))
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "64"))
+
+
+def format_documents(documents: List[Tuple[str, str]]) -> str:
+    return "".join(f"\n\nTitle: {title}\n{text}" for title, text in documents)
+
+
+class ContextSession:
+    def __init__(self, context_id: str, kind: str, documents: List[Tuple[str, str]], meta: Dict[str, Any]):
+        self.context_id = context_id
+        self.kind = kind
+        self.documents = documents
+        self.meta = meta
+        self.created_at = time.time()
+        self.questions = 0
+        # Gemini cached content: {"name", "key_name", "expires_at"}
+        self.remote: Optional[Dict[str, Any]] = None
+        self.remote_failed = False
+        self.lock = threading.Lock()
+
+    def full_text(self) -> str:
+        return format_documents(self.documents)
+
+    def cached_text(self) -> str:
+        """The context as held by a cached-content model."""
+        return truncate_to_tokens(self.full_text(), CONTEXT_CACHE_MAX_TOKENS)
+
+
+class LocalContextModel:
+    """Offline stand-in for a cached-content model: the stored context is sent as its own part."""
+
+    def __init__(self, ai_model, context_text: str):
+        self.ai_model = ai_model
+        self.context_text = context_text
+
+    def generate_content(self, prompt, **kwargs):
+        return self.ai_model.generate_content([self.context_text, prompt], **kwargs)
+
+    def stream_text(self, prompt, **kwargs):
+        return self.ai_model.stream_text([self.context_text, prompt], **kwargs)
+
+
+class ContextCache:
+    def __init__(self, backend: str = CONTEXT_CACHE_BACKEND, ttl: float = CONTEXT_CACHE_TTL,
+                 max_entries: int = CONTEXT_CACHE_MAX_ENTRIES):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._sessions: "OrderedDict[str, ContextSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.remote_registrations = 0
+        self.remote_failures = 0
+
+    @staticmethod
+    def context_id_for(kind: str, *parts) -> str:
+        payload = json.dumps([kind, *parts], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def _build_lock(self, context_id: str) -> threading.Lock:
+        with self._lock:
+            return self._build_locks.setdefault(context_id, threading.Lock())
+
+    def _lookup(self, context_id: str) -> Optional[ContextSession]:
+        with self._lock:
+            session = self._sessions.get(context_id)
+            if session is not None and time.time() - session.created_at > self.ttl:
+                del self._sessions[context_id]
+                session = None
+            if session is not None:
+                self._sessions.move_to_end(context_id)
+            return session
+
+    def find(self, kind: str, fingerprint: List[Any]) -> Optional[ContextSession]:
+        return self._lookup(self.context_id_for(kind, *fingerprint))
+
+    def get_or_create(self, kind: str, fingerprint: List[Any],
+                      loader: Callable[[], Tuple[List[Tuple[str, str]], Dict[str, Any]]]) -> Tuple[ContextSession, bool]:
+        """Session for this input, preparing it with `loader` on first use. Returns (session, reused)."""
+        context_id = self.context_id_for(kind, *fingerprint)
+        session = self._lookup(context_id)
+        if session is None:
+            with self._build_lock(context_id):
+                # Another request may have prepared it while we waited
+                session = self._lookup(context_id)
+                if session is None:
+                    documents, meta = loader()
+                    session = ContextSession(context_id, kind, documents, meta)
+                    with self._lock:
+                        self._sessions[context_id] = session
+                        while len(self._sessions) > self.max_entries:
+                            evicted_id, _ = self._sessions.popitem(last=False)
+                            self._build_locks.pop(evicted_id, None)
+                        self.misses += 1
+                    return session, False
+        with self._lock:
+            self.hits += 1
+        session.questions += 1
+        return session, True
+
+    def _register_remote(self, ai_model, session: ContextSession) -> Optional[Dict[str, Any]]:
+        text = session.cached_text()
+        ttl = max(60, int(self.ttl - (time.time() - session.created_at)))
+        request = protos.CreateCachedContentRequest(cached_content=protos.CachedContent(
+            model=CONTEXT_CACHE_MODEL,
+            display_name=f"{session.kind}-{session.context_id}",
+            contents=[protos.Content(role="user", parts=[protos.Part(text=text)])],
+            ttl=datetime.timedelta(seconds=ttl),
+        ))
+        # Cached content belongs to the key's project, like uploaded files
+        with key_pool.lease(ai_model.preferred_key) as key:
+            created = key.client("cache").create_cached_content(request)
+        return {"name": created.name, "key_name": key.name, "expires_at": time.time() + ttl}
+
+    def context_model(self, ai_model, session: ContextSession, budget: int):
+        """Model that already holds the session's context, or None to send the context inline.
+
+        `budget` caps the tokens of context the local stand-in sends with each question.
+        """
+        if self.backend == "local":
+            return LocalContextModel(ai_model, truncate_to_tokens(session.full_text(), budget))
+        if self.backend != "gemini" or session.remote_failed:
+            return None
+        with session.lock:
+            if session.remote is None or session.remote["expires_at"] <= time.time() + 60:
+                if estimate_tokens(session.full_text()) < CONTEXT_CACHE_MIN_TOKENS:
+                    return None
+                try:
+                    session.remote = self._register_remote(ai_model, session)
+                    self.remote_registrations += 1
+                except Exception as e:
+                    print(f"Gemini context caching failed for {session.kind} {session.context_id}: {e}")
+                    session.remote_failed = True
+                    self.remote_failures += 1
+                    return None
+            remote = session.remote
+        return ai_model.with_cached_content(CONTEXT_CACHE_MODEL, remote["name"], remote["key_name"])
+
+    def prompt_context(self, ai_model, session: ContextSession, reference: str,
+                       inline: Callable[[ContextSession], str], budget: int) -> Tuple[Any, str]:
+        """(model, context) for a prompt over the session.
+
+        With the context held by the model, `context` is just `reference` to it;
+        otherwise the model is ai_model and `context` is `inline(session)`.
+        """
+        context_model = self.context_model(ai_model, session, budget)
+        if context_model is not None:
+            return context_model, reference
+        return ai_model, inline(session)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "remote_registrations": self.remote_registrations,
+                "remote_failures": self.remote_failures,
+            }
+
+
+context_sessions = ContextCache()
@@ -0,0 +1,185 @@
+"""
+Process pool for CPU-bound stages (diffs, HTML parsing, pandas, matplotlib).
+
+These stages hold the GIL, so running them on the request thread pool stalls
+every other request in the worker while one big diff or chart is computed.
+cpu_pool.run() hands them to long-lived worker processes instead and blocks
+only the calling request. Workers come from a forkserver that has already
+imported cpu_tasks, and each runs cpu_tasks.warm_up() (pandas, matplotlib,
+seaborn, the page parser) when it starts; start() brings all of them up at
+application startup so no request pays for process creation or imports.
+A pool whose worker died is replaced on the next call. Like any
+multiprocessing child, workers import the script that launched the server
+(`python main.py`), which is why uvicorn.run() stays under its __main__ guard.
+
+Per task it records runs, errors, queue wait and run time (average and p95
+over a sliding window), plus the current and peak queue depth.
+
+Tuning (environment variables):
+    CPU_POOL_WORKERS        worker processes (default min(4, CPU count); 0 runs tasks inline)
+    CPU_POOL_TASK_TIMEOUT   seconds a request waits for its task (default 120)
+    CPU_POOL_START_METHOD   forkserver | spawn (default forkserver)
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict
+
+import cpu_tasks
+
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+CPU_POOL_TASK_TIMEOUT = float(os.getenv("CPU_POOL_TASK_TIMEOUT", "120"))
+CPU_POOL_START_METHOD = os.getenv("CPU_POOL_START_METHOD", "forkserver")
+CPU_POOL_LATENCY_WINDOW = 200
+
+
+def _timed_call(func: Callable, args: tuple, kwargs: dict):
+    """Runs in the worker; wall-clock start and end let the caller split queue wait from run time."""
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, started, time.time()
+
+
+def _p95(samples) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, int(len(ordered) * 0.95) - 1)]
+
+
+class CpuPool:
+    def __init__(self, workers: int = CPU_POOL_WORKERS, timeout: float = CPU_POOL_TASK_TIMEOUT,
+                 start_method: str = CPU_POOL_START_METHOD):
+        self.workers = workers
+        self.timeout = timeout
+        self.start_method = start_method
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.max_queue_depth = 0
+        self.restarts = 0
+        self._tasks: Dict[str, Dict] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _create(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == "forkserver":
+            # Workers fork from a server that already imported the task module
+            context.set_forkserver_preload(["cpu_tasks"])
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=cpu_tasks.warm_up)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create()
+            return self._executor
+
+    def _replace(self, broken: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        """Start every worker now, so the first requests find them warm."""
+        if not self.enabled:
+            return
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(cpu_tasks.worker_pid)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _record(self, name: str, queue_wait: float, run_time: float, error: bool):
+        with self._lock:
+            task = self._tasks.setdefault(name, {
+                "runs": 0, "errors": 0,
+                "queue_wait": deque(maxlen=CPU_POOL_LATENCY_WINDOW),
+                "run_time": deque(maxlen=CPU_POOL_LATENCY_WINDOW),
+            })
+            task["runs"] += 1
+            task["errors"] += int(error)
+            task["queue_wait"].append(queue_wait)
+            task["run_time"].append(run_time)
+
+    def run(self, name: str, func: Callable, *args, **kwargs):
+        """Run func(*args, **kwargs) on a worker process and return its result; blocks the caller only."""
+        submitted = time.time()
+        if not self.enabled:
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                self._record(name, 0.0, time.time() - submitted, True)
+                raise
+            self._record(name, 0.0, time.time() - submitted, False)
+            return result
+
+        with self._lock:
+            self.pending += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.pending - self.workers)
+        try:
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    future = executor.submit(_timed_call, func, args, kwargs)
+                except BrokenProcessPool:
+                    # A worker died after the last call; nothing ran yet, so retry once on a new pool
+                    self._replace(executor)
+                    if attempt:
+                        raise
+                    continue
+                try:
+                    result, started, finished = future.result(timeout=self.timeout)
+                except FuturesTimeout:
+                    future.cancel()
+                    raise TimeoutError(f"{name} did not finish within {self.timeout:.0f}s on the CPU pool")
+                except BrokenProcessPool:
+                    print(f"CPU pool worker died during {name}; replacing the pool")
+                    self._replace(executor)
+                    raise
+                break
+        except Exception:
+            self._record(name, 0.0, time.time() - submitted, True)
+            raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+        self._record(name, max(0.0, started - submitted), finished - started, False)
+        return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            tasks = {}
+            for name, task in self._tasks.items():
+                waits, runs = list(task["queue_wait"]), list(task["run_time"])
+                tasks[name] = {
+                    "runs": task["runs"],
+                    "errors": task["errors"],
+                    "avg_queue_wait_ms": round(1000 * sum(waits) / len(waits), 1),
+                    "p95_queue_wait_ms": round(1000 * _p95(waits), 1),
+                    "avg_run_ms": round(1000 * sum(runs) / len(runs), 1),
+                    "p95_run_ms": round(1000 * _p95(runs), 1),
+                }
+            return {
+                "workers": self.workers,
+                "start_method": self.start_method if self.enabled else "inline",
+                "in_flight": self.pending,
+                "queue_depth": max(0, self.pending - self.workers),
+                "max_queue_depth": self.max_queue_depth,
+                "restarts": self.restarts,
+                "tasks": tasks,
+            }
+
+
+cpu_pool = CpuPool()
@@ -0,0 +1,140 @@
+"""
+CPU-bound stages run on the cpu_pool worker processes.
+
+Everything here takes and returns plain, picklable values (strings, bytes,
+dicts, PageBundle) so it can run in a worker or, with CPU_POOL_WORKERS=0,
+inline in the request thread. warm_up() is the worker initializer: it imports
+pandas, matplotlib, seaborn and the page parser once per worker so the first
+task does not pay for them.
+"""
+import difflib
+import io
+import os
+import threading
+from typing import Dict, Optional
+
+
+class TableDataError(ValueError):
+    """The source holds no usable table; the endpoint answers 400 with this message."""
+
+
+# pyplot keeps global figure state and is not thread-safe (only contended
+# when tasks run inline)
+_chart_lock = threading.Lock()
+
+
+def warm_up():
+    try:
+        import pandas  # noqa: F401
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot  # noqa: F401
+        import seaborn  # noqa: F401
+    except ImportError as e:
+        print(f"CPU worker {os.getpid()}: {e}")
+    import page_parse  # noqa: F401
+
+
+def worker_pid() -> int:
+    return os.getpid()
+
+
+def diff_stats(old_text: str, new_text: str, fromfile: str, tofile: str) -> Dict:
+    """Unified diff of two texts with added/removed line counts."""
+    old_lines = old_text.splitlines()
+    new_lines = new_text.splitlines()
+    diff = difflib.unified_diff(old_lines, new_lines, fromfile=fromfile, tofile=tofile, lineterm='')
+    full_diff_text = '\n'.join(diff)
+    diff_lines = full_diff_text.splitlines()
+    return {
+        "diff": full_diff_text,
+        "lines_added": sum(1 for l in diff_lines if l.startswith('+') and not l.startswith('+++')),
+        "lines_removed": sum(1 for l in diff_lines if l.startswith('-') and not l.startswith('---')),
+        "old_line_count": len(old_lines),
+    }
+
+
+def parse_page_body(body: str, backend: str):
+    import page_parse
+    return page_parse.parse_body(body, backend)
+
+
+def _first_html_table(table_html: str):
+    import pandas as pd
+    dfs = pd.read_html(table_html)
+    if not dfs:
+        raise TableDataError("No table found in HTML")
+    return dfs[0]
+
+
+def table_html_to_csv(table_html: str) -> str:
+    return _first_html_table(table_html).to_csv(index=False)
+
+
+def excel_to_csv(excel_path: str) -> str:
+    import pandas as pd
+    return pd.read_excel(excel_path).to_csv(index=False)
+
+
+def render_chart(chart_type: str, image_format: str, excel_path: Optional[str] = None,
+                 table_html: Optional[str] = None, csv_text: Optional[str] = None) -> bytes:
+    """Chart of the first table found in the Excel file, HTML table or CSV text (in that order)."""
+    import pandas as pd
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    if excel_path:
+        df = pd.read_excel(excel_path)
+    elif table_html:
+        df = _first_html_table(table_html)
+    else:
+        df = pd.read_csv(io.StringIO(csv_text or ""))
+    # Clean and process DataFrame
+    for col in df.columns[1:]:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df.dropna(subset=df.columns[1:], how='all', inplace=True)
+    if df.empty:
+        raise TableDataError("Failed to extract chart data from provided source")
+    # Create chart based on type
+    with _chart_lock:
+        plt.clf()
+        if chart_type == "Grouped Bar":
+            melted = df.melt(id_vars=[df.columns[0]], var_name="Group", value_name="Count")
+            plt.figure(figsize=(10, 6))
+            sns.barplot(data=melted, x=melted.columns[0], y="Count", hue="Group")
+            plt.xticks(rotation=45)
+            plt.title("Grouped Bar Chart")
+            plt.tight_layout()
+        elif chart_type == "Stacked Bar":
+            df_plot = df.set_index(df.columns[0])
+            plt.figure(figsize=(10, 6))
+            df_plot.drop(columns="Total", errors="ignore").plot(kind='bar', stacked=True)
+            plt.title("Stacked Bar Chart")
+            plt.xticks(rotation=45)
+            plt.ylabel("Count")
+            plt.tight_layout()
+        elif chart_type == "Line":
+            df_plot = df.set_index(df.columns[0])
+            plt.figure(figsize=(10, 6))
+            df_plot.drop(columns="Total", errors="ignore").plot(marker='o')
+            plt.title("Line Chart")
+            plt.xticks(rotation=45)
+            plt.ylabel("Count")
+            plt.tight_layout()
+        elif chart_type == "Pie":
+            plt.figure(figsize=(7, 6))
+            label_col = df.columns[0]
+            if "Total" in df.columns:
+                data = df["Total"]
+            else:
+                data = df.iloc[:, 1:].sum(axis=1)
+            plt.pie(data, labels=df[label_col], autopct="%1.1f%%", startangle=140)
+            plt.title("Pie Chart (Total Responses)")
+            plt.tight_layout()
+        # Save chart to bytes
+        buf = io.BytesIO()
+        plt.savefig(buf, format=image_format, bbox_inches="tight")
+        plt.close("all")
+        return buf.getvalue()
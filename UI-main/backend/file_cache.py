@@ -0,0 +1,135 @@
+"""
+Cache of Gemini file-upload handles, keyed by API key and file SHA-256.
+
+Files uploaded to Gemini stay available in the uploading key's project for
+48 hours, so the same image bytes sent again (image summary, follow-up Q&A,
+chart extraction) reuse the earlier upload instead of paying for it again.
+Handles are stored in SQLite next to the other caches so they survive
+restarts, and stop being reused GEMINI_FILE_EXPIRY_MARGIN seconds before the
+service expires them. A handle the service no longer recognises (deleted
+early, key rotated) is dropped and the file is uploaded again.
+
+Tuning (environment variables):
+    GEMINI_FILE_TTL            lifetime assumed when an upload reports none (default 172800)
+    GEMINI_FILE_EXPIRY_MARGIN  seconds before expiry a handle stops being reused (default 3600)
+    GEMINI_FILE_CACHE_DB       SQLite file (default .cache/gemini_files.db)
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import file_types
+
+from cache_db import CACHE_DIR, open_cache_db
+
+GEMINI_FILE_TTL = float(os.getenv("GEMINI_FILE_TTL", str(48 * 3600)))
+GEMINI_FILE_EXPIRY_MARGIN = float(os.getenv("GEMINI_FILE_EXPIRY_MARGIN", "3600"))
+GEMINI_FILE_CACHE_DB = os.getenv("GEMINI_FILE_CACHE_DB", os.path.join(CACHE_DIR, "gemini_files.db"))
+
+# Errors returned when a generate call references a file the key can no longer see
+STALE_FILE_ERRORS = (google_exceptions.NotFound, google_exceptions.PermissionDenied)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def handle_from_file(uploaded) -> Dict:
+    sha = getattr(uploaded, "sha256_hash", None)
+    return {
+        "name": uploaded.name,
+        "uri": uploaded.uri,
+        "mime_type": uploaded.mime_type,
+        "display_name": getattr(uploaded, "display_name", None),
+        "sha256_hash": base64.b64encode(sha).decode() if isinstance(sha, bytes) else sha,
+    }
+
+
+def file_from_handle(handle: Dict):
+    """Rebuild a File usable in generate_content without calling the Files API."""
+    proto = {k: v for k, v in handle.items() if v is not None}
+    if "sha256_hash" in proto:
+        proto["sha256_hash"] = base64.b64decode(proto["sha256_hash"])
+    return file_types.File(proto)
+
+
+def _expires_at(uploaded) -> float:
+    expiration = getattr(uploaded, "expiration_time", None)
+    if expiration is not None and hasattr(expiration, "timestamp"):
+        try:
+            return expiration.timestamp()
+        except (OverflowError, OSError, ValueError):
+            pass
+    return time.time() + GEMINI_FILE_TTL
+
+
+class FileHandleCache:
+    def __init__(self, db_path: str = GEMINI_FILE_CACHE_DB):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._conn = open_cache_db(db_path)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_handles ("
+                "key_name TEXT, sha256 TEXT, name TEXT, handle TEXT, expires_at REAL, "
+                "PRIMARY KEY (key_name, sha256))"
+            )
+            self._conn.commit()
+
+    def find(self, sha256: str, key_names: List[str]) -> Optional[Tuple[str, Dict]]:
+        """Live handle for these bytes on the first of `key_names` that has one."""
+        if not key_names:
+            return None
+        usable_after = time.time() + GEMINI_FILE_EXPIRY_MARGIN
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key_name, handle FROM file_handles WHERE sha256 = ? AND expires_at > ? "
+                f"AND key_name IN ({','.join('?' * len(key_names))})",
+                (sha256, usable_after, *key_names),
+            ).fetchall()
+            found = {key_name: json.loads(handle) for key_name, handle in rows}
+            for key_name in key_names:
+                if key_name in found:
+                    self.hits += 1
+                    return key_name, found[key_name]
+            self.misses += 1
+        return None
+
+    def put(self, key_name: str, sha256: str, uploaded):
+        handle = handle_from_file(uploaded)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_handles (key_name, sha256, name, handle, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key_name, sha256, handle["name"], json.dumps(handle), _expires_at(uploaded)),
+            )
+            self._conn.commit()
+
+    def invalidate(self, name: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM file_handles WHERE name = ?", (name,))
+            self._conn.commit()
+            self.invalidated += 1
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM file_handles WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM file_handles").fetchone()[0]
+            return {"entries": entries, "hits": self.hits, "misses": self.misses, "invalidated": self.invalidated}
+
+
+file_cache = FileHandleCache()
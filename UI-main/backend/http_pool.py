@@ -0,0 +1,98 @@
+"""
+Shared keep-alive HTTP connection pools for all outbound calls.
+
+One requests.Session is kept per scheme+host so repeated calls to the same
+service (Atlassian, AssemblyAI, Google, Slack, ...) reuse TLS connections
+instead of paying a fresh handshake each time.
+
+Tuning (environment variables):
+    HTTP_POOL_MAXSIZE   default connections kept per host (default 20)
+    HTTP_TIMEOUT        default request timeout in seconds (default 60)
+    HTTP_POOL_SIZES     per-host overrides, e.g. "api.assemblyai.com=4,www.googleapis.com=8"
+    HTTP_TIMEOUTS       per-host timeout overrides, same format
+"""
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _parse_host_overrides(raw: str) -> dict:
+    overrides = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        host, value = item.split("=", 1)
+        try:
+            overrides[host.strip().lower()] = float(value)
+        except ValueError:
+            print(f"Ignoring invalid HTTP pool override: {item}")
+    return overrides
+
+
+DEFAULT_POOL_SIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+DEFAULT_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+HOST_POOL_SIZES = _parse_host_overrides(os.getenv("HTTP_POOL_SIZES", ""))
+HOST_TIMEOUTS = _parse_host_overrides(os.getenv("HTTP_TIMEOUTS", ""))
+
+
+class PooledSession(requests.Session):
+    """requests.Session that applies a default timeout to every request."""
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.default_timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.default_timeout)
+        return super().request(method, url, **kwargs)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _host_key(url: str) -> tuple:
+    parts = urlsplit(url)
+    return parts.scheme or "https", (parts.hostname or "").lower()
+
+
+def new_session(url: str) -> PooledSession:
+    """Build a session whose pool and timeout are sized for the host of `url`."""
+    scheme, host = _host_key(url)
+    pool_size = int(HOST_POOL_SIZES.get(host, DEFAULT_POOL_SIZE))
+    session = PooledSession(HOST_TIMEOUTS.get(host, DEFAULT_TIMEOUT))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount(f"{scheme}://", adapter)
+    return session
+
+
+def get_session(url: str) -> PooledSession:
+    """Return the process-wide session for the host of `url`."""
+    key = _host_key(url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = new_session(url)
+                _sessions[key] = session
+    return session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    return get_session(url).request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request("PUT", url, **kwargs)
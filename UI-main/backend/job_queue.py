@@ -0,0 +1,233 @@
+"""
+Background jobs for long pipelines (video summarization).
+
+A POST creates a job and returns its id at once; JOB_WORKERS threads run the
+registered handler while the client polls GET /jobs/{id} or follows
+GET /jobs/{id}/events. Handlers report progress with progress(stage); each
+job records its stages as pending, running, done or skipped.
+
+Jobs live in SQLite, so queued and interrupted jobs are resumed (restarted
+from their first stage) when the server starts again, up to
+JOB_MAX_ATTEMPTS runs. Submitting a job identical to one still queued or
+running (same kind and dedup key) returns the existing job. Finished jobs
+are kept for JOB_RETENTION seconds.
+
+Tuning (environment variables):
+    JOB_WORKERS        jobs run concurrently (default 2)
+    JOB_MAX_ATTEMPTS   runs of a job interrupted by restarts before it fails (default 3)
+    JOB_RETENTION      seconds finished jobs are kept (default 86400)
+    JOB_QUEUE_DB       SQLite file (default .cache/jobs.db)
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache_db import CACHE_DIR, open_cache_db
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", os.path.join(CACHE_DIR, "jobs.db"))
+
+ACTIVE_STATUSES = ("queued", "running")
+JOB_COLUMNS = ("id", "kind", "status", "stages", "payload", "result", "error", "status_code",
+               "attempts", "created_at", "started_at", "finished_at")
+
+
+class JobQueue:
+    def __init__(self, db_path: str = JOB_QUEUE_DB, workers: int = JOB_WORKERS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retention: float = JOB_RETENTION):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._handlers: Dict[str, Tuple[List[str], Callable]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Notified on every job update, for /jobs/{id}/events
+        self._changed = threading.Condition(self._lock)
+        self.deduplicated = 0
+        self._conn = open_cache_db(db_path)
+        with self._lock:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, dedup_key TEXT, status TEXT, stages TEXT, payload TEXT, "
+                "result TEXT, error TEXT, status_code INTEGER, attempts INTEGER DEFAULT 0, "
+                "created_at REAL, started_at REAL, finished_at REAL, updated_at REAL);"
+                "CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (kind, dedup_key, status);"
+            )
+            self._conn.commit()
+
+    def register(self, kind: str, stages: List[str], handler: Callable[[Dict[str, Any], Callable[[str], None]], Any]):
+        """handler(payload, progress) runs a job of this kind; its return value is the job result."""
+        self._handlers[kind] = (stages, handler)
+
+    @staticmethod
+    def _fresh_stages(stages: List[str]) -> str:
+        return json.dumps([{"name": name, "status": "pending", "started_at": None, "finished_at": None}
+                           for name in stages])
+
+    def _update(self, job_id: str, **fields):
+        """Set columns of a job; caller holds self._lock."""
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        self._conn.commit()
+        self._changed.notify_all()
+
+    def _row(self, job_id: str) -> Optional[Dict]:
+        row = self._conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(JOB_COLUMNS, row)) if row else None
+
+    def start(self):
+        """Start the workers and resume jobs left queued or running by the previous process."""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            rows = self._conn.execute(
+                "SELECT id, kind, status, attempts FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                ACTIVE_STATUSES,
+            ).fetchall()
+            resumed = []
+            for job_id, kind, status, attempts in rows:
+                if kind not in self._handlers:
+                    continue
+                if attempts >= self.max_attempts:
+                    self._update(job_id, status="failed", error="Interrupted by server restarts",
+                                 status_code=500, finished_at=time.time())
+                    continue
+                if status == "running":
+                    self._update(job_id, status="queued", stages=self._fresh_stages(self._handlers[kind][0]))
+                resumed.append(job_id)
+        for job_id in resumed:
+            self._executor.submit(self._run, job_id)
+        if resumed:
+            print(f"Job queue: resumed {len(resumed)} jobs")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            # Running jobs are resumed on the next start
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, kind: str, payload: Dict[str, Any], dedup_key: str) -> Tuple[Dict, bool]:
+        """Queue a job, or return the identical job still queued or running. Returns (job, deduplicated)."""
+        self.start()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND dedup_key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                (kind, dedup_key, *ACTIVE_STATUSES),
+            ).fetchone()
+            if row:
+                self.deduplicated += 1
+                return self._describe(self._row(row[0])), True
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, dedup_key, status, stages, payload, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, dedup_key, self._fresh_stages(self._handlers[kind][0]), json.dumps(payload), now, now),
+            )
+            self._conn.commit()
+            job = self._describe(self._row(job_id))
+            executor = self._executor
+        executor.submit(self._run, job_id)
+        return job, False
+
+    def _set_stage(self, job_id: str, stage: str):
+        now = time.time()
+        with self._lock:
+            stages = json.loads(self._row(job_id)["stages"])
+            for entry in stages:
+                if entry["status"] == "running":
+                    entry["status"], entry["finished_at"] = "done", now
+                if entry["name"] == stage:
+                    entry["status"], entry["started_at"] = "running", now
+            self._update(job_id, stages=json.dumps(stages))
+
+    def _finish_stages(self, job_id: str, failed: bool) -> str:
+        now = time.time()
+        stages = json.loads(self._row(job_id)["stages"])
+        for entry in stages:
+            if entry["status"] == "running":
+                entry["status"], entry["finished_at"] = ("failed" if failed else "done"), now
+            elif entry["status"] == "pending" and not failed:
+                entry["status"] = "skipped"
+        return json.dumps(stages)
+
+    def _run(self, job_id: str):
+        with self._lock:
+            job = self._row(job_id)
+            if job is None or job["status"] != "queued":
+                return
+            self._update(job_id, status="running", attempts=job["attempts"] + 1, started_at=time.time())
+        stages, handler = self._handlers[job["kind"]]
+        try:
+            result = handler(json.loads(job["payload"]), lambda stage: self._set_stage(job_id, stage))
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            print(f"Job {job_id} ({job['kind']}) failed: {detail}")
+            with self._lock:
+                self._update(job_id, status="failed", error=str(detail), status_code=getattr(e, "status_code", 500),
+                             stages=self._finish_stages(job_id, True), finished_at=time.time())
+            return
+        with self._lock:
+            self._update(job_id, status="completed", result=json.dumps(result),
+                         stages=self._finish_stages(job_id, False), finished_at=time.time())
+
+    @staticmethod
+    def _describe(job: Dict) -> Dict:
+        stages = json.loads(job["stages"])
+        running = [entry["name"] for entry in stages if entry["status"] == "running"]
+        return {
+            "job_id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "stage": running[0] if running else None,
+            "stages": stages,
+            "attempts": job["attempts"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "result": json.loads(job["result"]) if job["result"] else None,
+            "error": job["error"],
+            "status_code": job["status_code"],
+        }
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._row(job_id)
+        return self._describe(job) if job else None
+
+    def wait_for_change(self, job_id: str, seen: Dict, timeout: float) -> Optional[Dict]:
+        """The job once it differs from `seen` (or after `timeout` seconds)."""
+        deadline = time.time() + timeout
+        with self._lock:
+            while True:
+                job = self._row(job_id)
+                current = self._describe(job) if job else None
+                remaining = deadline - time.time()
+                if current != seen or remaining <= 0:
+                    return current
+                self._changed.wait(remaining)
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND finished_at < ?",
+                (time.time() - self.retention,),
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"workers": self.workers, "jobs": counts, "deduplicated": self.deduplicated}
+
+
+job_queue = JobQueue()
@@ -0,0 +1,186 @@
+"""
+Pool of Gemini API keys with isolated clients and quota-aware routing.
+
+genai.configure() replaces the process-wide client, so concurrent requests
+selecting different keys overwrote each other's key, and all traffic stayed
+on one key until it was rate limited. Each key in the pool instead owns its
+own set of clients (google.generativeai has no public per-client API, so one
+_ClientManager is configured per key), and every Gemini call leases a key:
+
+- each key has a token bucket sized to its requests-per-minute quota;
+- the key selected in the UI (x-api-key identifier) is used while it has
+  budget, otherwise the call goes to the least-loaded key (fewest calls in
+  flight, most budget left);
+- a key that answered 429 is skipped until its cooldown expires;
+- when every key is exhausted the call waits for the next token, at most
+  GEMINI_KEY_MAX_WAIT seconds, then goes to the key that recovers first.
+
+Keys are read from GENAI_API_KEY_1..N.
+
+Tuning (environment variables):
+    GEMINI_KEY_RPM        requests per minute allowed per key (default 15)
+    GEMINI_KEY_COOLDOWN   seconds a key is skipped after a 429 (default 60)
+    GEMINI_KEY_MAX_WAIT   longest wait for a key with budget (default 30)
+"""
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import client as genai_client
+from google.generativeai.types import file_types
+
+GEMINI_KEY_RPM = float(os.getenv("GEMINI_KEY_RPM", "15"))
+GEMINI_KEY_COOLDOWN = float(os.getenv("GEMINI_KEY_COOLDOWN", "60"))
+GEMINI_KEY_MAX_WAIT = float(os.getenv("GEMINI_KEY_MAX_WAIT", "30"))
+
+KEY_ENV_PATTERN = re.compile(r"^GENAI_API_KEY_(\d+)$")
+
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    return isinstance(exc, google_exceptions.ResourceExhausted) or getattr(exc, "code", None) == 429
+
+
+class KeyState:
+    def __init__(self, name: str, api_key: str, rpm: float):
+        self.name = name
+        self.api_key = api_key
+        self.capacity = rpm
+        self.tokens = rpm
+        self.refill_rate = rpm / 60.0
+        self.updated_at = time.monotonic()
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.rate_limited = 0
+        self._manager = None
+        self._manager_lock = threading.Lock()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until and self.tokens >= 1
+
+    def seconds_until_available(self, now: float) -> float:
+        wait = max(0.0, self.cooldown_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.refill_rate)
+        return wait
+
+    def client(self, kind: str = "generative"):
+        """Client of the given kind ("generative", "file", ...) bound to this key only."""
+        with self._manager_lock:
+            if self._manager is None:
+                manager = genai_client._ClientManager()
+                manager.configure(api_key=self.api_key)
+                self._manager = manager
+            return self._manager.get_default_client(kind)
+
+    def upload_file(self, path: str, mime_type: Optional[str] = None, display_name: Optional[str] = None):
+        response = self.client("file").create_file(path=path, mime_type=mime_type, display_name=display_name)
+        return file_types.File(response)
+
+
+class KeyPool:
+    def __init__(self, keys: Dict[str, str], rpm: float = GEMINI_KEY_RPM,
+                 cooldown: float = GEMINI_KEY_COOLDOWN, max_wait: float = GEMINI_KEY_MAX_WAIT):
+        self.keys: List[KeyState] = [KeyState(name, value, rpm) for name, value in keys.items()]
+        self.by_name = {k.name: k for k in self.keys}
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls) -> "KeyPool":
+        found = []
+        for name, value in os.environ.items():
+            match = KEY_ENV_PATTERN.match(name)
+            if match and value:
+                found.append((int(match.group(1)), name, value))
+        return cls({name: value for _, name, value in sorted(found)})
+
+    def _pick(self, now: float, preferred: Optional[str], candidates: List[KeyState]) -> Optional[KeyState]:
+        preferred_key = self.by_name.get(preferred) if preferred else None
+        if preferred_key in candidates and preferred_key.available(now):
+            return preferred_key
+        available = [k for k in candidates if k.available(now)]
+        if not available:
+            return None
+        return min(available, key=lambda k: (k.in_flight, -k.tokens))
+
+    def acquire(self, preferred: Optional[str] = None, strict: bool = False,
+                exclude: Optional[Set[str]] = None) -> KeyState:
+        """Lease a key.
+
+        `strict` waits for `preferred` itself (e.g. files uploaded with it);
+        `exclude` names keys to avoid (already tried, circuit open) unless no other key is left.
+        """
+        if not self.keys:
+            raise RuntimeError("No Gemini API keys configured (GENAI_API_KEY_1..N)")
+        if strict and preferred in self.by_name:
+            candidates = [self.by_name[preferred]]
+        else:
+            candidates = [k for k in self.keys if k.name not in (exclude or ())] or self.keys
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                for k in self.keys:
+                    k.refill(now)
+                key = self._pick(now, preferred, candidates)
+                if key is None and now >= deadline:
+                    # Out of budget everywhere: let the key that recovers first take the call
+                    key = min(candidates, key=lambda k: k.seconds_until_available(now))
+                if key is not None:
+                    key.tokens -= 1
+                    key.in_flight += 1
+                    key.requests += 1
+                    return key
+                wait = min(k.seconds_until_available(now) for k in candidates)
+                self._cond.wait(max(0.05, min(wait, deadline - now)))
+
+    def release(self, key: KeyState, rate_limited: bool = False):
+        with self._cond:
+            key.in_flight -= 1
+            if rate_limited:
+                key.rate_limited += 1
+                key.tokens = 0
+                key.cooldown_until = time.monotonic() + self.cooldown
+            self._cond.notify_all()
+
+    @contextmanager
+    def lease(self, preferred: Optional[str] = None, strict: bool = False, exclude: Optional[Set[str]] = None):
+        key = self.acquire(preferred, strict, exclude)
+        rate_limited = False
+        try:
+            yield key
+        except Exception as e:
+            rate_limited = is_rate_limit_error(e)
+            raise
+        finally:
+            # Also runs when a streaming consumer goes away mid-stream (GeneratorExit)
+            self.release(key, rate_limited)
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._cond:
+            for k in self.keys:
+                k.refill(now)
+            return {
+                k.name: {
+                    "tokens": round(k.tokens, 2),
+                    "in_flight": k.in_flight,
+                    "requests": k.requests,
+                    "rate_limited": k.rate_limited,
+                    "cooling_down": now < k.cooldown_until,
+                }
+                for k in self.keys
+            }
+
+
+key_pool = KeyPool.from_env()
@@ -0,0 +1,207 @@
+"""
+BM25 inverted index over the cleaned text of every page in a space.
+
+Lets /search answer over a whole space without hand-picked page_titles and
+lets /analyze-goal shortlist pages for a goal. Each page version is tokenized
+once (title terms count LEXICAL_TITLE_WEIGHT times) and its term counts are
+stored in SQLite, so after a restart only pages whose version changed are
+fetched and tokenized again. The in-memory postings of a space are brought up
+to date against the page index whenever it has been reloaded: new and edited
+pages are (re)indexed, deleted pages dropped. A lookup only walks the
+postings of the query terms, which takes milliseconds for thousands of pages.
+
+Tuning (environment variables):
+    LEXICAL_INDEX_DB       SQLite file with per-version term counts (default .cache/lexical_index.db)
+    LEXICAL_TITLE_WEIGHT   times title terms are counted (default 3)
+    BM25_K1                term frequency saturation (default 1.2)
+    BM25_B                 document length normalization (default 0.75)
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cache_db import CACHE_DIR, open_cache_db
+from page_cache import page_cache
+from page_index import page_index
+
+LEXICAL_INDEX_DB = os.getenv("LEXICAL_INDEX_DB", os.path.join(CACHE_DIR, "lexical_index.db"))
+LEXICAL_TITLE_WEIGHT = int(os.getenv("LEXICAL_TITLE_WEIGHT", "3"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9_]+")
+STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "had", "her", "was", "one",
+    "our", "out", "has", "have", "how", "its", "may", "who", "did", "yes", "this", "that", "with",
+    "from", "they", "will", "would", "there", "their", "what", "about", "which", "when", "your",
+    "into", "than", "then", "them", "these", "those", "been", "were", "also", "is", "it", "in",
+    "on", "of", "to", "be", "as", "at", "by", "or", "an", "if", "do", "so", "we", "me", "my",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class SpaceLexicalIndex:
+    def __init__(self, space_key: str):
+        self.space_key = space_key
+        self.pages: Dict[str, Dict] = {}
+        self.lengths: Dict[str, int] = {}
+        self.page_terms: Dict[str, List[str]] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+        self.synced_index = None
+
+    def add(self, page: Dict, terms: Dict[str, int]):
+        page_id = str(page["id"])
+        self.remove(page_id)
+        self.pages[page_id] = page
+        length = sum(terms.values())
+        self.lengths[page_id] = length
+        self.page_terms[page_id] = list(terms)
+        self.total_length += length
+        for term, count in terms.items():
+            self.postings.setdefault(term, {})[page_id] = count
+
+    def remove(self, page_id: str):
+        if page_id not in self.pages:
+            return
+        del self.pages[page_id]
+        self.total_length -= self.lengths.pop(page_id)
+        for term in self.page_terms.pop(page_id):
+            docs = self.postings[term]
+            del docs[page_id]
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query: str, top_n: int, only: Optional[Iterable[str]] = None) -> List[Tuple[Dict, float]]:
+        if not self.pages:
+            return []
+        allowed = {str(p) for p in only} if only is not None else None
+        avg_length = self.total_length / len(self.pages) or 1
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (len(self.pages) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for page_id, tf in docs.items():
+                if allowed is not None and page_id not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[page_id] / avg_length)
+                scores[page_id] = scores.get(page_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: -item[1])[:top_n]
+        return [(self.pages[page_id], score) for page_id, score in best]
+
+
+class LexicalIndex:
+    def __init__(self, db_path: str = LEXICAL_INDEX_DB):
+        self._spaces: Dict[str, SpaceLexicalIndex] = {}
+        self._lock = threading.Lock()
+        self._space_locks: Dict[str, threading.Lock] = {}
+        self._db_lock = threading.Lock()
+        self.indexed_pages = 0
+        self.queries = 0
+        self._conn = open_cache_db(db_path)
+        with self._db_lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS page_terms ("
+                "page_id TEXT PRIMARY KEY, version INTEGER, terms TEXT)"
+            )
+            self._conn.commit()
+
+    def _space_lock(self, space_key: str) -> threading.Lock:
+        with self._lock:
+            return self._space_locks.setdefault(space_key, threading.Lock())
+
+    def _stored_terms(self, page_ids: List[str]) -> Dict[str, Tuple[Optional[int], Dict[str, int]]]:
+        stored = {}
+        with self._db_lock:
+            for i in range(0, len(page_ids), 500):
+                chunk = page_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT page_id, version, terms FROM page_terms WHERE page_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                stored.update({page_id: (version, json.loads(terms)) for page_id, version, terms in rows})
+        return stored
+
+    def _page_terms(self, confluence, page: Dict) -> Dict[str, int]:
+        text = page_cache.get_text(confluence, page["id"], page.get("version"))
+        terms = Counter(tokenize(text))
+        for term in tokenize(page["title"]):
+            terms[term] += LEXICAL_TITLE_WEIGHT
+        return dict(terms)
+
+    def sync(self, confluence, space_key: str) -> SpaceLexicalIndex:
+        """Bring the space's postings up to date with its page index."""
+        current = page_index.get(confluence, space_key)
+        with self._lock:
+            index = self._spaces.get(space_key)
+        if index is not None and index.synced_index is current:
+            return index
+        with self._space_lock(space_key):
+            with self._lock:
+                index = self._spaces.setdefault(space_key, SpaceLexicalIndex(space_key))
+            if index.synced_index is current:
+                return index
+            started = time.time()
+            live = {str(p["id"]): p for p in current.pages}
+            for page_id in [p for p in index.pages if p not in live]:
+                index.remove(page_id)
+            changed = [p for page_id, p in live.items()
+                       if page_id not in index.pages or index.pages[page_id].get("version") != p.get("version")]
+            stored = self._stored_terms([str(p["id"]) for p in changed])
+            missing = [p for p in changed
+                       if str(p["id"]) not in stored or stored[str(p["id"])][0] != p.get("version")]
+            if missing:
+                # Bodies not yet cached come in CQL batches (or from the mirror)
+                page_cache.prefetch_storage(confluence, missing)
+            fresh = []
+            for page in changed:
+                page_id = str(page["id"])
+                if page_id in stored and stored[page_id][0] == page.get("version"):
+                    terms = stored[page_id][1]
+                else:
+                    try:
+                        terms = self._page_terms(confluence, page)
+                    except Exception as e:
+                        print(f"Lexical indexing skipped page {page_id}: {e}")
+                        continue
+                    fresh.append((page_id, page.get("version"), json.dumps(terms)))
+                index.add(page, terms)
+            if fresh:
+                with self._db_lock:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO page_terms (page_id, version, terms) VALUES (?, ?, ?)", fresh
+                    )
+                    self._conn.commit()
+            self.indexed_pages += len(fresh)
+            index.synced_index = current
+            if changed:
+                print(f"Lexical index {space_key}: {len(changed)} pages updated "
+                      f"({len(fresh)} tokenized) in {time.time() - started:.2f}s")
+            return index
+
+    def search(self, confluence, space_key: str, query: str, top_n: int = 10,
+               only: Optional[Iterable[str]] = None) -> List[Tuple[Dict, float]]:
+        """Best (page, BM25 score) matches in a space, optionally restricted to page ids in `only`."""
+        index = self.sync(confluence, space_key)
+        self.queries += 1
+        # Postings are only mutated under the space lock
+        with self._space_lock(space_key):
+            return index.search(query, top_n, only)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            spaces = {key: {"pages": len(i.pages), "terms": len(i.postings)} for key, i in self._spaces.items()}
+        return {"spaces": spaces, "indexed_pages": self.indexed_pages, "queries": self.queries}
+
+
+lexical_index = LexicalIndex()
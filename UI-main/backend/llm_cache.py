@@ -0,0 +1,443 @@
+"""
+Persistent response cache for Gemini generate_content calls.
+
+CachedModel wraps genai.GenerativeModel; identical requests (same model,
+same normalized prompt, same input parts and generation settings) are
+answered from an in-memory LRU tier or, across restarts, from a SQLite disk
+tier instead of calling Gemini again. Only successful text responses are
+stored. generate_content(stream=True) always goes to the model; stream_text()
+streams fresh generations chunk by chunk (storing the joined text once the
+stream completes) and replays cached answers in one piece.
+
+Configuration (environment variables):
+    LLM_CACHE_ENABLED             "0" disables the cache entirely (default "1")
+    LLM_CACHE_TTL                 seconds an answer stays valid (default 86400)
+    LLM_CACHE_MEMORY_ENTRIES      size of the in-memory tier (default 512)
+    LLM_CACHE_DB                  SQLite file for the disk tier (default .cache/llm_cache.db)
+    LLM_CACHE_DISABLED_ENDPOINTS  comma-separated endpoint names that bypass the cache
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import google.generativeai as genai
+
+from cache_db import CACHE_DIR, open_cache_db
+from file_cache import STALE_FILE_ERRORS, file_cache, file_from_handle, file_sha256
+from key_pool import KeyPool, KeyState, key_pool
+from prompt_budget import estimate_tokens, token_usage
+from resilience import (
+    GEMINI_HEDGE_ENABLED, GEMINI_MAX_RETRIES, GeminiUnavailableError, ProbeInFlightError,
+    backoff_delay, breakers, is_retryable, latencies,
+)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", os.path.join(CACHE_DIR, "llm_cache.db"))
+LLM_CACHE_DISABLED_ENDPOINTS = {
+    e.strip() for e in os.getenv("LLM_CACHE_DISABLED_ENDPOINTS", "").split(",") if e.strip()
+}
+
+
+class CachedPart:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class CachedResponse:
+    """Minimal stand-in for a GenerateContentResponse served from the cache."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.parts = [CachedPart(text)]
+        self.from_cache = True
+
+
+def normalize_prompt(text: str) -> str:
+    lines = text.replace("\r\n", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def _part_fingerprint(part: Any) -> Any:
+    if isinstance(part, str):
+        return normalize_prompt(part)
+    if isinstance(part, bytes):
+        return {"bytes": hashlib.sha256(part).hexdigest()}
+    if isinstance(part, dict):
+        data = part.get("data")
+        if isinstance(data, (bytes, bytearray)):
+            return {"mime_type": part.get("mime_type"), "bytes": hashlib.sha256(data).hexdigest()}
+        return {k: _part_fingerprint(v) for k, v in sorted(part.items())}
+    if isinstance(part, (list, tuple)):
+        return [_part_fingerprint(p) for p in part]
+    # Uploaded files: prefer the content hash over the per-upload name
+    sha = getattr(part, "sha256_hash", None)
+    if sha:
+        return {"file_sha256": base64.b64encode(sha).decode() if isinstance(sha, bytes) else str(sha)}
+    uri = getattr(part, "uri", None) or getattr(part, "name", None)
+    return {"file": str(uri) if uri else repr(part)}
+
+
+def _prompt_text(contents: Any) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_prompt_text(c) for c in contents)
+    return ""
+
+
+def cache_key(model_name: str, contents: Any, settings: Dict) -> str:
+    payload = {
+        "model": model_name,
+        "contents": _part_fingerprint(contents),
+        # request_options (timeouts, retries) do not change the answer
+        "settings": {k: repr(v) for k, v in sorted(settings.items()) if k != "request_options"},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, db_path: str = LLM_CACHE_DB, ttl: float = LLM_CACHE_TTL,
+                 memory_entries: int = LLM_CACHE_MEMORY_ENTRIES):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._conn = open_cache_db(db_path)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, model TEXT, endpoint TEXT, response TEXT, created_at REAL)"
+            )
+            self._conn.commit()
+
+    def _count(self, endpoint: str, counter: str):
+        with self._lock:
+            stats = self.counters.setdefault(endpoint, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0})
+            stats[counter] += 1
+
+    def get(self, key: str, endpoint: str) -> Optional[str]:
+        now = time.time()
+        text, tier = None, "misses"
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None and now - item[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                text, tier = item[0], "memory_hits"
+            else:
+                row = self._conn.execute(
+                    "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self._remember(key, row[0], row[1])
+                    text, tier = row[0], "disk_hits"
+        self._count(endpoint, tier)
+        return text
+
+    def _remember(self, key: str, text: str, created_at: float):
+        self._memory[key] = (text, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key: str, text: str, model_name: str, endpoint: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, text, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, endpoint, response, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, endpoint, text, now),
+            )
+            self._conn.commit()
+
+    def bypass(self, endpoint: str):
+        self._count(endpoint, "bypassed")
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            totals = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0}
+            for stats in self.counters.values():
+                for k, v in stats.items():
+                    totals[k] += v
+            return {
+                "enabled": LLM_CACHE_ENABLED,
+                "memory_entries": len(self._memory),
+                "totals": totals,
+                "endpoints": {k: dict(v) for k, v in self.counters.items()},
+            }
+
+
+llm_cache = LLMCache()
+
+# Runs hedged attempts; the caller's thread only waits on the futures
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="gemini-hedge")
+
+
+class CachedModel:
+    """genai.GenerativeModel wrapper that serves repeated requests from llm_cache.
+
+    Calls that reach Gemini lease a key from the key pool and run on that
+    key's own client; `preferred_key` is the x-api-key identifier chosen in
+    the UI. Once a file has been uploaded through upload_file() the model is
+    pinned to the uploading key, since files are only visible to that key;
+    uploads of bytes already sent to Gemini reuse the cached file handle.
+    Transient failures are retried on other keys with backoff, guarded by
+    per key/model circuit breakers, and optionally hedged (see resilience).
+    With `cached_content` set, calls run against that Gemini cached content
+    (see context_cache); like files, it is only visible to its own key.
+    """
+
+    def __init__(self, model_name: str, endpoint: str, cache: LLMCache = llm_cache,
+                 pool: KeyPool = key_pool, preferred_key: Optional[str] = None,
+                 cached_content: Optional[str] = None, **model_kwargs):
+        self.model_name = model_name
+        self.endpoint = endpoint
+        self.cache = cache
+        self.pool = pool
+        self.preferred_key = preferred_key
+        self.pinned_key: Optional[str] = None
+        self.cached_content = cached_content
+        self.model_settings = model_kwargs
+        # Answers over a cached context depend on that context, so it is part of the cache key
+        self.key_settings = {**model_kwargs, "cached_content": cached_content} if cached_content else model_kwargs
+        self.use_cache = LLM_CACHE_ENABLED and endpoint not in LLM_CACHE_DISABLED_ENDPOINTS
+        self._models: Dict[str, Any] = {}
+        self._models_lock = threading.Lock()
+        # Uploaded file name -> upload_file() arguments, to re-upload stale handles
+        self._uploads: Dict[str, tuple] = {}
+
+    def _model_for(self, key: KeyState):
+        with self._models_lock:
+            model = self._models.get(key.name)
+            if model is None:
+                model = genai.GenerativeModel(self.model_name, **self.model_settings)
+                # Bind the model to this key's client instead of the process-wide default
+                model._client = key.client("generative")
+                if self.cached_content:
+                    model._cached_content = self.cached_content
+                self._models[key.name] = model
+            return model
+
+    def _lease(self, tried: List[str] = ()):
+        if self.pinned_key:
+            return self.pool.lease(self.pinned_key, strict=True)
+        exclude = set(tried) | breakers.open_keys(self.model_name)
+        return self.pool.lease(self.preferred_key, exclude=exclude)
+
+    @contextmanager
+    def _attempt(self, tried: List[str], track_latency: bool = True):
+        """Lease a key for one attempt, feeding the outcome to its circuit breaker."""
+        with self._lease(tried) as key:
+            tried.append(key.name)
+            breaker = breakers.get(key.name, self.model_name)
+            admission = breaker.allow_request()
+            if admission is None:
+                # Picked before another call took this key's half-open probe
+                raise ProbeInFlightError(f"Circuit for {key.name}/{self.model_name} is being probed")
+            started = time.monotonic()
+            try:
+                yield key
+            except Exception as e:
+                if is_retryable(e):
+                    breaker.record_failure()
+                raise
+            else:
+                breaker.record_success()
+                if track_latency:
+                    latencies.record(self.model_name, time.monotonic() - started)
+            finally:
+                if admission == "probe":
+                    breaker.release_probe()
+
+    def _record_usage(self, contents, usage_metadata):
+        token_usage.record(self.endpoint, usage_metadata, estimate_tokens(_prompt_text(contents)))
+
+    def _check_breakers(self):
+        names = [self.pinned_key] if self.pinned_key else [k.name for k in self.pool.keys]
+        open_breakers = [breakers.get(n, self.model_name) for n in names]
+        if open_breakers and all(b.is_open() for b in open_breakers):
+            raise GeminiUnavailableError(
+                f"Gemini is unavailable for {self.model_name} (circuit open on every key)",
+                retry_after=min(b.retry_after() for b in open_breakers)
+            )
+
+    def _with_retries(self, call):
+        tried: List[str] = []
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            self._check_breakers()
+            try:
+                return call(tried)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt == GEMINI_MAX_RETRIES:
+                    raise GeminiUnavailableError(f"Gemini request failed after {attempt + 1} attempts: {e}") from e
+                delay = backoff_delay(attempt)
+                print(f"Gemini call for {self.endpoint} failed ({e}); retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _call_once(self, contents, kwargs, tried: List[str]):
+        with self._attempt(tried, track_latency=not kwargs.get("stream")) as key:
+            return self._model_for(key).generate_content(contents, **kwargs)
+
+    def _call_hedged(self, contents, kwargs, tried: List[str]):
+        primary = _hedge_executor.submit(self._call_once, contents, kwargs, tried)
+        try:
+            return primary.result(timeout=latencies.hedge_delay(self.model_name))
+        except FuturesTimeout:
+            pass
+        # `tried` already holds the primary's key, so the hedge goes to another one
+        hedge = _hedge_executor.submit(self._call_once, contents, kwargs, tried)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        first = done.pop()
+        if first.exception() is None:
+            return first.result()
+        other = hedge if first is primary else primary
+        try:
+            return other.result()
+        except Exception:
+            raise first.exception()
+
+    def _generate(self, contents, **kwargs):
+        hedge = (GEMINI_HEDGE_ENABLED and not kwargs.get("stream") and not self.pinned_key
+                 and len(self.pool.keys) > 1)
+        call = self._call_hedged if hedge else self._call_once
+        try:
+            response = self._with_retries(lambda tried: call(contents, kwargs, tried))
+        except STALE_FILE_ERRORS:
+            refreshed = self._reupload_files(contents)
+            if refreshed is None:
+                raise
+            contents = refreshed
+            response = self._with_retries(lambda tried: call(contents, kwargs, tried))
+        if not kwargs.get("stream"):
+            self._record_usage(contents, getattr(response, "usage_metadata", None))
+        return response
+
+    def upload_file(self, path: str, mime_type: Optional[str] = None, display_name: Optional[str] = None,
+                    reuse: bool = True):
+        """Upload a file for this model's calls, reusing a live upload of the same bytes if there is one."""
+        digest = file_sha256(path)
+        if self.pinned_key:
+            key_names = [self.pinned_key]
+        else:
+            key_names = [k.name for k in self.pool.keys]
+            if self.preferred_key in key_names:
+                key_names.remove(self.preferred_key)
+                key_names.insert(0, self.preferred_key)
+        found = file_cache.find(digest, key_names) if reuse else None
+        if found is not None:
+            key_name, handle = found
+            uploaded = file_from_handle(handle)
+        else:
+            with self._lease() as key:
+                uploaded = key.upload_file(path, mime_type=mime_type, display_name=display_name)
+            key_name = key.name
+            file_cache.put(key_name, digest, uploaded)
+        self.pinned_key = key_name
+        self._uploads[uploaded.name] = (path, mime_type, display_name)
+        return uploaded
+
+    def _reupload_files(self, contents):
+        """Replace cached file handles the service rejected with fresh uploads; None if there were none."""
+        if not isinstance(contents, (list, tuple)):
+            return None
+        stale = [p for p in contents if getattr(p, "name", None) in self._uploads]
+        if not stale:
+            return None
+        replaced = {}
+        for part in stale:
+            print(f"Gemini file {part.name} is no longer available, uploading it again")
+            file_cache.invalidate(part.name)
+            path, mime_type, display_name = self._uploads.pop(part.name)
+            replaced[id(part)] = self.upload_file(path, mime_type, display_name, reuse=False)
+        return [replaced.get(id(p), p) for p in contents]
+
+    def generate_content(self, contents, **kwargs):
+        if not self.use_cache or kwargs.get("stream"):
+            self.cache.bypass(self.endpoint)
+            return self._generate(contents, **kwargs)
+        key = cache_key(self.model_name, contents, {**self.key_settings, **kwargs})
+        text = self.cache.get(key, self.endpoint)
+        if text is not None:
+            return CachedResponse(text)
+        response = self._generate(contents, **kwargs)
+        try:
+            text = response.text
+        except Exception:
+            # Blocked or empty responses are not cached
+            return response
+        if text:
+            self.cache.put(key, text, self.model_name, self.endpoint)
+        return response
+
+    def stream_text(self, contents, **kwargs) -> Iterator[str]:
+        """Yield the response text as Gemini streams it; cached answers are yielded whole."""
+        key = None
+        if self.use_cache:
+            # Same key as generate_content, so streamed and blocking calls share entries
+            key = cache_key(self.model_name, contents, {**self.key_settings, **kwargs})
+            text = self.cache.get(key, self.endpoint)
+            if text is not None:
+                yield text
+                return
+        else:
+            self.cache.bypass(self.endpoint)
+        parts = []
+        usage_metadata = None
+        tried: List[str] = []
+        attempt = 0
+        while True:
+            self._check_breakers()
+            try:
+                with self._attempt(tried, track_latency=False) as api_key:
+                    for chunk in self._model_for(api_key).generate_content(contents, stream=True, **kwargs):
+                        # Usage totals arrive with the final chunks
+                        usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+                        try:
+                            piece = chunk.text
+                        except Exception:
+                            # Chunks carrying only safety/finish metadata have no text
+                            continue
+                        if piece:
+                            parts.append(piece)
+                            yield piece
+                break
+            except Exception as e:
+                # Once text has reached the client the stream cannot be replayed
+                if parts or not is_retryable(e):
+                    raise
+                if attempt == GEMINI_MAX_RETRIES:
+                    raise GeminiUnavailableError(f"Gemini request failed after {attempt + 1} attempts: {e}") from e
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+        self._record_usage(contents, usage_metadata)
+        if key and parts:
+            self.cache.put(key, "".join(parts), self.model_name, self.endpoint)
+
+    def with_cached_content(self, model_name: str, cached_content: str, key_name: str) -> "CachedModel":
+        """Model for the same endpoint answering over Gemini cached content held by `key_name`."""
+        model = CachedModel(model_name, self.endpoint, cache=self.cache, pool=self.pool,
+                            preferred_key=key_name, cached_content=cached_content)
+        model.pinned_key = key_name
+        return model
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        key = self.pool.by_name.get(self.pinned_key or self.preferred_key) or self.pool.keys[0]
+        return getattr(self._model_for(key), name)
@@ -4,25 +4,47 @@ import re
 import csv
 import json
 import time
+import threading
 import traceback
 import warnings
-import requests
-from typing import List, Optional, Dict, Any
+import anyio
+from typing import Callable, List, Optional, Dict, Any
 from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from fpdf import FPDF
 from docx import Document
 from dotenv import load_dotenv
+# Loaded before the local modules below, which read their settings at import time
+load_dotenv()
 from atlassian import Confluence
 import google.generativeai as genai
-from bs4 import BeautifulSoup
 from io import BytesIO
-import difflib
 import base64
-
-# Load environment variables
-load_dotenv()
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+import http_pool
+from page_index import page_index
+from page_cache import page_cache
+from confluence_mirror import mirror, MirrorSyncer, MIRROR_SPACES, is_valid_space_key
+from page_classifier import page_types, extract_code_or_text
+from page_parse import parse_page, page_parser
+from cpu_pool import cpu_pool
+import cpu_tasks
+from attachment_cache import attachment_cache, AttachmentDownloadError
+from llm_cache import CachedModel, llm_cache
+from file_cache import file_cache
+from key_pool import key_pool
+from resilience import GeminiUnavailableError, breakers, is_retryable, latencies
+from context_cache import context_sessions, format_documents
+from vector_index import vector_index, retrieve_documents
+from lexical_index import lexical_index
+from web_cache import web_search_cache
+from answer_cache import answer_cache, scope_key
+from transcript_cache import transcript_cache
+from job_queue import job_queue
+from prompt_budget import budget_for, estimate_tokens, fit_diff, fit_documents, fit_relevant, fit_spread, query_coverage, truncate_to_tokens, token_usage
+from sse import sse_event, sse_response, stream_section
 
 app = FastAPI(title="Confluence AI Assistant API")
 
@@ -46,13 +68,102 @@ GEMINI_API_KEY = os.getenv("GENAI_API_KEY_1") or os.getenv("GENAI_API_KEY_2")
 if not GEMINI_API_KEY:
     raise ValueError("No Gemini API key found in environment variables. Please set GENAI_API_KEY_1 or GENAI_API_KEY_2 in your .env file.")
 
-# Configure Gemini AI
+# Default client for library paths outside the key pool; Gemini calls made
+# through get_ai_model() use per-key clients from key_pool instead
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Concurrency model: endpoints that talk to Confluence, Gemini, AssemblyAI etc.
+# are plain `def` handlers, so FastAPI runs them on its worker thread pool
+# instead of the event loop. The pool size bounds how many blocking requests
+# a single worker serves at once.
+API_THREADPOOL_SIZE = int(os.getenv("API_THREADPOOL_SIZE", "64"))
+
+# Max concurrent upstream calls fanned out by a single request
+ANALYZER_FANOUT = int(os.getenv("ANALYZER_FANOUT", "5"))
+
+# Pages picked by the lexical index when /search gets no page_titles, and
+# page titles offered to Gemini by /analyze-goal
+SEARCH_SPACE_PAGES = int(os.getenv("SEARCH_SPACE_PAGES", "8"))
+ANALYZE_GOAL_SHORTLIST = int(os.getenv("ANALYZE_GOAL_SHORTLIST", "40"))
+
+# hybrid_rag web fallback: Google search timeout, hard latency budget of the
+# whole fallback, and the share of question terms found in the page context
+# below which /search starts the web lookup alongside its first answer
+WEB_SEARCH_TIMEOUT = float(os.getenv("WEB_SEARCH_TIMEOUT", "5"))
+HYBRID_RAG_BUDGET = float(os.getenv("HYBRID_RAG_BUDGET", "15"))
+WEB_SPECULATE_COVERAGE = float(os.getenv("WEB_SPECULATE_COVERAGE", "0.5"))
+# Reply /search/stream asks for when neither the pages nor Gemini can answer
+SEARCH_NO_ANSWER = "CANNOT_ANSWER"
+_web_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="web-search")
+
+@app.on_event("startup")
+async def configure_threadpool():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = API_THREADPOOL_SIZE
+
+# Diffs, large page parses, pandas and matplotlib run on warm worker processes
+@app.on_event("startup")
+async def start_cpu_pool():
+    cpu_pool.start()
+
+@app.on_event("shutdown")
+async def stop_cpu_pool():
+    cpu_pool.shutdown()
+
+# Local SQLite mirror of Confluence (enabled by CONFLUENCE_MIRROR_SPACES)
+mirror_syncer = None
+
+@app.on_event("startup")
+async def start_confluence_mirror():
+    global mirror_syncer
+    if mirror is None:
+        return
+    page_index.set_store(mirror)
+    page_cache.set_store(mirror)
+    page_types.set_store(mirror)
+    mirror_syncer = MirrorSyncer(mirror, init_confluence, MIRROR_SPACES)
+    mirror_syncer.start()
+
+GEMINI_MODEL_NAME = "models/gemini-1.5-flash-8b-latest"
+
+def get_ai_model(endpoint: str, req: Optional[Request] = None, preferred_key: Optional[str] = None) -> CachedModel:
+    """
+    Gemini model for an endpoint; repeated identical prompts are served from llm_cache.
+    Calls are routed over the key pool, preferring the key selected with the x-api-key header
+    (or `preferred_key`, for background jobs).
+    """
+    if req is not None:
+        preferred_key = req.headers.get('x-api-key')
+    return CachedModel(GEMINI_MODEL_NAME, endpoint=endpoint, preferred_key=preferred_key)
+
+@app.on_event("startup")
+async def purge_llm_cache():
+    llm_cache.purge_expired()
+    file_cache.purge_expired()
+    web_search_cache.purge_expired()
+    answer_cache.purge_expired()
+    job_queue.purge_expired()
+
+def gemini_unavailable_headers(e: GeminiUnavailableError) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, int(round(e.retry_after))))}
+
+def to_http_exception(e: Exception) -> HTTPException:
+    """Map an endpoint failure to its HTTP error: Gemini overload is a 503, HTTP errors pass through"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, GeminiUnavailableError):
+        return HTTPException(status_code=503, detail=str(e), headers=gemini_unavailable_headers(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+@app.exception_handler(GeminiUnavailableError)
+async def gemini_unavailable_handler(request: Request, exc: GeminiUnavailableError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers=gemini_unavailable_headers(exc))
+
 # Pydantic models for request/response
 class SearchRequest(BaseModel):
     space_key: str
-    page_titles: List[str]
+    # Omitted or empty: the space's best lexical matches for the query are used
+    page_titles: Optional[List[str]] = None
     query: str
 
 class VideoRequest(BaseModel):
@@ -73,12 +184,14 @@ class ImpactRequest(BaseModel):
     new_page_title: str
     question: Optional[str] = None
     enable_stack_overflow_check: Optional[bool] = True
+    structured_output: Optional[bool] = False
 
 class DirectCodeImpactRequest(BaseModel):
     old_code: str
     new_code: str
     question: Optional[str] = None
     enable_stack_overflow_check: Optional[bool] = True
+    structured_output: Optional[bool] = False
 
 class PushToJiraConfluenceSlackRequest(BaseModel):
     summary: str
@@ -136,6 +249,8 @@ class PreviewSaveToConfluenceResponse(BaseModel):
 class AnalyzeGoalRequest(BaseModel):
     goal: str
     available_pages: list[str]
+    # With a space key, pages are shortlisted against the goal by the lexical index
+    space_key: Optional[str] = None
 
 class AnalyzeGoalResponse(BaseModel):
     tools: list[str]
@@ -165,19 +280,38 @@ def remove_emojis(text):
     return no_emoji.encode('latin-1', 'ignore').decode('latin-1')
 
 def clean_html(html_content):
-    soup = BeautifulSoup(html_content, "html.parser")
-    return soup.get_text(separator="\n")
+    return parse_page(html_content).text
+
+_confluence_client = None
+_confluence_lock = threading.Lock()
 
 def init_confluence():
+    """Return the process-wide Confluence client (one keep-alive session)."""
+    global _confluence_client
+    if _confluence_client is not None:
+        return _confluence_client
+    with _confluence_lock:
+        if _confluence_client is None:
+            try:
+                base_url = os.getenv('CONFLUENCE_BASE_URL')
+                _confluence_client = Confluence(
+                    url=base_url,
+                    username=os.getenv('CONFLUENCE_USER_EMAIL'),
+                    password=os.getenv('CONFLUENCE_API_KEY'),
+                    timeout=10,
+                    session=http_pool.new_session(base_url)
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Confluence initialization failed: {str(e)}")
+    return _confluence_client
+
+def download_confluence_file(url: str, suffix: str, error_detail: str) -> str:
+    """Download a Confluence attachment through the on-disk attachment cache, returning its path"""
+    auth = (os.getenv('CONFLUENCE_USER_EMAIL'), os.getenv('CONFLUENCE_API_KEY'))
     try:
-        return Confluence(
-            url=os.getenv('CONFLUENCE_BASE_URL'),
-            username=os.getenv('CONFLUENCE_USER_EMAIL'),
-            password=os.getenv('CONFLUENCE_API_KEY'),
-            timeout=10
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Confluence initialization failed: {str(e)}")
+        return attachment_cache.fetch(url, auth=auth, suffix=suffix)
+    except AttachmentDownloadError:
+        raise HTTPException(status_code=404, detail=error_detail)
 
 # Export functions
 def create_pdf(text):
@@ -254,8 +388,10 @@ def auto_detect_space(confluence, space_key: Optional[str] = None) -> str:
         return spaces[0]["key"]
     raise HTTPException(status_code=400, detail="Multiple spaces found. Please specify a space_key.")
 
-def search_web_google(query, num_results=5):
-    import os
+def search_web_google(query, num_results=5, timeout=WEB_SEARCH_TIMEOUT):
+    cached = web_search_cache.get(query, num_results)
+    if cached is not None:
+        return cached
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
     SEARCH_ENGINE_ID = os.getenv("SEARCH_ENGINE_ID")
     url = "https://www.googleapis.com/customsearch/v1"
@@ -266,10 +402,11 @@ def search_web_google(query, num_results=5):
         "num": num_results
     }
     try:
-        response = requests.get(url, params=params)
+        response = http_pool.get(url, params=params, timeout=timeout)
         response.raise_for_status()
         results = response.json().get("items", [])
         if not results:
+            web_search_cache.put(query, num_results, "")
             return ""
         snippets = []
         for item in results:
@@ -277,7 +414,9 @@ def search_web_google(query, num_results=5):
             snippet = item.get("snippet", "")
             link = item.get("link", "")
             snippets.append(f"{title}\n{snippet}\n{link}")
-        return "\n\n".join(snippets)
+        web_context = "\n\n".join(snippets)
+        web_search_cache.put(query, num_results, web_context)
+        return web_context
     except Exception as e:
         return f"❌ Google Search error: {e}"
 
@@ -303,7 +442,7 @@ def search_stack_overflow(query: str, num_results: int = 3) -> List[str]:
         # Remove None values
         params = {k: v for k, v in params.items() if v is not None}
         
-        response = requests.get(url, params=params, timeout=10)
+        response = http_pool.get(url, params=params, timeout=10)
         response.raise_for_status()
         
         data = response.json()
@@ -473,22 +612,27 @@ def check_stack_overflow_risks(code_content: str) -> List[Dict[str, Any]]:
             }
         ]
         
-        found_risks = []
+        matched = [p for p in risk_patterns if re.search(p["pattern"], code_content, re.IGNORECASE)]
+        if not matched:
+            return []
         
-        for pattern_info in risk_patterns:
-            if re.search(pattern_info["pattern"], code_content, re.IGNORECASE):
-                # Search Stack Overflow for real discussions
-                search_query = pattern_info.get("search_terms", [pattern_info["pattern"].replace('\\', '')])[0]
-                stack_overflow_links = search_stack_overflow(search_query, 3)
-                
-                found_risks.append({
-                    "pattern": pattern_info["pattern"].replace('\\', ''),
-                    "risk_level": pattern_info["risk_level"],
-                    "description": pattern_info["description"],
-                    "stack_overflow_links": stack_overflow_links,
-                    "alternative_suggestions": pattern_info["alternative_suggestions"],
-                    "deprecation_warning": pattern_info.get("deprecation_warning")
-                })
+        # Search Stack Overflow for real discussions, one lookup per matched pattern in parallel
+        search_queries = [
+            p.get("search_terms", [p["pattern"].replace('\\', '')])[0] for p in matched
+        ]
+        with ThreadPoolExecutor(max_workers=ANALYZER_FANOUT) as pool:
+            links_per_pattern = list(pool.map(lambda q: search_stack_overflow(q, 3), search_queries))
+        
+        found_risks = []
+        for pattern_info, stack_overflow_links in zip(matched, links_per_pattern):
+            found_risks.append({
+                "pattern": pattern_info["pattern"].replace('\\', ''),
+                "risk_level": pattern_info["risk_level"],
+                "description": pattern_info["description"],
+                "stack_overflow_links": stack_overflow_links,
+                "alternative_suggestions": pattern_info["alternative_suggestions"],
+                "deprecation_warning": pattern_info.get("deprecation_warning")
+            })
         
         return found_risks
         
@@ -496,23 +640,129 @@ def check_stack_overflow_risks(code_content: str) -> List[Dict[str, Any]]:
         print(f"Error in Stack Overflow risk check: {e}")
         return []
 
-def hybrid_rag(prompt, api_key=None):
-    import google.generativeai as genai
-    if api_key:
-        genai.configure(api_key=api_key)
-    else:
-        # fallback to default
-        from os import getenv
-        genai.configure(api_key=getenv('GENAI_API_KEY_1'))
-    model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
-    web_context = search_web_google(prompt)
+def generate_text(ai_model, prompt) -> str:
+    return ai_model.generate_content(prompt).text.strip()
+
+SEVERITY_TAGS = {
+    'Low': '🟢 Low',
+    'Medium': '🟡 Medium',
+    'High': '🔴 High'
+}
+
+def tag_risk_severity(raw_risk: str) -> str:
+    return re.sub(r'\b(Low|Medium|High)\b', lambda m: SEVERITY_TAGS[m.group(0)], raw_risk)
+
+# Response schema for the single-call structured impact analysis
+IMPACT_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "impact_analysis": {"type": "STRING"},
+        "recommendations": {"type": "STRING"},
+        "changes": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "change": {"type": "STRING"},
+                    "severity": {"type": "STRING", "enum": ["Low", "Medium", "High"]},
+                    "reason": {"type": "STRING"}
+                },
+                "required": ["change", "severity", "reason"]
+            }
+        },
+        "risk_factors": {"type": "ARRAY", "items": {"type": "STRING"}}
+    },
+    "required": ["impact_analysis", "recommendations", "changes", "risk_factors"]
+}
+
+def prepare_diff_for_prompt(diff_text: str, endpoint: str, ai_model=None) -> str:
+    """Strip markup and non-ASCII from a diff and keep its most-changed hunks within the endpoint's budget"""
+    text = re.sub(r'<[^>]+>', '', diff_text)
+    text = re.sub(r'[^\x00-\x7F]+', '', text)
+    return fit_diff(text, budget_for(endpoint), ai_model)
+
+def structured_impact_analysis(ai_model, safe_diff: str, subject: str) -> Optional[Dict[str, Any]]:
+    """
+    Run the whole impact analysis as one JSON-schema-constrained Gemini call.
+    Returns the analyzer's report sections, or None when Gemini rejects the request (e.g. a
+    model or SDK without response_schema support) or the output could not be parsed, so the
+    caller falls back to the separate prompts.
+    """
+    prompt = f"""Analyze the following changes between two versions of {subject} and fill in every field:
+
+- impact_analysis: 2 paragraphs (at most 20 sentences) on what was changed, which parts are affected and why it matters.
+- recommendations: 2 paragraphs (at most 20 sentences) suggesting improvements, as a senior reviewer.
+- changes: every individual change, each with a severity of Low, Medium or High and a one-line reason.
+- risk_factors: key risks introduced by the changes (broken validation, auth changes, logical regressions, removed error handling, performance, security, maintainability), one line each, without restating line counts.
+
+Changes:
+{safe_diff}"""
+    try:
+        response = ai_model.generate_content(
+            prompt,
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": IMPACT_ANALYSIS_SCHEMA
+            }
+        )
+    except GeminiUnavailableError:
+        raise
+    except Exception as e:
+        if is_retryable(e):
+            raise
+        print(f"Structured impact analysis request rejected: {e}")
+        return None
+    try:
+        data = json.loads(response.text)
+    except (ValueError, AttributeError) as e:
+        print(f"Structured impact analysis returned unparseable output: {e}")
+        return None
+    changes = [
+        c for c in data.get("changes", [])
+        if isinstance(c, dict) and c.get("change") and c.get("severity") in SEVERITY_TAGS
+    ]
+    risk_text = "\n".join(
+        f"- {c['change']}: {SEVERITY_TAGS[c['severity']]} — {c.get('reason', '')}"
+        for c in changes
+    )
+    return {
+        "impact_analysis": data.get("impact_analysis", "").strip(),
+        "recommendations": data.get("recommendations", "").strip(),
+        "risk_analysis": risk_text,
+        "risk_factors": [f.strip() for f in data.get("risk_factors", []) if isinstance(f, str) and f.strip()],
+        "change_severities": changes
+    }
+
+def start_web_search(query: str):
+    """Run search_web_google in the background, e.g. speculatively before it is known to be needed"""
+    return _web_executor.submit(search_web_google, query)
+
+def hybrid_rag(prompt, req: Optional[Request] = None, web_lookup=None):
+    """Answer from web search results, giving up on slow steps after HYBRID_RAG_BUDGET seconds.
+    
+    `web_lookup` is a start_web_search() future the caller may have started already.
+    """
+    model = get_ai_model("hybrid_rag", req)
+    deadline = time.monotonic() + HYBRID_RAG_BUDGET
+    
+    def generate(text):
+        return model.generate_content(text, request_options={"timeout": max(1.0, deadline - time.monotonic())})
+    
+    if web_lookup is None:
+        web_lookup = start_web_search(prompt)
+    try:
+        web_context = web_lookup.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FuturesTimeout:
+        print("Web search did not finish within the hybrid_rag budget, answering without it")
+        web_context = ""
     if not web_context.strip():
-        response = model.generate_content(prompt)
+        response = generate(prompt)
         answer = response.parts[0].text.strip() if response.parts else "⚠️ No answer from Gemini."
         return answer, "llm"
     final_prompt = f"""
 Use the following web search results to answer the question accurately.
 If relevant, include links as citations.
+If the web results do not contain the answer, answer from your own knowledge instead.
 
 Web Results:
 {web_context}
@@ -522,10 +772,11 @@ Question: {prompt}
 Answer:
 """
     try:
-        response = model.generate_content(final_prompt)
+        response = generate(final_prompt)
         text = response.parts[0].text.strip() if response.parts else "⚠️ No answer from Gemini."
-        if "do not contain" in text.lower():
-            response = model.generate_content(prompt)
+        # A third round trip only while the budget lasts; otherwise the web answer stands
+        if "do not contain" in text.lower() and time.monotonic() < deadline:
+            response = generate(prompt)
             answer = response.parts[0].text.strip() if response.parts else "⚠️ No fallback answer from Gemini."
             return answer, "llm"
         return text, "hybrid_rag"
@@ -538,9 +789,13 @@ async def root():
     return {"message": "Confluence AI Assistant API", "status": "running"}
 
 @app.get("/spaces")
-async def get_spaces():
+def get_spaces():
     """Get all available Confluence spaces"""
     try:
+        if mirror is not None:
+            space_options = mirror.get_spaces()
+            if space_options:
+                return {"spaces": space_options}
         confluence = init_confluence()
         
         spaces = confluence.get_all_spaces(start=0, limit=100)["results"]
@@ -548,58 +803,108 @@ async def get_spaces():
         
         return {"spaces": space_options}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.get("/pages/{space_key}")
-async def get_pages(space_key: Optional[str] = None):
+def get_pages(space_key: Optional[str] = None):
     """Get all pages from a specific space (auto-detect if not provided)"""
     try:
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, space_key)
         
-        pages = confluence.get_all_pages_from_space(space=space_key, start=0, limit=100)
-        page_titles = [p["title"] for p in pages]
+        page_titles = page_index.titles(confluence, space_key)
         
         return {"pages": page_titles}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
+
+@app.get("/pages-with-type/{space_key}")
+def get_pages_with_type(space_key: Optional[str] = None):
+    """Get all pages from a space with their content type (video, code, image or text)"""
+    try:
+        confluence = init_confluence()
+        space_key = auto_detect_space(confluence, space_key)
+        
+        pages = page_index.get(confluence, space_key).pages
+        return {"pages": page_types.classify_pages(confluence, pages)}
+    except Exception as e:
+        raise to_http_exception(e)
+
+def open_search_session(confluence, space_key: str, page_titles: Optional[List[str]], query: str):
+    """Resolve the selected pages and the session holding their documents for a search query.
+    
+    Without page_titles the space's best BM25 matches for the query are used.
+    The page set's documents are prepared once per set of page versions and reused by
+    follow-up questions. Returns (selected_pages, session, reused).
+    """
+    selected_pages = []
+    page_scores = None
+    if page_titles:
+        for title in dict.fromkeys(page_titles):
+            page = page_index.find(confluence, space_key, title)
+            if page:
+                selected_pages.append(page)
+    else:
+        matches = lexical_index.search(confluence, space_key, query, SEARCH_SPACE_PAGES)
+        selected_pages = [page for page, _ in matches]
+        page_scores = [score for _, score in matches]
+    
+    if not selected_pages:
+        raise HTTPException(status_code=400, detail="No pages found")
+    
+    def load_documents():
+        # Extract content from selected pages (uncached bodies are fetched in CQL batches)
+        fetch_stats = page_cache.prefetch_storage(confluence, selected_pages)
+        documents = [
+            (page["title"], page_cache.get_text(confluence, page["id"], page.get("version")))
+            for page in selected_pages
+        ]
+        return documents, {"fetch_stats": fetch_stats, "pages": selected_pages, "page_scores": page_scores}
+    
+    session, reused = context_sessions.get_or_create(
+        "search", [space_key, [[p["id"], p.get("version")] for p in selected_pages]], load_documents
+    )
+    return selected_pages, session, reused
+
+def retrieve_search_documents(session, query: str, query_vector=None):
+    """Top-k chunks of the session's pages for the query, grouped per page
+    
+    Search contexts are always fitted to the question this way and sent inline: page sets
+    are never registered as Gemini cached content, which would skip retrieval and send the
+    whole set with every question. `query_vector` is the question embedding when the
+    semantic answer cache already computed it.
+    """
+    if sum(estimate_tokens(text) for _, text in session.documents) <= budget_for("search"):
+        # Small page sets are sent whole; retrieval only pays off past the budget
+        return session.documents
+    try:
+        # Lexically found pages blend their BM25 score into the chunk ranking
+        return retrieve_documents(vector_index, session.meta["pages"], session.documents, query,
+                                  budget_for("search"), page_scores=session.meta["page_scores"],
+                                  query_vector=query_vector)
+    except Exception as e:
+        # Without embeddings, pages share the search budget by term overlap with the query
+        print(f"Vector retrieval failed, falling back to lexical fitting: {e}")
+        return fit_documents(session.documents, query, budget_for("search"))
 
 @app.post("/search")
-async def ai_powered_search(request: SearchRequest, req: Request):
+def ai_powered_search(request: SearchRequest, req: Request):
     """AI Powered Search functionality"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("search", req)
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
         
-        full_context = ""
-        selected_pages = []
-        
-        # Get pages
-        pages = confluence.get_all_pages_from_space(space=space_key, start=0, limit=100)
-        selected_pages = [p for p in pages if p["title"] in request.page_titles]
-        
-        if not selected_pages:
-            raise HTTPException(status_code=400, detail="No pages found")
-        
-        # Extract content from selected pages
-        for page in selected_pages:
-            page_id = page["id"]
-            page_data = confluence.get_page_by_id(page_id, expand="body.storage")
-            raw_html = page_data["body"]["storage"]["value"]
-            text_content = clean_html(raw_html)
-            full_context += f"\n\nTitle: {page['title']}\n{text_content}"
-        
-        # Generate AI response
-        prompt = (
-            f"Answer the following question using the provided Confluence page content as context.\n"
-            f"Context:\n{full_context}\n\n"
-            f"Question: {request.query}\n"
-            f"Instructions: Begin with the answer based on the context above. Then, if applicable, supplement with general knowledge."
+        selected_pages, session, reused = open_search_session(
+            confluence, space_key, request.page_titles, request.query
         )
+        # Near-duplicate questions over the same page versions reuse the stored answer, before any retrieval
+        cached_answer, question_vector = answer_cache.lookup("search", session.context_id, selected_pages, request.query)
+        if cached_answer is not None:
+            return {**cached_answer, "context_id": session.context_id, "context_reused": reused, "fetch_stats": {}}
+        full_context = format_documents(retrieve_search_documents(session, request.query, question_vector))
         
+        # Generate AI response
         structured_prompt = (
             f"Answer the following question. If the provided context directly answers the question, use it. Otherwise, answer from your own knowledge. "
             f"Return your answer as JSON: {{'answer': <your answer>, 'supported_by_context': true/false, 'can_answer': true/false}}. "
@@ -608,6 +913,10 @@ async def ai_powered_search(request: SearchRequest, req: Request):
             f"Context:\n{full_context}\n\n"
             f"Question: {request.query}"
         )
+        # Questions the pages barely cover will likely need the web fallback; start it now
+        web_lookup = None
+        if query_coverage(request.query, full_context) < WEB_SPECULATE_COVERAGE:
+            web_lookup = start_web_search(request.query)
         response = ai_model.generate_content(structured_prompt)
         import json as _json
         source = "llm"
@@ -617,7 +926,7 @@ async def ai_powered_search(request: SearchRequest, req: Request):
             supported = result.get('supported_by_context', False)
             can_answer = result.get('can_answer', True)
             if not supported and not can_answer:
-                ai_response, source = hybrid_rag(request.query, api_key=api_key)
+                ai_response, source = hybrid_rag(request.query, req, web_lookup)
         except Exception:
             ai_response = response.text.strip()
             supported = None
@@ -631,11 +940,11 @@ async def ai_powered_search(request: SearchRequest, req: Request):
                     supported = result.get('supported_by_context', False)
                     can_answer = result.get('can_answer', True)
                     if not supported and not can_answer:
-                        ai_response, source = hybrid_rag(request.query, api_key=api_key)
+                        ai_response, source = hybrid_rag(request.query, req, web_lookup)
             except Exception:
                 # Regex fallback for supported_by_context: false and can_answer: false
                 if re.search(r"supported_by_context['\"]?\s*[:=]\s*false", response.text.strip(), re.IGNORECASE) and re.search(r"can_answer['\"]?\s*[:=]\s*false", response.text.strip(), re.IGNORECASE):
-                    ai_response, source = hybrid_rag(request.query, api_key=api_key)
+                    ai_response, source = hybrid_rag(request.query, req, web_lookup)
             # If ast.literal_eval succeeded and ai_response is still a dict, extract 'answer'
             if isinstance(ai_response, dict):
                 ai_response = ai_response.get('answer', '').strip()
@@ -646,35 +955,100 @@ async def ai_powered_search(request: SearchRequest, req: Request):
                     ai_response = match.group(1).strip()
         page_titles = [p["title"] for p in selected_pages]
         final_response = ai_response
-        return {
+        result = {
             "response": final_response,
             "pages_analyzed": len(selected_pages),
             "page_titles": page_titles,
             "source": source
         }
+        if final_response:
+            answer_cache.store("search", session.context_id, selected_pages, request.query, question_vector, result)
+        return {
+            **result,
+            "fetch_stats": {} if reused else session.meta["fetch_stats"],
+            "context_id": session.context_id,
+            "context_reused": reused
+        }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
-@app.post("/video-summarizer")
-async def video_summarizer(request: VideoRequest, req: Request):
-    """Video Summarizer functionality using AssemblyAI and Gemini"""
-    import requests
-    import tempfile
-    import subprocess
-    import shutil
-    confluence = init_confluence()
-    space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
+@app.post("/search/stream")
+def ai_powered_search_stream(request: SearchRequest, req: Request):
+    """AI Powered Search, streaming the answer over Server-Sent Events
+    
+    Same flow as /search: the answer comes from the pages or Gemini's own knowledge, and a
+    question neither can answer is sent to the hybrid_rag web fallback, streamed as its own
+    section. Plain-text answers differ from /search's JSON ones, so they are cached separately.
+    """
+    try:
+        ai_model = get_ai_model("search", req)
+        confluence = init_confluence()
+        space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
+        selected_pages, session, reused = open_search_session(
+            confluence, space_key, request.page_titles, request.query
+        )
+        # A reused answer needs no retrieval
+        cached_answer, question_vector = answer_cache.lookup(
+            "search_stream", session.context_id, selected_pages, request.query
+        )
+        full_context = "" if cached_answer is not None else format_documents(
+            retrieve_search_documents(session, request.query, question_vector)
+        )
+    except Exception as e:
+        raise to_http_exception(e)
+    
+    # Plain-text prompt: the JSON envelope used by /search cannot be rendered while it streams
+    prompt = (
+        f"Answer the following question. If the provided context directly answers the question, use it. Otherwise, answer from your own knowledge. "
+        f"If you cannot answer at all, reply with exactly {SEARCH_NO_ANSWER} and nothing else.\n"
+        f"Context:\n{full_context}\n\n"
+        f"Question: {request.query}"
+    )
+    
+    def events():
+        context_fields = {"context_id": session.context_id, "context_reused": reused}
+        if cached_answer is not None:
+            yield sse_event("section_start", {"section": "response"})
+            yield sse_event("section_end", {"section": "response", "text": cached_answer["response"]})
+            yield sse_event("done", {**cached_answer, **context_fields, "fetch_stats": {}})
+            return
+        # Questions the pages barely cover will likely need the web fallback; start it now
+        web_lookup = None
+        if query_coverage(request.query, full_context) < WEB_SPECULATE_COVERAGE:
+            web_lookup = start_web_search(request.query)
+        answer = yield from stream_section(ai_model, "response", prompt)
+        source = "llm"
+        if not answer or answer.upper().startswith(SEARCH_NO_ANSWER):
+            yield sse_event("status", {"message": "Searching the web"})
+            yield sse_event("section_start", {"section": "hybrid_rag"})
+            answer, source = hybrid_rag(request.query, req, web_lookup)
+            yield sse_event("section_end", {"section": "hybrid_rag", "text": answer})
+        result = {
+            "response": answer,
+            "pages_analyzed": len(selected_pages),
+            "page_titles": [p["title"] for p in selected_pages],
+            "source": source
+        }
+        if answer:
+            answer_cache.store("search_stream", session.context_id, selected_pages, request.query, question_vector, result)
+        yield sse_event("done", {
+            **result,
+            **context_fields,
+            "fetch_stats": {} if reused else session.meta["fetch_stats"]
+        })
+    
+    return sse_response(events())
 
-    # Get page info
-    pages = confluence.get_all_pages_from_space(space=space_key, start=0, limit=100)
-    selected_page = next((p for p in pages if p["title"] == request.page_title), None)
+def find_page_video(confluence, space_key: str, page_title: str):
+    """Return the first .mp4 attachment of a page and its absolute download URL"""
+    selected_page = page_index.find(confluence, space_key, page_title)
     if not selected_page:
         raise HTTPException(status_code=400, detail="Page not found")
     page_id = selected_page["id"]
 
     # Get attachments
-    attachments = confluence.get(f"/rest/api/content/{page_id}/child/attachment?limit=50")
+    attachments = confluence.get(f"/rest/api/content/{page_id}/child/attachment?limit=50&expand=version")
     video_attachment = None
     for att in attachments.get("results", []):
         if att["title"].lower().endswith(".mp4"):
@@ -683,18 +1057,29 @@ async def video_summarizer(request: VideoRequest, req: Request):
     if not video_attachment:
         raise HTTPException(status_code=404, detail="No .mp4 video attachment found on this page.")
 
-    # Download video
     video_url = video_attachment["_links"]["download"]
     full_url = f"{os.getenv('CONFLUENCE_BASE_URL').rstrip('/')}{video_url}"
-    video_name = video_attachment["title"].replace(" ", "_")
-    
+    return video_attachment, full_url
+
+def download_page_video(confluence, video_attachment: Dict[str, Any], full_url: str) -> str:
+    video_version = (video_attachment.get("version") or {}).get("number")
+    try:
+        # Streamed to the on-disk attachment cache; repeat calls reuse the file
+        return attachment_cache.fetch(
+            full_url,
+            session=confluence._session,
+            cache_key=f"attachment:{video_attachment['id']}:{video_version}" if video_version else None,
+            suffix=".mp4"
+        )
+    except AttachmentDownloadError as e:
+        raise HTTPException(status_code=404, detail=f"Failed to download video: {e}")
+
+def transcribe_video(video_path: str) -> Dict[str, Any]:
+    """Extract the audio track with ffmpeg and transcribe it with AssemblyAI (text, words, chapters, highlights, speakers)"""
+    import tempfile
+    import subprocess
     with tempfile.TemporaryDirectory() as tmpdir:
-        video_path = os.path.join(tmpdir, video_name)
         audio_path = os.path.join(tmpdir, "audio.mp3")
-        # Download video file
-        video_data = confluence._session.get(full_url).content
-        with open(video_path, "wb") as f:
-            f.write(video_data)
         # Extract audio using ffmpeg
         try:
             subprocess.run([
@@ -708,186 +1093,358 @@ async def video_summarizer(request: VideoRequest, req: Request):
             raise HTTPException(status_code=500, detail="AssemblyAI API key not configured. Please set ASSEMBLYAI_API_KEY in your environment variables.")
         headers = {"authorization": assemblyai_api_key}
         with open(audio_path, "rb") as f:
-            upload_response = requests.post(
+            upload_response = http_pool.post(
                 "https://api.assemblyai.com/v2/upload",
                 headers=headers,
-                data=f
+                data=f,
+                timeout=600
             )
         if upload_response.status_code != 200:
             raise HTTPException(status_code=500, detail="Failed to upload audio to AssemblyAI")
         audio_url = upload_response.json()["upload_url"]
-        # Submit for transcription
-        transcript_request = {
-            "audio_url": audio_url,
-            "speaker_labels": True,
-            "auto_chapters": True,
-            "auto_highlights": True,
-            "entity_detection": True,
-            "sentiment_analysis": True
-        }
-        transcript_response = requests.post(
-            "https://api.assemblyai.com/v2/transcript",
-            json=transcript_request,
-            headers={**headers, "content-type": "application/json"}
-        )
-        if transcript_response.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to submit audio for transcription")
-        transcript_id = transcript_response.json()["id"]
-        # Poll for completion
-        while True:
-            polling_response = requests.get(
-                f"https://api.assemblyai.com/v2/transcript/{transcript_id}",
-                headers=headers
-            )
-            if polling_response.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to get transcription status")
-            status = polling_response.json()["status"]
-            if status == "completed":
-                break
-            elif status == "error":
-                raise HTTPException(status_code=500, detail="Transcription failed")
-            time.sleep(3)
-        transcript_data = polling_response.json()
-        transcript_text = transcript_data.get("text", "")
-        if not transcript_text:
-            raise HTTPException(status_code=500, detail="No transcript text returned from AssemblyAI")
-        
-        # Initialize Gemini AI model for text generation
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
-        
-        # Q&A
-        if request.question:
-            qa_prompt = (
-                f"Based on the following video transcript, answer this question: {request.question}\n\n"
-                f"Transcript: {transcript_text[:3000]}\n\n"
-                f"Provide a detailed answer based on the video content."
-            )
-            qa_response = ai_model.generate_content(qa_prompt)
-            return {"answer": qa_response.text.strip()}
-        
-        # Generate quotes
-        quote_prompt = (
-            "Extract 3-5 powerful or interesting quotes from the transcript.\n"
-            "Format each quote on a new line starting with a dash (-).\n"
-            f"Transcript:\n{transcript_text[:3000]}"
+    # Submit for transcription
+    transcript_request = {
+        "audio_url": audio_url,
+        "speaker_labels": True,
+        "auto_chapters": True,
+        "auto_highlights": True,
+        "entity_detection": True,
+        "sentiment_analysis": True
+    }
+    transcript_response = http_pool.post(
+        "https://api.assemblyai.com/v2/transcript",
+        json=transcript_request,
+        headers={**headers, "content-type": "application/json"}
+    )
+    if transcript_response.status_code != 200:
+        raise HTTPException(status_code=500, detail="Failed to submit audio for transcription")
+    transcript_id = transcript_response.json()["id"]
+    # Poll for completion
+    while True:
+        polling_response = http_pool.get(
+            f"https://api.assemblyai.com/v2/transcript/{transcript_id}",
+            headers=headers
         )
-        quotes_response = ai_model.generate_content(quote_prompt).text.strip()
-        # Split quotes into individual items
-        quotes = [quote.strip().lstrip("- ").strip() for quote in quotes_response.split('\n') if quote.strip()]
-        
-        # Generate summary WITHOUT timestamps
-        summary_prompt = (
+        if polling_response.status_code != 200:
+            raise HTTPException(status_code=500, detail="Failed to get transcription status")
+        status = polling_response.json()["status"]
+        if status == "completed":
+            break
+        elif status == "error":
+            raise HTTPException(status_code=500, detail="Transcription failed")
+        time.sleep(3)
+    transcript_data = polling_response.json()
+    transcript_text = transcript_data.get("text", "")
+    if not transcript_text:
+        raise HTTPException(status_code=500, detail="No transcript text returned from AssemblyAI")
+    return {
+        "text": transcript_text,
+        "words": [
+            {k: w.get(k) for k in ("text", "start", "end", "confidence", "speaker")}
+            for w in transcript_data.get("words") or []
+        ],
+        "chapters": transcript_data.get("chapters") or [],
+        "highlights": (transcript_data.get("auto_highlights_result") or {}).get("results") or [],
+        # Speaker turns without their per-word breakdown (already in "words")
+        "speakers": [
+            {k: u.get(k) for k in ("speaker", "start", "end", "text")}
+            for u in transcript_data.get("utterances") or []
+        ],
+    }
+
+VIDEO_TRANSCRIPT_REFERENCE = "(the full video transcript, provided above)"
+
+def video_fingerprint(video_attachment: Dict[str, Any], full_url: str) -> List[Any]:
+    video_version = (video_attachment.get("version") or {}).get("number")
+    return [video_attachment["id"], video_version] if video_version else [full_url]
+
+def load_video_transcript(confluence, video_attachment: Dict[str, Any], full_url: str,
+                          progress: Callable[[str], None] = lambda stage: None) -> Dict[str, Any]:
+    """Stored transcript of this attachment version, or download and transcribe the video"""
+    video_version = (video_attachment.get("version") or {}).get("number")
+    def download_and_transcribe():
+        progress("download")
+        video_path = download_page_video(confluence, video_attachment, full_url)
+        progress("transcribe")
+        return transcribe_video(video_path)
+    return transcript_cache.get_or_transcribe(video_attachment["id"], video_version, download_and_transcribe)
+
+def video_session_documents(transcript: Dict[str, Any]):
+    return [("Video transcript", transcript["text"])], {"chapters": transcript["chapters"]}
+
+def open_video_session(confluence, video_attachment: Dict[str, Any], full_url: str,
+                       progress: Callable[[str], None] = lambda stage: None):
+    """Transcript session for a video, loaded from the transcript cache (or transcribed) on first use"""
+    return context_sessions.get_or_create(
+        "video", video_fingerprint(video_attachment, full_url),
+        lambda: video_session_documents(load_video_transcript(confluence, video_attachment, full_url, progress))
+    )
+
+def video_prompt_context(ai_model, session):
+    """(model, transcript) for video prompts: the transcript itself, or a reference to cached content"""
+    return context_sessions.prompt_context(
+        ai_model, session, VIDEO_TRANSCRIPT_REFERENCE, lambda s: s.documents[0][1], budget_for("video_summarizer")
+    )
+
+def video_qa_prompt(transcript_text: str, question: str, ai_model=None) -> str:
+    transcript = fit_relevant(transcript_text, question, budget_for("video_summarizer"), ai_model)
+    return (
+        f"Based on the following video transcript, answer this question: {question}\n\n"
+        f"Transcript: {transcript}\n\n"
+        f"Provide a detailed answer based on the video content."
+    )
+
+def video_summary_prompts(transcript_text: str, ai_model=None) -> Dict[str, str]:
+    """Prompts for the summary, quotes and timestamps sections of a video summary"""
+    # Passages spread over the whole video rather than only its beginning
+    transcript = fit_spread(transcript_text, budget_for("video_summarizer"), ai_model)
+    return {
+        # Summary WITHOUT timestamps
+        "summary": (
             "detailed paragraph summarizing the video content.\n"
             "Do NOT include any timestamps in the summary.\n"
-            f"Transcript:\n{transcript_text[:3000]}"
-        )
-        summary = ai_model.generate_content(summary_prompt).text.strip()
-        
-        # Generate timestamps separately
-        timestamp_prompt = (
+            f"Transcript:\n{transcript}"
+        ),
+        "quotes": (
+            "Extract 3-5 powerful or interesting quotes from the transcript.\n"
+            "Format each quote on a new line starting with a dash (-).\n"
+            f"Transcript:\n{transcript}"
+        ),
+        # Timestamps are generated separately
+        "timestamps": (
             "Extract 5-7 important moments from the following transcript.\n"
             "Format each moment as: [MM:SS-MM:SS] Description of what happens\n"
             "Example: [00:15-00:30] Speaker introduces the main topic\n"
             "Return only the timestamps, one per line.\n\n"
-            f"Transcript:\n{transcript_text[:3000]}"
-        )
-        timestamps_response = ai_model.generate_content(timestamp_prompt).text.strip()
-        # Split timestamps into individual items
-        timestamps = [ts.strip() for ts in timestamps_response.split('\n') if ts.strip()]
-        
-        return {
-            "summary": summary,
-            "quotes": quotes,
-            "timestamps": timestamps,
-            "qa": [],
-            "page_title": request.page_title,
-            "transcript": transcript_text[:1000] + "..." if len(transcript_text) > 1000 else transcript_text,
-            "video_url": full_url
-        }
+            f"Transcript:\n{transcript}"
+        ),
+    }
+
+def video_summary_result(page_title: str, transcript_text: str, full_url: str,
+                         summary: str, quotes_text: str, timestamps_text: str) -> Dict[str, Any]:
+    # Split quotes and timestamps into individual items
+    quotes = [quote.strip().lstrip("- ").strip() for quote in quotes_text.split('\n') if quote.strip()]
+    timestamps = [ts.strip() for ts in timestamps_text.split('\n') if ts.strip()]
+    return {
+        "summary": summary,
+        "quotes": quotes,
+        "timestamps": timestamps,
+        "qa": [],
+        "page_title": page_title,
+        "transcript": transcript_text[:1000] + "..." if len(transcript_text) > 1000 else transcript_text,
+        "video_url": full_url
+    }
+
+def summarize_video(request: VideoRequest, ai_model, progress: Callable[[str], None] = lambda stage: None) -> Dict[str, Any]:
+    """Transcribe (or reuse the transcript of) a page's video and summarize it or answer the question"""
+    confluence = init_confluence()
+    space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
 
+    progress("resolve")
+    video_attachment, full_url = find_page_video(confluence, space_key, request.page_title)
+    session, reused = open_video_session(confluence, video_attachment, full_url, progress)
+    transcript_text = session.documents[0][1]
+    
+    progress("answer" if request.question else "summarize")
+    context_model, transcript = video_prompt_context(ai_model, session)
+    
+    # Q&A
+    if request.question:
+        qa_response = context_model.generate_content(video_qa_prompt(transcript, request.question, ai_model))
+        return {"answer": qa_response.text.strip(), "context_id": session.context_id, "context_reused": reused}
+    
+    prompts = video_summary_prompts(transcript, ai_model)
+    quotes_text = context_model.generate_content(prompts["quotes"]).text.strip()
+    summary = context_model.generate_content(prompts["summary"]).text.strip()
+    timestamps_text = context_model.generate_content(prompts["timestamps"]).text.strip()
+    
+    return video_summary_result(request.page_title, transcript_text, full_url, summary, quotes_text, timestamps_text)
+
+@app.post("/video-summarizer")
+def video_summarizer(request: VideoRequest, req: Request):
+    """Video Summarizer functionality using AssemblyAI and Gemini"""
+    return summarize_video(request, get_ai_model("video_summarizer", req))
+
+def run_video_job(payload: Dict[str, Any], progress: Callable[[str], None]) -> Dict[str, Any]:
+    preferred_key = payload.pop("preferred_key", None)
+    return summarize_video(VideoRequest(**payload), get_ai_model("video_summarizer", preferred_key=preferred_key), progress)
+
+job_queue.register("video_summarizer", ["resolve", "download", "transcribe", "summarize", "answer"], run_video_job)
+
+@app.on_event("startup")
+async def start_job_queue():
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    job_queue.shutdown()
+
+@app.post("/video-summarizer/jobs")
+def submit_video_summarizer_job(request: VideoRequest, req: Request):
+    """Queue a video summary (or question) and return its job id at once; follow it with /jobs/{job_id}"""
+    dedup_key = json.dumps([request.space_key, request.page_title, request.question])
+    payload = {**request.model_dump(), "preferred_key": req.headers.get('x-api-key')}
+    job, deduplicated = job_queue.submit("video_summarizer", payload, dedup_key)
+    return JSONResponse(status_code=202, content={**job, "deduplicated": deduplicated})
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status, per-stage progress and (once completed) result of a background job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+def job_events(job_id: str):
+    """Job progress over Server-Sent Events: a `job` frame per change, then `done` or `error`"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    def events():
+        current = job
+        while True:
+            yield sse_event("job", current)
+            if current["status"] == "completed":
+                yield sse_event("done", current["result"])
+                return
+            if current["status"] == "failed":
+                yield sse_event("error", {"detail": current["error"], "status_code": current["status_code"]})
+                return
+            current = job_queue.wait_for_change(job_id, current, timeout=15)
+            if current is None:
+                yield sse_event("error", {"detail": "Job not found", "status_code": 404})
+                return
+    
+    return sse_response(events())
+
+@app.post("/video-summarizer/stream")
+def video_summarizer_stream(request: VideoRequest, req: Request):
+    """Video Summarizer streaming progress and Gemini output over Server-Sent Events"""
+    confluence = init_confluence()
+    space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
+    video_attachment, full_url = find_page_video(confluence, space_key, request.page_title)
+    
+    ai_model = get_ai_model("video_summarizer", req)
+    
+    def events():
+        fingerprint = video_fingerprint(video_attachment, full_url)
+        session = context_sessions.find("video", fingerprint)
+        reused = session is not None
+        if session is None:
+            video_version = (video_attachment.get("version") or {}).get("number")
+            stored = transcript_cache.get(video_attachment["id"], video_version)
+            if stored is None:
+                yield sse_event("status", {"message": "Downloading video"})
+                video_path = download_page_video(confluence, video_attachment, full_url)
+                yield sse_event("status", {"message": "Transcribing audio"})
+                stored = transcript_cache.transcribe_once(
+                    video_attachment["id"], video_version, lambda: transcribe_video(video_path)
+                )
+            session, reused = context_sessions.get_or_create(
+                "video", fingerprint, lambda: video_session_documents(stored)
+            )
+        transcript_text = session.documents[0][1]
+        context_model, transcript = video_prompt_context(ai_model, session)
+        
+        if request.question:
+            answer = yield from stream_section(context_model, "answer", video_qa_prompt(transcript, request.question, ai_model))
+            yield sse_event("done", {"answer": answer, "context_id": session.context_id, "context_reused": reused})
+            return
+        
+        prompts = video_summary_prompts(transcript, ai_model)
+        summary = yield from stream_section(context_model, "summary", prompts["summary"])
+        quotes_text = yield from stream_section(context_model, "quotes", prompts["quotes"])
+        timestamps_text = yield from stream_section(context_model, "timestamps", prompts["timestamps"])
+        yield sse_event("done", video_summary_result(
+            request.page_title, transcript_text, full_url, summary, quotes_text, timestamps_text
+        ))
+    
+    return sse_response(events())
+
+
+def detect_language_from_content(content: str) -> str:
+    if "<?xml" in content:
+        return "xml"
+    if "<html" in content.lower() or "<!DOCTYPE html>" in content:
+        return "html"
+    if content.strip().startswith("{") or content.strip().startswith("["):
+        return "json"
+    if re.search(r"\bclass\s+\w+", content) and "public" in content:
+        return "java"
+    if "#include" in content:
+        return "cpp"
+    if "def " in content:
+        return "python"
+    if "function" in content or "=>" in content:
+        return "javascript"
+    return "text"
+
+def load_code_page(confluence, space_key: str, page_title: str):
+    """Return the storage body of a page, its visible code and the detected language"""
+    selected_page = page_index.find(confluence, space_key, page_title)
+    
+    if not selected_page:
+        raise HTTPException(status_code=400, detail="Page not found")
+    
+    context = page_cache.get_storage(confluence, selected_page["id"], selected_page.get("version"))
+    
+    # Extract visible code (the first non-empty <pre>/<code> block)
+    bundle = parse_page(context)
+    cleaned_code = bundle.code_blocks[0] if bundle.code_blocks else bundle.text.strip()
+    
+    return context, cleaned_code, detect_language_from_content(cleaned_code)
+
+def code_summary_prompt(context: str, ai_model=None) -> str:
+    context = truncate_to_tokens(context, budget_for("code_assistant"), ai_model)
+    return (
+        f"The following is content (possibly code or structure) from a Confluence page:\n\n{context}\n\n"
+        "Summarize in detailed paragraph"
+    )
+
+def code_alteration_prompt(code: str, instruction: str) -> str:
+    return (
+        f"The following is a piece of code extracted from a Confluence page:\n\n{code}\n\n"
+        f"Please modify this code according to the following instruction:\n'{instruction}'\n\n"
+        "Return the modified code only. No explanation or extra text."
+    )
+
+def code_conversion_prompt(code: str, target_language: str) -> str:
+    return (
+        f"The following is a code structure or data snippet:\n\n{code}\n\n"
+        f"Convert this into equivalent {target_language} code. Only show the converted code."
+    )
+
+def strip_code_fences(text: str) -> str:
+    return re.sub(r"^```[a-zA-Z]*\n|```$", "", text.strip(), flags=re.MULTILINE)
 
 @app.post("/code-assistant")
-async def code_assistant(request: CodeRequest, req: Request):
+def code_assistant(request: CodeRequest, req: Request):
     """Code Assistant functionality"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("code_assistant", req)
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
         
-        # Get page content
-        pages = confluence.get_all_pages_from_space(space=space_key, start=0, limit=100)
-        selected_page = next((p for p in pages if p["title"] == request.page_title), None)
-        
-        if not selected_page:
-            raise HTTPException(status_code=400, detail="Page not found")
-        
-        page_id = selected_page["id"]
-        page_content = confluence.get_page_by_id(page_id, expand="body.storage")
-        context = page_content["body"]["storage"]["value"]
-        
-        # Extract visible code
-        soup = BeautifulSoup(context, "html.parser")
-        for tag in soup.find_all(['pre', 'code']):
-            code_text = tag.get_text()
-            if code_text.strip():
-                cleaned_code = code_text
-                break
-        else:
-            cleaned_code = soup.get_text(separator="\n").strip()
-        
-        # Detect language
-        def detect_language_from_content(content: str) -> str:
-            if "<?xml" in content:
-                return "xml"
-            if "<html" in content.lower() or "<!DOCTYPE html>" in content:
-                return "html"
-            if content.strip().startswith("{") or content.strip().startswith("["):
-                return "json"
-            if re.search(r"\bclass\s+\w+", content) and "public" in content:
-                return "java"
-            if "#include" in content:
-                return "cpp"
-            if "def " in content:
-                return "python"
-            if "function" in content or "=>" in content:
-                return "javascript"
-            return "text"
-        
-        detected_lang = detect_language_from_content(cleaned_code)
+        context, cleaned_code, detected_lang = load_code_page(confluence, space_key, request.page_title)
         
         # Generate summary
-        summary_prompt = (
-            f"The following is content (possibly code or structure) from a Confluence page:\n\n{context}\n\n"
-            "Summarize in detailed paragraph"
-        )
-        summary_response = ai_model.generate_content(summary_prompt)
+        summary_response = ai_model.generate_content(code_summary_prompt(context, ai_model))
         summary = summary_response.text.strip()
         
         # Modify code if instruction provided
         modified_code = None
         if request.instruction:
-            alteration_prompt = (
-                f"The following is a piece of code extracted from a Confluence page:\n\n{cleaned_code}\n\n"
-                f"Please modify this code according to the following instruction:\n'{request.instruction}'\n\n"
-                "Return the modified code only. No explanation or extra text."
-            )
-            altered_response = ai_model.generate_content(alteration_prompt)
-            modified_code = re.sub(r"^```[a-zA-Z]*\n|```$", "", altered_response.text.strip(), flags=re.MULTILINE)
+            altered_response = ai_model.generate_content(code_alteration_prompt(cleaned_code, request.instruction))
+            modified_code = strip_code_fences(altered_response.text)
         
         # Convert to another language if requested
         converted_code = None
         if request.target_language and request.target_language != detected_lang:
             input_code = modified_code if modified_code else cleaned_code
-            convert_prompt = (
-                f"The following is a code structure or data snippet:\n\n{input_code}\n\n"
-                f"Convert this into equivalent {request.target_language} code. Only show the converted code."
-            )
-            lang_response = ai_model.generate_content(convert_prompt)
-            converted_code = re.sub(r"^```[a-zA-Z]*\n|```$", "", lang_response.text.strip(), flags=re.MULTILINE)
+            lang_response = ai_model.generate_content(code_conversion_prompt(input_code, request.target_language))
+            converted_code = strip_code_fences(lang_response.text)
         
         return {
             "summary": summary,
@@ -899,66 +1456,83 @@ async def code_assistant(request: CodeRequest, req: Request):
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
+
+@app.post("/code-assistant/stream")
+def code_assistant_stream(request: CodeRequest, req: Request):
+    """Code Assistant streaming summary, modified and converted code over Server-Sent Events"""
+    try:
+        ai_model = get_ai_model("code_assistant", req)
+        confluence = init_confluence()
+        space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
+        context, cleaned_code, detected_lang = load_code_page(confluence, space_key, request.page_title)
+    except Exception as e:
+        raise to_http_exception(e)
+    
+    def events():
+        summary = yield from stream_section(ai_model, "summary", code_summary_prompt(context, ai_model))
+        
+        modified_code = None
+        if request.instruction:
+            altered = yield from stream_section(
+                ai_model, "modified_code", code_alteration_prompt(cleaned_code, request.instruction)
+            )
+            modified_code = strip_code_fences(altered)
+        
+        converted_code = None
+        if request.target_language and request.target_language != detected_lang:
+            input_code = modified_code if modified_code else cleaned_code
+            converted = yield from stream_section(
+                ai_model, "converted_code", code_conversion_prompt(input_code, request.target_language)
+            )
+            converted_code = strip_code_fences(converted)
+        
+        yield sse_event("done", {
+            "summary": summary,
+            "original_code": cleaned_code,
+            "detected_language": detected_lang,
+            "modified_code": modified_code,
+            "converted_code": converted_code,
+            "target_language": request.target_language
+        })
+    
+    return sse_response(events())
 
 @app.post("/impact-analyzer")
-async def impact_analyzer(request: ImpactRequest, req: Request):
+def impact_analyzer(request: ImpactRequest, req: Request):
     """Impact Analyzer functionality"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("impact_analyzer", req)
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
         
         # Get pages
-        pages = confluence.get_all_pages_from_space(space=space_key, start=0, limit=100)
-        old_page = next((p for p in pages if p["title"] == request.old_page_title), None)
-        new_page = next((p for p in pages if p["title"] == request.new_page_title), None)
+        old_page = page_index.find(confluence, space_key, request.old_page_title)
+        new_page = page_index.find(confluence, space_key, request.new_page_title)
         
         if not old_page or not new_page:
             raise HTTPException(status_code=400, detail="One or both pages not found")
         
-        # Extract content from pages
-        def extract_content(content):
-            soup = BeautifulSoup(content, 'html.parser')
-            # Try to find code blocks first
-            code_blocks = soup.find_all('ac:structured-macro', {'ac:name': 'code'})
-            if code_blocks:
-                return '\n'.join(
-                    block.find('ac:plain-text-body').text
-                    for block in code_blocks if block.find('ac:plain-text-body')
-                )
-            # If no code blocks, extract all text content
-            return soup.get_text(separator="\n").strip()
-        
-        old_raw = confluence.get_page_by_id(old_page["id"], expand="body.storage")["body"]["storage"]["value"]
-        new_raw = confluence.get_page_by_id(new_page["id"], expand="body.storage")["body"]["storage"]["value"]
-        old_content = extract_content(old_raw)
-        new_content = extract_content(new_raw)
+        old_raw = page_cache.get_storage(confluence, old_page["id"], old_page.get("version"))
+        new_raw = page_cache.get_storage(confluence, new_page["id"], new_page.get("version"))
+        # Code macro bodies if present, otherwise all text content
+        old_content = extract_code_or_text(old_raw)
+        new_content = extract_code_or_text(new_raw)
         
         if not old_content or not new_content:
             raise HTTPException(status_code=400, detail="No content found in one or both pages")
         
-        # Generate diff
-        old_lines = old_content.splitlines()
-        new_lines = new_content.splitlines()
-        diff = difflib.unified_diff(old_lines, new_lines, fromfile=request.old_page_title, tofile=request.new_page_title, lineterm='')
-        full_diff_text = '\n'.join(diff)
-        
-        # Calculate metrics
-        lines_added = sum(1 for l in full_diff_text.splitlines() if l.startswith('+') and not l.startswith('+++'))
-        lines_removed = sum(1 for l in full_diff_text.splitlines() if l.startswith('-') and not l.startswith('---'))
-        total_lines = len(old_lines) or 1
+        # Generate diff and metrics on the CPU pool
+        diff = cpu_pool.run("impact_diff", cpu_tasks.diff_stats, old_content, new_content,
+                            request.old_page_title, request.new_page_title)
+        full_diff_text = diff["diff"]
+        lines_added = diff["lines_added"]
+        lines_removed = diff["lines_removed"]
+        total_lines = diff["old_line_count"] or 1
         percent_change = round(((lines_added + lines_removed) / total_lines) * 100, 2)
         
         # Generate AI analysis
-        def clean_and_truncate_prompt(text, max_chars=10000):
-            text = re.sub(r'<[^>]+>', '', text)
-            text = re.sub(r'[^\x00-\x7F]+', '', text)
-            return text[:max_chars]
-        
-        safe_diff = clean_and_truncate_prompt(full_diff_text)
+        safe_diff = prepare_diff_for_prompt(full_diff_text, "impact_analyzer", ai_model)
         
         # Impact analysis
         impact_prompt = f"""Write 2 paragraphs summarizing the overall impact of the following changes between two versions of a document.
@@ -973,9 +1547,6 @@ async def impact_analyzer(request: ImpactRequest, req: Request):
         Changes:
         {safe_diff}"""
         
-        impact_response = ai_model.generate_content(impact_prompt)
-        impact_text = impact_response.text.strip()
-        
         # Recommendations
         rec_prompt = f"""As a senior analyst, write 2 paragraphs suggesting improvements for the following changes.
 
@@ -989,22 +1560,8 @@ async def impact_analyzer(request: ImpactRequest, req: Request):
         Changes:
         {safe_diff}"""
         
-        rec_response = ai_model.generate_content(rec_prompt)
-        rec_text = rec_response.text.strip()
-        
         # Risk analysis
         risk_prompt = f"Assess the risk of each change in this document diff with severity tags (Low, Medium, High):\n\n{safe_diff}"
-        risk_response = ai_model.generate_content(risk_prompt)
-        raw_risk = risk_response.text.strip()
-        risk_text = re.sub(
-            r'\b(Low|Medium|High)\b',
-            lambda m: {
-                'Low': '🟢 Low',
-                'Medium': '🟡 Medium',
-                'High': '🔴 High'
-            }[m.group(0)],
-            raw_risk
-        )
         
         # Generate structured risk factors (new dynamic part)
         risk_factors_prompt = f"""
@@ -1025,26 +1582,43 @@ async def impact_analyzer(request: ImpactRequest, req: Request):
         {safe_diff}
         """
 
-        risk_factors_response = ai_model.generate_content(risk_factors_prompt)
-        risk_factors = risk_factors_response.text.strip().split("\n")
-        risk_factors = [re.sub(r"^[\*\-•\s]+", "", line).strip() for line in risk_factors if line.strip()]
-
-
-
-        # Stack Overflow Risk Check
-        stack_overflow_risks = []
-        if getattr(request, 'enable_stack_overflow_check', True):
-            # Check both old and new content for risks
-            combined_content = f"{old_content}\n{new_content}"
-            stack_overflow_risks = check_stack_overflow_risks(combined_content)
+        # The four analyses and the Stack Overflow check are independent, so
+        # they run concurrently; only the Q&A below waits on their results.
+        with ThreadPoolExecutor(max_workers=ANALYZER_FANOUT) as pool:
+            stack_overflow_future = None
+            if getattr(request, 'enable_stack_overflow_check', True):
+                # Check both old and new content for risks
+                combined_content = f"{old_content}\n{new_content}"
+                stack_overflow_future = pool.submit(check_stack_overflow_risks, combined_content)
+
+            # Opt-in single structured call; falls back to the separate prompts if unparseable
+            structured = structured_impact_analysis(ai_model, safe_diff, "a document") if request.structured_output else None
+            if structured:
+                impact_text = structured["impact_analysis"]
+                rec_text = structured["recommendations"]
+                risk_text = structured["risk_analysis"]
+                risk_factors = structured["risk_factors"]
+                change_severities = structured["change_severities"]
+            else:
+                impact_future = pool.submit(generate_text, ai_model, impact_prompt)
+                rec_future = pool.submit(generate_text, ai_model, rec_prompt)
+                risk_future = pool.submit(generate_text, ai_model, risk_prompt)
+                risk_factors_future = pool.submit(generate_text, ai_model, risk_factors_prompt)
+                impact_text = impact_future.result()
+                rec_text = rec_future.result()
+                risk_text = tag_risk_severity(risk_future.result())
+                risk_factors = risk_factors_future.result().split("\n")
+                risk_factors = [re.sub(r"^[\*\-•\s]+", "", line).strip() for line in risk_factors if line.strip()]
+                change_severities = None
+            stack_overflow_risks = stack_overflow_future.result() if stack_overflow_future else []
 
         # Q&A if question provided
         qa_answer = None
         if request.question:
             context = (
-                f"Summary: {impact_text[:1000]}\n"
-                f"Recommendations: {rec_text[:1000]}\n"
-                f"Risks: {risk_text[:1000]}\n"
+                f"Summary: {truncate_to_tokens(impact_text, 250)}\n"
+                f"Recommendations: {truncate_to_tokens(rec_text, 250)}\n"
+                f"Risks: {truncate_to_tokens(risk_text, 250)}\n"
                 f"Changes: +{lines_added}, -{lines_removed}, ~{percent_change}%"
             )
             qa_prompt = f"""You are an expert AI assistant. Based on the report below, answer the user's question clearly.
@@ -1071,19 +1645,18 @@ Answer:"""
             "risk_factors": risk_factors,
             "answer": qa_answer,
             "diff": full_diff_text,
-            "stack_overflow_risks": stack_overflow_risks
+            "stack_overflow_risks": stack_overflow_risks,
+            "change_severities": change_severities
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/direct-code-impact-analyzer")
-async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Request):
+def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Request):
     """Direct Code Impact Analyzer functionality - analyzes code without requiring Confluence pages"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("direct_code_impact_analyzer", req)
         
         old_content = request.old_code
         new_content = request.new_code
@@ -1091,25 +1664,17 @@ async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Req
         if not old_content or not new_content:
             raise HTTPException(status_code=400, detail="Both old and new code must be provided")
         
-        # Generate diff
-        old_lines = old_content.splitlines()
-        new_lines = new_content.splitlines()
-        diff = difflib.unified_diff(old_lines, new_lines, fromfile="original_code", tofile="modified_code", lineterm='')
-        full_diff_text = '\n'.join(diff)
-        
-        # Calculate metrics
-        lines_added = sum(1 for l in full_diff_text.splitlines() if l.startswith('+') and not l.startswith('+++'))
-        lines_removed = sum(1 for l in full_diff_text.splitlines() if l.startswith('-') and not l.startswith('---'))
-        total_lines = len(old_lines) or 1
+        # Generate diff and metrics on the CPU pool
+        diff = cpu_pool.run("impact_diff", cpu_tasks.diff_stats, old_content, new_content,
+                            "original_code", "modified_code")
+        full_diff_text = diff["diff"]
+        lines_added = diff["lines_added"]
+        lines_removed = diff["lines_removed"]
+        total_lines = diff["old_line_count"] or 1
         percent_change = round(((lines_added + lines_removed) / total_lines) * 100, 2)
         
         # Generate AI analysis
-        def clean_and_truncate_prompt(text, max_chars=10000):
-            text = re.sub(r'<[^>]+>', '', text)
-            text = re.sub(r'[^\x00-\x7F]+', '', text)
-            return text[:max_chars]
-        
-        safe_diff = clean_and_truncate_prompt(full_diff_text)
+        safe_diff = prepare_diff_for_prompt(full_diff_text, "direct_code_impact_analyzer", ai_model)
         
         # Impact analysis
         impact_prompt = f"""Write 2 paragraphs summarizing the overall impact of the following changes between two versions of code.
@@ -1124,9 +1689,6 @@ async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Req
         Changes:
         {safe_diff}"""
         
-        impact_response = ai_model.generate_content(impact_prompt)
-        impact_text = impact_response.text.strip()
-        
         # Recommendations
         rec_prompt = f"""As a senior developer, write 2 paragraphs suggesting improvements for the following code changes.
 
@@ -1141,22 +1703,8 @@ async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Req
         Changes:
         {safe_diff}"""
         
-        rec_response = ai_model.generate_content(rec_prompt)
-        rec_text = rec_response.text.strip()
-        
         # Risk analysis
         risk_prompt = f"Assess the risk of each change in this code diff with severity tags (Low, Medium, High):\n\n{safe_diff}"
-        risk_response = ai_model.generate_content(risk_prompt)
-        raw_risk = risk_response.text.strip()
-        risk_text = re.sub(
-            r'\b(Low|Medium|High)\b',
-            lambda m: {
-                'Low': '🟢 Low',
-                'Medium': '🟡 Medium',
-                'High': '🔴 High'
-            }[m.group(0)],
-            raw_risk
-        )
         
         # Generate structured risk factors
         risk_factors_prompt = f"""
@@ -1172,11 +1720,8 @@ async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Req
         - Compatibility problems
         """
         
-        risk_factors_response = ai_model.generate_content(risk_factors_prompt)
-        risk_factors = [line.strip()[2:] for line in risk_factors_response.text.strip().split('\n') if line.strip().startswith('- ')]
-        
-        # QA response if question provided
-        qa_answer = ""
+        # QA prompt if question provided
+        qa_prompt = None
         if request.question:
             qa_prompt = f"""Answer this specific question about the code changes: "{request.question}"
 
@@ -1184,14 +1729,36 @@ async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Req
             {safe_diff}
             
             Provide a concise, direct answer."""
-            qa_response = ai_model.generate_content(qa_prompt)
-            qa_answer = qa_response.text.strip()
         
-        # Stack Overflow risk check if enabled
-        stack_overflow_risks = []
-        if getattr(request, 'enable_stack_overflow_check', True):
-            combined_content = f"{old_content}\n{new_content}"
-            stack_overflow_risks = check_stack_overflow_risks(combined_content)
+        # Every stage here depends only on the diff, so all of them run concurrently
+        with ThreadPoolExecutor(max_workers=ANALYZER_FANOUT) as pool:
+            qa_future = pool.submit(generate_text, ai_model, qa_prompt) if qa_prompt else None
+            stack_overflow_future = None
+            # Stack Overflow risk check if enabled
+            if getattr(request, 'enable_stack_overflow_check', True):
+                combined_content = f"{old_content}\n{new_content}"
+                stack_overflow_future = pool.submit(check_stack_overflow_risks, combined_content)
+
+            # Opt-in single structured call; falls back to the separate prompts if unparseable
+            structured = structured_impact_analysis(ai_model, safe_diff, "code") if request.structured_output else None
+            if structured:
+                impact_text = structured["impact_analysis"]
+                rec_text = structured["recommendations"]
+                risk_text = structured["risk_analysis"]
+                risk_factors = structured["risk_factors"]
+                change_severities = structured["change_severities"]
+            else:
+                impact_future = pool.submit(generate_text, ai_model, impact_prompt)
+                rec_future = pool.submit(generate_text, ai_model, rec_prompt)
+                risk_future = pool.submit(generate_text, ai_model, risk_prompt)
+                risk_factors_future = pool.submit(generate_text, ai_model, risk_factors_prompt)
+                impact_text = impact_future.result()
+                rec_text = rec_future.result()
+                risk_text = tag_risk_severity(risk_future.result())
+                risk_factors = [line.strip()[2:] for line in risk_factors_future.result().split('\n') if line.strip().startswith('- ')]
+                change_severities = None
+            qa_answer = qa_future.result() if qa_future else ""
+            stack_overflow_risks = stack_overflow_future.result() if stack_overflow_future else []
         
         return {
             "lines_added": lines_added,
@@ -1206,19 +1773,18 @@ async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Req
             "risk_factors": risk_factors,
             "answer": qa_answer,
             "diff": full_diff_text,
-            "stack_overflow_risks": stack_overflow_risks
+            "stack_overflow_risks": stack_overflow_risks,
+            "change_severities": change_severities
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/push-to-jira-confluence-slack")
-async def push_to_jira_confluence_slack(request: PushToJiraConfluenceSlackRequest, req: Request):
+def push_to_jira_confluence_slack(request: PushToJiraConfluenceSlackRequest, req: Request):
     """Push extracted tasks from video summary to Jira, Confluence, and Slack"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("push_to_jira_confluence_slack", req)
         
         
         CONFLUENCE_USER_EMAIL = os.getenv("CONFLUENCE_USER_EMAIL")
@@ -1265,7 +1831,7 @@ Meeting Notes:
         # Helper functions
         def get_next_version(page_id: str) -> int:
             auth = base64.b64encode(f"{CONFLUENCE_USER_EMAIL}:{CONFLUENCE_API_KEY}".encode()).decode()
-            res = requests.get(
+            res = http_pool.get(
                 f"{CONFLUENCE_BASE_URL}/rest/api/content/{page_id}",
                 headers={"Authorization": f"Basic {auth}"}
             )
@@ -1299,7 +1865,7 @@ Meeting Notes:
                 }
             }
 
-            response = requests.put(
+            response = http_pool.put(
                 f"{CONFLUENCE_BASE_URL}/rest/api/content/{page_id}",
                 headers=headers,
                 json=payload
@@ -1340,7 +1906,7 @@ Meeting Notes:
                 }
             }
 
-            response = requests.post(url, headers=headers, auth=auth, json=payload)
+            response = http_pool.post(url, headers=headers, auth=auth, json=payload)
             print("🔄 Jira response:", response.status_code, response.text)
 
             if response.status_code == 201:
@@ -1357,7 +1923,7 @@ Meeting Notes:
 🔗 *Jira:* <{issue_link}|{issue_key}>
 """
 
-            response = requests.post(
+            response = http_pool.post(
                 "https://slack.com/api/chat.postMessage",
                 headers={
                     "Authorization": f"Bearer {SLACK_TOKEN}",
@@ -1401,35 +1967,11 @@ Meeting Notes:
         }
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
-@app.post("/test-support")
-async def test_support(request: TestRequest, req: Request):
-    """Test Support Tool functionality"""
-    try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
-        print(f"Test support request: {request}")  # Debug log
-        confluence = init_confluence()
-        space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
-        
-        # Get code page
-        pages = confluence.get_all_pages_from_space(space=space_key, start=0, limit=50)
-        code_page = next((p for p in pages if p["title"] == request.code_page_title), None)
-        
-        if not code_page:
-            raise HTTPException(status_code=400, detail="Code page not found")
-        
-        print(f"Found code page: {code_page['title']}")  # Debug log
-        
-        code_data = confluence.get_page_by_id(code_page["id"], expand="body.storage")
-        code_content = code_data["body"]["storage"]["value"]
-        
-        print(f"Code content length: {len(code_content)}")  # Debug log
-        
-        # Generate test strategy
-        prompt_strategy = f"""The following is a code snippet:\n\n{code_content[:2000]}\n\nPlease generate a **structured test strategy** for the above code using the following format. 
+def test_strategy_prompt(code_content: str, ai_model=None) -> str:
+    code = truncate_to_tokens(code_content, budget_for("test_support"), ai_model)
+    return f"""The following is a code snippet:\n\n{code}\n\nPlease generate a **structured test strategy** for the above code using the following format. 
 
 Make sure each section heading is **clearly labeled** and includes a **percentage estimate** of total testing effort and the total of all percentage values across Unit Test, Integration Test, and End-to-End (E2E) Test must add up to exactly **100%**. Each subpoint should be short (1–2 lines max). Use bullet points for clarity.
 
@@ -1486,13 +2028,9 @@ Make sure each section heading is **clearly labeled** and includes a **percentag
 
 Please format your response exactly like this structure, using proper markdown headings, short bullet points, and estimated test effort percentages. """
 
-        response_strategy = ai_model.generate_content(prompt_strategy)
-        strategy_text = response_strategy.text.strip()
-        
-        print(f"Strategy generated: {len(strategy_text)} chars")  # Debug log
-        
-        # Generate cross-platform testing
-        prompt_cross_platform = f"""You are a cross-platform UI testing expert. Analyze the following frontend code and generate a detailed cross-platform test strategy using the structure below. Your insights should be **relevant to the code**, not generic. Code:\n\n{code_content[:2000]}\n\nFollow the format strictly and customize values based on the code analysis. Avoid repeating default phrases — provide actual testing considerations derived from the code.
+def cross_platform_prompt(code_content: str, ai_model=None) -> str:
+    code = truncate_to_tokens(code_content, budget_for("test_support"), ai_model)
+    return f"""You are a cross-platform UI testing expert. Analyze the following frontend code and generate a detailed cross-platform test strategy using the structure below. Your insights should be **relevant to the code**, not generic. Code:\n\n{code}\n\nFollow the format strictly and customize values based on the code analysis. Avoid repeating default phrases — provide actual testing considerations derived from the code.
 
 ---
 
@@ -1547,36 +2085,70 @@ Please format your response exactly like this structure, using proper markdown h
 
 Respond **exactly** in this format with dynamic insights, no extra text outside the structure. """
 
+def sensitivity_prompt(test_input_content: str, ai_model=None) -> str:
+    data = truncate_to_tokens(test_input_content, budget_for("test_support"), ai_model)
+    return f"""You are a data privacy expert. Classify sensitive fields (PII, credentials, financial) and provide masking suggestions.Also, don't include comments if any code is present.\n\nData:\n{data}"""
+
+def test_support_qa_prompt(strategy_text: str, cross_text: str, sensitivity_text: Optional[str], question: str) -> str:
+    context = f"📘 Test Strategy:\n{strategy_text}\n🌐 Cross-Platform Testing:\n{cross_text}"
+    if sensitivity_text:
+        context += f"\n🔒 Sensitivity Analysis:\n{sensitivity_text}"
+    return f"""Based on the following content:\n{context}\n\nAnswer this user query: "{question}" """
+
+def load_test_support_pages(confluence, space_key: str, request: TestRequest):
+    """Return the storage body of the code page and, if requested and found, of the test input page"""
+    code_page = page_index.find(confluence, space_key, request.code_page_title)
+    
+    if not code_page:
+        raise HTTPException(status_code=400, detail="Code page not found")
+    
+    print(f"Found code page: {code_page['title']}")  # Debug log
+    
+    code_content = page_cache.get_storage(confluence, code_page["id"], code_page.get("version"))
+    
+    print(f"Code content length: {len(code_content)}")  # Debug log
+    
+    test_input_content = None
+    if request.test_input_page_title:
+        test_input_page = page_index.find(confluence, space_key, request.test_input_page_title)
+        if test_input_page:
+            test_input_content = page_cache.get_storage(confluence, test_input_page["id"], test_input_page.get("version"))
+    return code_content, test_input_content
 
-        response_cross_platform = ai_model.generate_content(prompt_cross_platform)
+@app.post("/test-support")
+def test_support(request: TestRequest, req: Request):
+    """Test Support Tool functionality"""
+    try:
+        ai_model = get_ai_model("test_support", req)
+        print(f"Test support request: {request}")  # Debug log
+        confluence = init_confluence()
+        space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
+        
+        code_content, test_input_content = load_test_support_pages(confluence, space_key, request)
+        
+        # Generate test strategy
+        response_strategy = ai_model.generate_content(test_strategy_prompt(code_content, ai_model))
+        strategy_text = response_strategy.text.strip()
+        
+        print(f"Strategy generated: {len(strategy_text)} chars")  # Debug log
+        
+        # Generate cross-platform testing
+        response_cross_platform = ai_model.generate_content(cross_platform_prompt(code_content, ai_model))
         cross_text = response_cross_platform.text.strip()
         
         print(f"Cross-platform generated: {len(cross_text)} chars")  # Debug log
         
         # Sensitivity analysis if test input page provided
         sensitivity_text = None
-        if request.test_input_page_title:
-            test_input_page = next((p for p in pages if p["title"] == request.test_input_page_title), None)
-            if test_input_page:
-                test_data = confluence.get_page_by_id(test_input_page["id"], expand="body.storage")
-                test_input_content = test_data["body"]["storage"]["value"]
-                
-                prompt_sensitivity = f"""You are a data privacy expert. Classify sensitive fields (PII, credentials, financial) and provide masking suggestions.Also, don't include comments if any code is present.\n\nData:\n{test_input_content[:2000]}"""
-
-
-
-                response_sensitivity = ai_model.generate_content(prompt_sensitivity)
-                sensitivity_text = response_sensitivity.text.strip()
-                print(f"Sensitivity generated: {len(sensitivity_text)} chars")  # Debug log
+        if test_input_content is not None:
+            response_sensitivity = ai_model.generate_content(sensitivity_prompt(test_input_content, ai_model))
+            sensitivity_text = response_sensitivity.text.strip()
+            print(f"Sensitivity generated: {len(sensitivity_text)} chars")  # Debug log
         
         # Q&A if question provided
         ai_response = None
         if request.question:
-            context = f"📘 Test Strategy:\n{strategy_text}\n🌐 Cross-Platform Testing:\n{cross_text}"
-            if sensitivity_text:
-                context += f"\n🔒 Sensitivity Analysis:\n{sensitivity_text}"
-            
-            prompt_chat = f"""Based on the following content:\n{context}\n\nAnswer this user query: "{request.question}" """
+            prompt_chat = test_support_qa_prompt(strategy_text, cross_text, sensitivity_text, request.question)
             response_chat = ai_model.generate_content(prompt_chat)
             ai_response = response_chat.text.strip()
             print(f"Q&A generated: {len(ai_response)} chars")  # Debug log
@@ -1593,35 +2165,70 @@ Respond **exactly** in this format with dynamic insights, no extra text outside
         
     except Exception as e:
         print(f"Test support error: {str(e)}")  # Debug log
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
+
+@app.post("/test-support/stream")
+def test_support_stream(request: TestRequest, req: Request):
+    """Test Support Tool streaming each section over Server-Sent Events"""
+    try:
+        ai_model = get_ai_model("test_support", req)
+        confluence = init_confluence()
+        space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
+        code_content, test_input_content = load_test_support_pages(confluence, space_key, request)
+    except Exception as e:
+        raise to_http_exception(e)
+    
+    def events():
+        strategy_text = yield from stream_section(ai_model, "test_strategy", test_strategy_prompt(code_content, ai_model))
+        cross_text = yield from stream_section(ai_model, "cross_platform_testing", cross_platform_prompt(code_content, ai_model))
+        
+        sensitivity_text = None
+        if test_input_content is not None:
+            sensitivity_text = yield from stream_section(
+                ai_model, "sensitivity_analysis", sensitivity_prompt(test_input_content, ai_model)
+            )
+        
+        ai_response = None
+        if request.question:
+            ai_response = yield from stream_section(
+                ai_model, "ai_response",
+                test_support_qa_prompt(strategy_text, cross_text, sensitivity_text, request.question)
+            )
+        
+        yield sse_event("done", {
+            "test_strategy": strategy_text,
+            "cross_platform_testing": cross_text,
+            "sensitivity_analysis": sensitivity_text,
+            "ai_response": ai_response
+        })
+    
+    return sse_response(events())
 
 @app.get("/images/{space_key}/{page_title}")
-async def get_images(space_key: Optional[str] = None, page_title: str = ""):
+def get_images(space_key: Optional[str] = None, page_title: str = ""):
     """Get all images, tables, and Excel attachments from a specific page"""
     try:
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, space_key)
         
         # Get page content
-        pages = confluence.get_all_pages_from_space(space=space_key, start=0, limit=100)
-        page = next((p for p in pages if p["title"].strip().lower() == page_title.strip().lower()), None)
+        page = page_index.find(confluence, space_key, page_title, case_insensitive=True)
         
         if not page:
             raise HTTPException(status_code=404, detail=f"Page '{page_title}' not found")
         
         page_id = page["id"]
-        html_content = confluence.get_page_by_id(page_id=page_id, expand="body.export_view")["body"]["export_view"]["value"]
-        soup = BeautifulSoup(html_content, "html.parser")
+        bundle = parse_page(page_cache.get_export_view(confluence, page_id, page.get("version")))
         base_url = os.getenv("CONFLUENCE_BASE_URL")
         
         # Images
         image_urls = list({
-            base_url + img["src"] if img["src"].startswith("/") else img["src"]
-            for img in soup.find_all("img") if img.get("src")
+            base_url + src if src.startswith("/") else src
+            for src in bundle.images
         })
         
         # Tables (as HTML strings)
-        tables = [str(table) for table in soup.find_all("table")]
+        tables = bundle.tables
         
         # Excel attachments
         excels = []
@@ -1642,36 +2249,25 @@ async def get_images(space_key: Optional[str] = None, page_title: str = ""):
         return {"images": image_urls, "tables": tables, "excels": excels}
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/image-summary")
-async def image_summary(request: ImageRequest, req: Request):
+def image_summary(request: ImageRequest, req: Request):
     """Generate AI summary for an image"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("image_summary", req)
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
         
         # Download image
-        auth = (os.getenv('CONFLUENCE_USER_EMAIL'), os.getenv('CONFLUENCE_API_KEY'))
-        response = requests.get(request.image_url, auth=auth)
-        if response.status_code != 200:
-            raise HTTPException(status_code=404, detail="Failed to fetch image")
-        
-        image_bytes = response.content
+        image_path = download_confluence_file(request.image_url, ".png", "Failed to fetch image")
         
         # Upload to Gemini
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-            tmp.write(image_bytes)
-            tmp.flush()
-            uploaded = genai.upload_file(
-                path=tmp.name,
-                mime_type="image/png",
-                display_name=f"confluence_image_{request.page_title}.png"
-            )
+        uploaded = ai_model.upload_file(
+            path=image_path,
+            mime_type="image/png",
+            display_name=f"confluence_image_{request.page_title}.png"
+        )
         
         prompt = (
             "You are analyzing a technical image from a documentation page. "
@@ -1686,38 +2282,34 @@ async def image_summary(request: ImageRequest, req: Request):
         return {"summary": summary}
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/image-qa")
-async def image_qa(request: ImageSummaryRequest, req: Request):
+def image_qa(request: ImageSummaryRequest, req: Request):
     """Generate AI response for a question about an image, table, or excel (uses summary if no image_url)"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("image_qa", req)
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
+        # Answers are scoped to the image/summary and invalidated when the page changes
+        page = page_index.find(confluence, space_key, request.page_title)
+        pages = [page] if page else []
+        scope = scope_key(space_key, request.image_url or "", request.summary, [[p["id"], p.get("version")] for p in pages])
+        cached_answer, question_vector = answer_cache.lookup("image_qa", scope, pages, request.question)
+        if cached_answer is not None:
+            return cached_answer
         # If image_url is provided and non-empty, use image logic
         if getattr(request, 'image_url', None):
             image_url = request.image_url
             if image_url:
                 # Download image
-                import requests
-                auth = (os.getenv('CONFLUENCE_USER_EMAIL'), os.getenv('CONFLUENCE_API_KEY'))
-                response = requests.get(image_url, auth=auth)
-                if response.status_code != 200:
-                    raise HTTPException(status_code=404, detail="Failed to fetch image")
-                image_bytes = response.content
+                image_path = download_confluence_file(image_url, ".png", "Failed to fetch image")
                 # Upload to Gemini
-                import tempfile
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_img:
-                    tmp_img.write(image_bytes)
-                    tmp_img.flush()
-                    uploaded_img = genai.upload_file(
-                        path=tmp_img.name,
-                        mime_type="image/png",
-                        display_name=f"qa_image_{request.page_title}.png"
-                    )
+                uploaded_img = ai_model.upload_file(
+                    path=image_path,
+                    mime_type="image/png",
+                    display_name=f"qa_image_{request.page_title}.png"
+                )
                 full_prompt = (
                     "You're analyzing a technical image extracted from documentation. "
                     "Answer the user's question based on the visual content of the image, "
@@ -1727,6 +2319,7 @@ async def image_qa(request: ImageSummaryRequest, req: Request):
                 )
                 ai_response = ai_model.generate_content([uploaded_img, full_prompt])
                 answer = ai_response.text.strip()
+                answer_cache.store("image_qa", scope, pages, request.question, question_vector, {"answer": answer})
                 return {"answer": answer}
         # Otherwise, use summary-only logic (for tables/excels)
         text_prompt = (
@@ -1737,61 +2330,34 @@ async def image_qa(request: ImageSummaryRequest, req: Request):
         )
         ai_response = ai_model.generate_content(text_prompt)
         answer = ai_response.text.strip()
+        answer_cache.store("image_qa", scope, pages, request.question, question_vector, {"answer": answer})
         return {"answer": answer}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/create-chart")
-async def create_chart(request: ChartRequest, req: Request):
+def create_chart(request: ChartRequest, req: Request):
     """Create chart from image, table, or Excel data"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("create_chart", req)
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
-        import pandas as pd
-        import matplotlib.pyplot as plt
-        import seaborn as sns
-        from io import StringIO
-        import tempfile
-        import requests
-        import base64
-        import io
-        # Priority: excel_url > table_html > image_url
-        df = None
+        # Priority: excel_url > table_html > image_url; the table is read and
+        # the chart rendered on the CPU pool
+        source = {}
         if request.excel_url:
-            # Download and read Excel file
-            auth = (os.getenv('CONFLUENCE_USER_EMAIL'), os.getenv('CONFLUENCE_API_KEY'))
-            response = requests.get(request.excel_url, auth=auth)
-            if response.status_code != 200:
-                raise HTTPException(status_code=404, detail="Failed to fetch Excel file")
-            excel_bytes = response.content
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_xls:
-                tmp_xls.write(excel_bytes)
-                tmp_xls.flush()
-                df = pd.read_excel(tmp_xls.name)
+            # Download Excel file
+            source["excel_path"] = download_confluence_file(request.excel_url, ".xlsx", "Failed to fetch Excel file")
         elif request.table_html:
-            # Parse HTML table to DataFrame
-            dfs = pd.read_html(request.table_html)
-            if not dfs:
-                raise HTTPException(status_code=400, detail="No table found in HTML")
-            df = dfs[0]
+            source["table_html"] = request.table_html
         elif request.image_url:
             # Existing image logic
-            auth = (os.getenv('CONFLUENCE_USER_EMAIL'), os.getenv('CONFLUENCE_API_KEY'))
-            response = requests.get(request.image_url, auth=auth)
-            if response.status_code != 200:
-                raise HTTPException(status_code=404, detail="Failed to fetch image")
-            image_bytes = response.content
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_img:
-                tmp_img.write(image_bytes)
-                tmp_img.flush()
-                uploaded_img = genai.upload_file(
-                    path=tmp_img.name,
-                    mime_type="image/png",
-                    display_name=f"chart_image_{request.page_title}.png"
-                )
+            image_path = download_confluence_file(request.image_url, ".png", "Failed to fetch image")
+            uploaded_img = ai_model.upload_file(
+                path=image_path,
+                mime_type="image/png",
+                display_name=f"chart_image_{request.page_title}.png"
+            )
             graph_prompt = (
                 "You're looking at a Likert-style bar chart image or table. Extract the full numeric table represented by the chart.\n"
                 "Return only the raw CSV table: no markdown, no comments, no code blocks.\n"
@@ -1812,56 +2378,14 @@ async def create_chart(request: ChartRequest, req: Request):
                     if line.split(",")[0] != header[0]:
                         cleaned_data.append(line)
                 return "\n".join(cleaned_data)
-            cleaned_csv = clean_ai_csv(csv_text)
-            df = pd.read_csv(StringIO(cleaned_csv))
+            source["csv_text"] = clean_ai_csv(csv_text)
         else:
             raise HTTPException(status_code=400, detail="No data source provided for chart generation")
-        # Clean and process DataFrame
-        for col in df.columns[1:]:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        df.dropna(subset=df.columns[1:], how='all', inplace=True)
-        if df.empty:
-            raise HTTPException(status_code=400, detail="Failed to extract chart data from provided source")
-        # Create chart based on type
-        plt.clf()
-        if request.chart_type == "Grouped Bar":
-            melted = df.melt(id_vars=[df.columns[0]], var_name="Group", value_name="Count")
-            plt.figure(figsize=(10, 6))
-            sns.barplot(data=melted, x=melted.columns[0], y="Count", hue="Group")
-            plt.xticks(rotation=45)
-            plt.title("Grouped Bar Chart")
-            plt.tight_layout()
-        elif request.chart_type == "Stacked Bar":
-            df_plot = df.set_index(df.columns[0])
-            plt.figure(figsize=(10, 6))
-            df_plot.drop(columns="Total", errors="ignore").plot(kind='bar', stacked=True)
-            plt.title("Stacked Bar Chart")
-            plt.xticks(rotation=45)
-            plt.ylabel("Count")
-            plt.tight_layout()
-        elif request.chart_type == "Line":
-            df_plot = df.set_index(df.columns[0])
-            plt.figure(figsize=(10, 6))
-            df_plot.drop(columns="Total", errors="ignore").plot(marker='o')
-            plt.title("Line Chart")
-            plt.xticks(rotation=45)
-            plt.ylabel("Count")
-            plt.tight_layout()
-        elif request.chart_type == "Pie":
-            plt.figure(figsize=(7, 6))
-            label_col = df.columns[0]
-            if "Total" in df.columns:
-                data = df["Total"]
-            else:
-                data = df.iloc[:, 1:].sum(axis=1)
-            plt.pie(data, labels=df[label_col], autopct="%1.1f%%", startangle=140)
-            plt.title("Pie Chart (Total Responses)")
-            plt.tight_layout()
-        # Save chart to bytes
-        buf = io.BytesIO()
-        plt.savefig(buf, format=request.format.lower(), bbox_inches="tight")
-        buf.seek(0)
-        chart_bytes = buf.getvalue()
+        try:
+            chart_bytes = cpu_pool.run("create_chart", cpu_tasks.render_chart,
+                                       request.chart_type, request.format.lower(), **source)
+        except cpu_tasks.TableDataError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         # Convert to base64 for response
         chart_base64 = base64.b64encode(chart_bytes).decode()
         return {
@@ -1870,15 +2394,13 @@ async def create_chart(request: ChartRequest, req: Request):
             "filename": f"{request.filename}.{request.format.lower()}"
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/export")
-async def export_content(request: ExportRequest, req: Request):
+def export_content(request: ExportRequest, req: Request):
     """Export content in various formats"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("export", req)
         if request.format == "pdf":
             buffer = create_pdf(request.content)
             file_data = buffer.getvalue()
@@ -1904,17 +2426,15 @@ async def export_content(request: ExportRequest, req: Request):
             file_data = buffer.getvalue()
             return {"file": file_data.decode('utf-8'), "mime": "text/plain", "filename": f"{request.filename}.txt"}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/save-to-confluence")
-async def save_to_confluence(request: SaveToConfluenceRequest, req: Request):
+def save_to_confluence(request: SaveToConfluenceRequest, req: Request):
     """
     Update the content of a Confluence page (storage format).
     """
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("save_to_confluence", req)
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, request.space_key)
         # Get page by title, expand body.storage
@@ -1937,18 +2457,25 @@ async def save_to_confluence(request: SaveToConfluenceRequest, req: Request):
             raise HTTPException(status_code=400, detail="Invalid mode. Use 'append' or 'overwrite'")
         
         # Update page
-        confluence.update_page(
+        updated = confluence.update_page(
             page_id=page_id,
             title=request.page_title,
             body=updated_body,
             representation="storage"
         )
+        # Only this page's version changed; keep the rest of the space index
+        page_index.put_page(space_key, {
+            "id": page_id,
+            "title": request.page_title,
+            "version": ((updated or {}).get("version") or {}).get("number"),
+        })
+        page_cache.invalidate(page_id)
         return {"message": "Page updated successfully"}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/preview-save-to-confluence")
-async def preview_save_to_confluence(request: PreviewSaveToConfluenceRequest, req: Request):
+def preview_save_to_confluence(request: PreviewSaveToConfluenceRequest, req: Request):
     """
     Preview the content that would be saved to a Confluence page.
     """
@@ -1979,15 +2506,27 @@ async def preview_save_to_confluence(request: PreviewSaveToConfluenceRequest, re
             "diff": diff
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
+
+def shortlist_pages_for_goal(space_key: str, goal: str, available_pages: List[str]) -> List[str]:
+    """Titles of the pages (of `available_pages`, if given) that best match the goal lexically"""
+    confluence = init_confluence()
+    space_key = auto_detect_space(confluence, space_key)
+    only = None
+    if available_pages:
+        only = [p["id"] for p in (page_index.find(confluence, space_key, t) for t in available_pages) if p]
+    shortlist = [page["title"] for page, _ in lexical_index.search(confluence, space_key, goal, ANALYZE_GOAL_SHORTLIST, only)]
+    # Goals sharing no terms with any page keep the caller's list (capped)
+    return shortlist or (available_pages or page_index.titles(confluence, space_key))[:ANALYZE_GOAL_SHORTLIST]
 
 @app.post("/analyze-goal", response_model=AnalyzeGoalResponse)
-async def analyze_goal(request: AnalyzeGoalRequest, req: Request):
+def analyze_goal(request: AnalyzeGoalRequest, req: Request):
     """Analyze a user goal and return which tools and pages to use, using Gemini."""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        ai_model = get_ai_model("analyze_goal", req)
+        available_pages = request.available_pages
+        if request.space_key and (not available_pages or len(available_pages) > ANALYZE_GOAL_SHORTLIST):
+            available_pages = shortlist_pages_for_goal(request.space_key, request.goal, available_pages)
         prompt = (
             "You are an expert AI agent orchestrator. "
             "Given the following user goal and a list of available Confluence page titles, decide which of these tools should be used to accomplish it: "
@@ -1995,7 +2534,7 @@ async def analyze_goal(request: AnalyzeGoalRequest, req: Request):
             "Also, select the most relevant page titles from the provided list that should be used to achieve the goal. "
             "Return a JSON object with three fields: 'tools' (a list of tool names to use, using these exact keys: 'ai_powered_search', 'impact_analyzer', 'code_assistant', 'video_summarizer', 'test_support', 'image_insights', 'chart_builder'), 'pages' (a list of relevant page titles from the provided list), and 'reasoning' (a short explanation of your choices). "
             "Return ONLY valid JSON, no extra text or explanation. Output your answer as a JSON object in a single code block. "
-            f"Available pages: {request.available_pages}\n"
+            f"Available pages: {available_pages}\n"
             f"User goal: '{request.goal}'"
         )
         response = ai_model.generate_content(prompt)
@@ -2027,23 +2566,18 @@ async def analyze_goal(request: AnalyzeGoalRequest, req: Request):
             raise HTTPException(status_code=400, detail=f"Gemini did not return valid tools/pages. Raw output:\n{response.text}")
         return {"tools": tools, "pages": pages, "reasoning": reasoning}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/table-summary")
-async def table_summary(request: TableSummaryRequest, req: Request):
+def table_summary(request: TableSummaryRequest, req: Request):
     """Generate AI summary for a table (HTML)"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
-        import pandas as pd
-        from io import StringIO
-        # Parse HTML table to DataFrame
-        dfs = pd.read_html(request.table_html)
-        if not dfs:
-            raise HTTPException(status_code=400, detail="No table found in HTML")
-        df = dfs[0]
-        csv_text = df.to_csv(index=False)
+        ai_model = get_ai_model("table_summary", req)
+        # Parse HTML table to CSV on the CPU pool
+        try:
+            csv_text = cpu_pool.run("table_summary", cpu_tasks.table_html_to_csv, request.table_html)
+        except cpu_tasks.TableDataError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         prompt = (
             "You are analyzing a table extracted from a Confluence page. "
             "Summarize the following table in detail. "
@@ -2055,29 +2589,16 @@ async def table_summary(request: TableSummaryRequest, req: Request):
         summary = response.text.strip()
         return {"summary": summary}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 @app.post("/excel-summary")
-async def excel_summary(request: ExcelSummaryRequest, req: Request):
+def excel_summary(request: ExcelSummaryRequest, req: Request):
     """Generate AI summary for an Excel file"""
     try:
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
-        import pandas as pd
-        import tempfile
-        import requests
-        # Download and read Excel file
-        auth = (os.getenv('CONFLUENCE_USER_EMAIL'), os.getenv('CONFLUENCE_API_KEY'))
-        response = requests.get(request.excel_url, auth=auth)
-        if response.status_code != 200:
-            raise HTTPException(status_code=404, detail="Failed to fetch Excel file")
-        excel_bytes = response.content
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_xls:
-            tmp_xls.write(excel_bytes)
-            tmp_xls.flush()
-            df = pd.read_excel(tmp_xls.name)
-        csv_text = df.to_csv(index=False)
+        ai_model = get_ai_model("excel_summary", req)
+        # Download Excel file and read it on the CPU pool
+        excel_path = download_confluence_file(request.excel_url, ".xlsx", "Failed to fetch Excel file")
+        csv_text = cpu_pool.run("excel_summary", cpu_tasks.excel_to_csv, excel_path)
         prompt = (
             "You are analyzing an Excel sheet extracted from a Confluence page. "
             "Summarize the following table in detail. "
@@ -2089,7 +2610,7 @@ async def excel_summary(request: ExcelSummaryRequest, req: Request):
         summary = response.text.strip()
         return {"summary": summary}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_exception(e)
 
 def send_to_google_chat(summary: str) -> bool:
     """
@@ -2102,7 +2623,7 @@ def send_to_google_chat(summary: str) -> bool:
     payload = {"text": f"AI Summary:\n{summary}"}
     headers = {"Content-Type": "application/json"}
     try:
-        resp = requests.post(webhook_url, json=payload, headers=headers, timeout=10)
+        resp = http_pool.post(webhook_url, json=payload, headers=headers, timeout=10)
         if resp.status_code == 200:
             return True
         else:
@@ -2113,7 +2634,7 @@ def send_to_google_chat(summary: str) -> bool:
         return False
 
 @app.post("/send-to-google-chat")
-async def send_to_google_chat_endpoint(payload: dict = Body(...)):
+def send_to_google_chat_endpoint(payload: dict = Body(...)):
     """
     Endpoint to send a summary to Google Chat.
     Expects JSON: { "summary": "..." }
@@ -2130,21 +2651,70 @@ async def send_to_google_chat_endpoint(payload: dict = Body(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sending to Google Chat: {str(e)}")
 
+@app.get("/mirror/status")
+async def mirror_status():
+    """Report what the local Confluence mirror holds and when it last synced"""
+    if mirror is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        **mirror.status(),
+        "last_results": mirror_syncer.last_results if mirror_syncer else {},
+    }
+
+@app.post("/mirror/sync/{space_key}")
+def mirror_sync(space_key: str, full: bool = False):
+    """Run a delta (or full, with ?full=true) sync of one space into the local mirror"""
+    if mirror is None:
+        raise HTTPException(status_code=400, detail="Confluence mirror is disabled. Set CONFLUENCE_MIRROR_SPACES to enable it.")
+    if not is_valid_space_key(space_key):
+        raise HTTPException(status_code=400, detail=f"Invalid space key: {space_key}")
+    try:
+        confluence = init_confluence()
+        result = mirror.sync_space(confluence, space_key, full=full)
+        page_index.invalidate(space_key)
+        return result
+    except Exception as e:
+        raise to_http_exception(e)
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Report hit/miss counters and sizes of the in-process caches"""
+    return {
+        "page_cache": page_cache.stats(),
+        "attachment_cache": attachment_cache.stats(),
+        "llm_cache": llm_cache.stats(),
+        "web_search_cache": web_search_cache.stats(),
+        "gemini_file_cache": file_cache.stats(),
+        "page_parse_cache": page_parser.stats(),
+        "context_cache": context_sessions.stats(),
+        "vector_index": vector_index.stats(),
+        "lexical_index": lexical_index.stats(),
+        "semantic_answer_cache": answer_cache.stats(),
+        "transcript_cache": transcript_cache.stats(),
+        "job_queue": job_queue.stats()
+    }
+
+@app.get("/cpu-pool/status")
+async def cpu_pool_status():
+    """Worker count, queue depth and per-task queue wait / run time of the CPU pool"""
+    return cpu_pool.stats()
+
+@app.get("/token-usage")
+async def get_token_usage():
+    """Prompt/output tokens reported by Gemini per endpoint, with the configured context budgets"""
+    return token_usage.stats()
+
+@app.get("/key-pool/status")
+async def key_pool_status():
+    """Per-key request budget, in-flight calls, rate-limit counters and circuit breaker state"""
+    return {"keys": key_pool.stats(), "breakers": breakers.stats(), "latency": latencies.stats()}
+
 @app.get("/test")
 async def test_endpoint():
     """Test endpoint to verify backend is working"""
     return {"message": "Backend is working", "status": "ok"}
 
-def get_actual_api_key_from_identifier(identifier: str) -> str:
-    if identifier and identifier.startswith('GENAI_API_KEY_'):
-        key = os.getenv(identifier)
-        print(f"Using API key identifier: {identifier}, value: {key}")  # This will appear in Render logs
-        if key:
-            return key
-    fallback = os.getenv('GENAI_API_KEY_1')
-    print(f"Falling back to GENAI_API_KEY_1, value: {fallback}")
-    return fallback
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,276 @@
+"""
+Version-aware cache of Confluence page bodies.
+
+Entries are keyed by page id and remember the page's version.number, the
+storage and export_view representations (each fetched lazily) and the
+cleaned plain text derived from storage. An entry is trusted without any
+network call for PAGE_CACHE_TTL seconds after it was last validated; after
+that a cheap `expand=version` probe decides whether the body must be
+refetched. Memory use is bounded by PAGE_CACHE_MAX_BYTES with LRU eviction.
+
+When a local store (the SQLite mirror) is attached, storage bodies whose
+mirrored version matches the known page version are read from it instead
+of Confluence, and it is used as a fallback if Confluence errors.
+
+prefetch_storage() fills the cache for many pages at once: misses are
+fetched with CQL `id in (...)` searches in batches of PAGE_BATCH_SIZE
+instead of one get_page_by_id round-trip per page.
+
+Tuning (environment variables):
+    PAGE_CACHE_TTL        seconds an entry is served without a version check (default 30)
+    PAGE_CACHE_MAX_BYTES  total body bytes kept in memory (default 64 MB)
+    PAGE_BATCH_SIZE       pages per CQL batch in prefetch_storage (default 25)
+    PAGE_FETCH_CONCURRENCY  parallel single-page fetches if a batch fails (default 8)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from page_parse import parse_page
+
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "30"))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PAGE_BATCH_SIZE = int(os.getenv("PAGE_BATCH_SIZE", "25"))
+PAGE_FETCH_CONCURRENCY = int(os.getenv("PAGE_FETCH_CONCURRENCY", "8"))
+
+REPRESENTATIONS = ("storage", "export_view")
+
+
+class PageEntry:
+    def __init__(self, page_id: str, version: Optional[int]):
+        self.page_id = page_id
+        self.version = version
+        self.title = None
+        self.bodies: Dict[str, str] = {}
+        self.text = None
+        self.checked_at = time.time()
+        self.stored_size = 0
+
+    @property
+    def size(self) -> int:
+        total = sum(len(v.encode("utf-8")) for v in self.bodies.values())
+        if self.text:
+            total += len(self.text.encode("utf-8"))
+        return total
+
+
+class PageContentCache:
+    def __init__(self, max_bytes: int = PAGE_CACHE_MAX_BYTES, ttl: float = PAGE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, PageEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.store = None
+
+    def set_store(self, store):
+        self.store = store
+
+    def _stored_page(self, page_id: str, version: Optional[int]) -> Optional[Dict]:
+        if self.store is None:
+            return None
+        page = self.store.get_page(page_id)
+        if page is None or page["body_storage"] is None:
+            return None
+        if version is not None and page["version"] != version:
+            return None
+        return page
+
+    def _current_version(self, confluence, page_id: str) -> Optional[int]:
+        page = confluence.get_page_by_id(page_id, expand="version")
+        return (page.get("version") or {}).get("number")
+
+    def _valid_entry(self, confluence, page_id: str, version: Optional[int]) -> Optional[PageEntry]:
+        """Return the cached entry if it still matches the live page version."""
+        with self._lock:
+            entry = self._entries.get(page_id)
+        if entry is None:
+            return None
+        if version is not None and entry.version is not None and version > entry.version:
+            return None
+        if time.time() - entry.checked_at > self.ttl:
+            live_version = self._current_version(confluence, page_id)
+            if live_version != entry.version:
+                return None
+            entry.checked_at = time.time()
+        return entry
+
+    def _store(self, entry: PageEntry):
+        with self._lock:
+            old = self._entries.pop(entry.page_id, None)
+            if old is not None:
+                self._bytes -= old.stored_size
+            entry.stored_size = entry.size
+            self._entries[entry.page_id] = entry
+            self._bytes += entry.stored_size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.stored_size
+
+    def _touch(self, page_id: str):
+        with self._lock:
+            if page_id in self._entries:
+                self._entries.move_to_end(page_id)
+
+    def get_body(self, confluence, page_id: str, representation: str = "storage",
+                 version: Optional[int] = None) -> str:
+        """Return the page body in the given representation ("storage" or "export_view")."""
+        if representation not in REPRESENTATIONS:
+            raise ValueError(f"Unsupported representation: {representation}")
+        page_id = str(page_id)
+        entry = self._valid_entry(confluence, page_id, version)
+        if entry is not None and representation in entry.bodies:
+            self.hits += 1
+            self._touch(page_id)
+            return entry.bodies[representation]
+        self.misses += 1
+        page = None
+        if representation == "storage" and version is not None:
+            stored = self._stored_page(page_id, version)
+            if stored is not None:
+                page = {
+                    "title": stored["title"],
+                    "version": {"number": stored["version"]},
+                    "body": {"storage": {"value": stored["body_storage"]}},
+                }
+        if page is None:
+            try:
+                page = confluence.get_page_by_id(page_id, expand=f"body.{representation},version")
+            except Exception:
+                stored = self._stored_page(page_id, None) if representation == "storage" else None
+                if stored is None:
+                    raise
+                print(f"Confluence unavailable, serving page {page_id} from local mirror")
+                return stored["body_storage"]
+        live_version = (page.get("version") or {}).get("number")
+        if entry is None or entry.version != live_version:
+            entry = PageEntry(page_id, live_version)
+        else:
+            # Same version, other representation already cached: keep both
+            entry.checked_at = time.time()
+        entry.title = page.get("title")
+        entry.bodies[representation] = page["body"][representation]["value"]
+        self._store(entry)
+        return entry.bodies[representation]
+
+    def _is_fresh(self, page_id: str, version: Optional[int]) -> bool:
+        """Whether a storage body can be served without any network call."""
+        with self._lock:
+            entry = self._entries.get(page_id)
+        if entry is None or "storage" not in entry.bodies:
+            return False
+        # A body newer than the requested version (the page index lagging behind) is fresh too, as in _valid_entry
+        if version is not None and entry.version is not None and version > entry.version:
+            return False
+        return time.time() - entry.checked_at <= self.ttl
+
+    def _store_storage(self, page_id: str, content: Dict):
+        version = (content.get("version") or {}).get("number")
+        with self._lock:
+            entry = self._entries.get(page_id)
+        if entry is None or entry.version != version:
+            entry = PageEntry(page_id, version)
+        entry.checked_at = time.time()
+        entry.title = content.get("title")
+        entry.bodies["storage"] = content["body"]["storage"]["value"]
+        self._store(entry)
+
+    def prefetch_storage(self, confluence, pages: List[Dict], batch_size: int = PAGE_BATCH_SIZE) -> Dict:
+        """Cache storage bodies for page-index entries, fetching misses in CQL batches.
+
+        Returns counters and per-batch timings.
+        """
+        needed = []
+        cached = 0
+        for page in pages:
+            page_id = str(page["id"])
+            version = page.get("version")
+            if self._is_fresh(page_id, version):
+                cached += 1
+                continue
+            stored = self._stored_page(page_id, version) if version is not None else None
+            if stored is not None:
+                self._store_storage(page_id, {
+                    "title": stored["title"],
+                    "version": {"number": stored["version"]},
+                    "body": {"storage": {"value": stored["body_storage"]}},
+                })
+                cached += 1
+                continue
+            needed.append(page_id)
+
+        batches = []
+        for i in range(0, len(needed), batch_size):
+            chunk = needed[i:i + batch_size]
+            started = time.time()
+            mode = "cql"
+            try:
+                response = confluence.get(
+                    "rest/api/content/search",
+                    params={
+                        "cql": f"id in ({','.join(chunk)})",
+                        "limit": len(chunk),
+                        "expand": "body.storage,version",
+                    },
+                )
+                for content in response.get("results", []):
+                    self._store_storage(str(content["id"]), content)
+            except Exception as e:
+                print(f"CQL batch fetch failed, falling back to single-page fetches: {e}")
+                mode = "concurrent"
+                with ThreadPoolExecutor(max_workers=min(PAGE_FETCH_CONCURRENCY, len(chunk))) as pool:
+                    list(pool.map(lambda page_id: self.get_storage(confluence, page_id), chunk))
+            batches.append({
+                "pages": len(chunk),
+                "mode": mode,
+                "seconds": round(time.time() - started, 3),
+            })
+        # Hits and misses are counted when the pages are read through get_body
+        return {"cached": cached, "fetched": len(needed), "batches": batches}
+
+    def get_storage(self, confluence, page_id: str, version: Optional[int] = None) -> str:
+        return self.get_body(confluence, page_id, "storage", version)
+
+    def get_export_view(self, confluence, page_id: str, version: Optional[int] = None) -> str:
+        return self.get_body(confluence, page_id, "export_view", version)
+
+    def get_text(self, confluence, page_id: str, version: Optional[int] = None) -> str:
+        """Return the cleaned plain text of the storage body."""
+        storage = self.get_storage(confluence, page_id, version)
+        with self._lock:
+            entry = self._entries.get(str(page_id))
+        if entry is not None and entry.text is not None:
+            return entry.text
+        text = parse_page(storage).text
+        if entry is not None and entry.bodies.get("storage") is storage:
+            entry.text = text
+            self._store(entry)
+        return text
+
+    def invalidate(self, page_id: Optional[str] = None):
+        with self._lock:
+            if page_id is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            entry = self._entries.pop(str(page_id), None)
+            if entry is not None:
+                self._bytes -= entry.stored_size
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+page_cache = PageContentCache()
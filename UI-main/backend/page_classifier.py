@@ -0,0 +1,109 @@
+"""
+Per-page content classification used by Agent Mode to route pages to tools.
+
+Each page is classified once per version from its storage body and its
+attachment list: code macros / <pre> blocks, .mp4 attachments, images,
+tables and Excel attachments. The result is kept in memory keyed by page id
+and version, so planning over a space does not download every body again.
+Attachment changes do not always bump the page version, so entries are also
+re-checked after PAGE_TYPE_TTL seconds.
+
+Tuning (environment variables):
+    PAGE_TYPE_TTL          seconds before a classification is re-checked (default 3600)
+    PAGE_TYPE_CONCURRENCY  pages classified in parallel for a space (default 8)
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from page_cache import page_cache
+from page_parse import parse_page
+
+PAGE_TYPE_TTL = float(os.getenv("PAGE_TYPE_TTL", "3600"))
+PAGE_TYPE_CONCURRENCY = int(os.getenv("PAGE_TYPE_CONCURRENCY", "8"))
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".svg", ".bmp", ".webp")
+EXCEL_EXTENSIONS = (".xls", ".xlsx")
+VIDEO_EXTENSIONS = (".mp4",)
+
+
+def extract_code_or_text(content: str) -> str:
+    """Code macro bodies if the page has any, otherwise all of its text."""
+    return parse_page(content).code_or_text()
+
+
+def classify_page(storage_html: str, attachments: List[Dict]) -> Dict:
+    bundle = parse_page(storage_html)
+    titles = [(att.get("title") or "").lower() for att in attachments]
+    has_code = bool(bundle.code_macros or bundle.code_blocks)
+    has_video = any(t.endswith(VIDEO_EXTENSIONS) for t in titles)
+    has_images = bundle.has_images or any(t.endswith(IMAGE_EXTENSIONS) for t in titles)
+    has_tables = bool(bundle.tables)
+    has_excel = any(t.endswith(EXCEL_EXTENSIONS) for t in titles)
+
+    if has_video:
+        content_type = "video"
+    elif has_code:
+        content_type = "code"
+    elif has_images or has_tables or has_excel:
+        content_type = "image"
+    else:
+        content_type = "text"
+    return {
+        "content_type": content_type,
+        "has_code": has_code,
+        "has_video": has_video,
+        "has_images": has_images,
+        "has_tables": has_tables,
+        "has_excel": has_excel,
+    }
+
+
+class PageTypeIndex:
+    def __init__(self, ttl: float = PAGE_TYPE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.store = None
+
+    def set_store(self, store):
+        self.store = store
+
+    def _attachments(self, confluence, page_id: str) -> List[Dict]:
+        if self.store is not None:
+            stored = self.store.get_page(page_id)
+            if stored is not None:
+                return self.store.get_attachments(page_id)
+        results = confluence.get_attachments_from_content(page_id=page_id, start=0, limit=100)
+        return results.get("results", [])
+
+    def get(self, confluence, page: Dict) -> Dict:
+        """Classification for a page-index entry ({"id", "title", "version"})."""
+        page_id = str(page["id"])
+        version = page.get("version")
+        with self._lock:
+            entry = self._entries.get(page_id)
+        if entry and entry["version"] == version and time.time() - entry["classified_at"] < self.ttl:
+            return entry["types"]
+        storage = page_cache.get_storage(confluence, page_id, version)
+        types = classify_page(storage, self._attachments(confluence, page_id))
+        with self._lock:
+            self._entries[page_id] = {"version": version, "classified_at": time.time(), "types": types}
+        return types
+
+    def classify_pages(self, confluence, pages: List[Dict]) -> List[Dict]:
+        def classify(page):
+            try:
+                types = self.get(confluence, page)
+            except Exception as e:
+                print(f"Page classification failed for {page['title']}: {e}")
+                types = {"content_type": "text"}
+            return {"id": page["id"], "title": page["title"], **types}
+
+        with ThreadPoolExecutor(max_workers=PAGE_TYPE_CONCURRENCY) as pool:
+            return list(pool.map(classify, pages))
+
+
+page_types = PageTypeIndex()
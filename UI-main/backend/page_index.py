@@ -0,0 +1,178 @@
+"""
+In-process title -> page index per Confluence space.
+
+Tools only need to map a page title to its id (and version), so instead of
+calling get_all_pages_from_space(limit=100) on every request we paginate the
+whole space once, keep exact and case-insensitive dictionaries for O(1)
+lookups, and refresh the index in the background once it is older than the
+TTL (stale entries keep being served while the refresh runs). If a local
+store (the SQLite mirror) is attached and has a fresh copy of the space,
+the index is built from it without calling Confluence. A title missing from
+the index is looked up with a single get_page_by_title call and added, so
+freshly created pages are found without reloading the whole space; titles
+Confluence does not know either (typos, deleted pages) are remembered as
+missing for PAGE_INDEX_TTL. Case-insensitive lookups never go remote, since
+get_page_by_title only matches exact titles.
+
+Tuning (environment variables):
+    PAGE_INDEX_TTL         seconds before a space index is refreshed (default 300)
+    PAGE_INDEX_PAGE_SIZE   page size used while paginating a space (default 100)
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+PAGE_INDEX_TTL = float(os.getenv("PAGE_INDEX_TTL", "300"))
+PAGE_INDEX_PAGE_SIZE = int(os.getenv("PAGE_INDEX_PAGE_SIZE", "100"))
+
+
+class SpacePageIndex:
+    def __init__(self, space_key: str, pages: List[Dict]):
+        self.space_key = space_key
+        self.loaded_at = time.time()
+        self.pages = pages
+        self.by_title = {}
+        self.by_lower_title = {}
+        # title -> time Confluence reported it missing
+        self.missing: Dict[str, float] = {}
+        for page in pages:
+            self.by_title.setdefault(page["title"], page)
+            self.by_lower_title.setdefault(page["title"].strip().lower(), page)
+
+    def age(self) -> float:
+        return time.time() - self.loaded_at
+
+    def lookup(self, title: str, case_insensitive: bool = False) -> Optional[Dict]:
+        if case_insensitive:
+            return self.by_lower_title.get(title.strip().lower())
+        return self.by_title.get(title)
+
+    def titles(self) -> List[str]:
+        return [p["title"] for p in self.pages]
+
+    def with_page(self, page: Dict) -> "SpacePageIndex":
+        """Copy of the index with `page` added or replaced (same id), keeping its load time."""
+        pages = [p for p in self.pages if str(p["id"]) != str(page["id"])] + [page]
+        index = SpacePageIndex(self.space_key, pages)
+        index.loaded_at = self.loaded_at
+        index.missing = {t: at for t, at in self.missing.items() if t != page["title"]}
+        return index
+
+
+def fetch_space_pages(confluence, space_key: str, page_size: int = PAGE_INDEX_PAGE_SIZE) -> List[Dict]:
+    """Paginate through every page of a space, returning id/title/version entries."""
+    pages = []
+    start = 0
+    while True:
+        batch = confluence.get_all_pages_from_space(
+            space=space_key, start=start, limit=page_size, expand="version"
+        )
+        if not batch:
+            break
+        for p in batch:
+            pages.append({
+                "id": p["id"],
+                "title": p["title"],
+                "version": (p.get("version") or {}).get("number"),
+            })
+        start += len(batch)
+    return pages
+
+
+class PageIndexCache:
+    def __init__(self, ttl: float = PAGE_INDEX_TTL):
+        self.ttl = ttl
+        self._indexes: Dict[str, SpacePageIndex] = {}
+        self._lock = threading.Lock()
+        self._space_locks: Dict[str, threading.Lock] = {}
+        self._refreshing = set()
+        self.store = None
+
+    def set_store(self, store):
+        self.store = store
+
+    def _space_lock(self, space_key: str) -> threading.Lock:
+        with self._lock:
+            return self._space_locks.setdefault(space_key, threading.Lock())
+
+    def _load(self, confluence, space_key: str, use_store: bool = True) -> SpacePageIndex:
+        if use_store and self.store is not None and self.store.is_fresh(space_key):
+            pages = self.store.get_pages(space_key)
+        else:
+            pages = fetch_space_pages(confluence, space_key)
+        index = SpacePageIndex(space_key, pages)
+        with self._lock:
+            self._indexes[space_key] = index
+        return index
+
+    def _refresh_in_background(self, confluence, space_key: str):
+        with self._lock:
+            if space_key in self._refreshing:
+                return
+            self._refreshing.add(space_key)
+
+        def run():
+            try:
+                with self._space_lock(space_key):
+                    self._load(confluence, space_key)
+            except Exception as e:
+                print(f"Page index refresh failed for space {space_key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(space_key)
+
+        threading.Thread(target=run, name=f"page-index-{space_key}", daemon=True).start()
+
+    def get(self, confluence, space_key: str, force_refresh: bool = False) -> SpacePageIndex:
+        index = self._indexes.get(space_key)
+        if index is None or force_refresh:
+            with self._space_lock(space_key):
+                current = self._indexes.get(space_key)
+                # Another thread may have loaded it while we waited
+                if current is not None and current is not index:
+                    return current
+                return self._load(confluence, space_key, use_store=not force_refresh)
+        if index.age() > self.ttl:
+            self._refresh_in_background(confluence, space_key)
+        return index
+
+    def find(self, confluence, space_key: str, title: str, case_insensitive: bool = False) -> Optional[Dict]:
+        """Look up a page by title; an exact-title miss asks Confluence for that one title and adds it."""
+        index = self.get(confluence, space_key)
+        page = index.lookup(title, case_insensitive)
+        if page is not None or case_insensitive:
+            return page
+        title = title.strip()
+        missing_since = index.missing.get(title)
+        if missing_since is not None and time.time() - missing_since < self.ttl:
+            return None
+        found = confluence.get_page_by_title(space=space_key, title=title, expand="version")
+        if not found:
+            with self._lock:
+                index.missing[title] = time.time()
+            return None
+        page = {"id": found["id"], "title": found["title"], "version": (found.get("version") or {}).get("number")}
+        self.put_page(space_key, page)
+        return page
+
+    def put_page(self, space_key: str, page: Dict):
+        """Add or update one page (e.g. its version after an edit) in a loaded space index."""
+        with self._lock:
+            index = self._indexes.get(space_key)
+            if index is not None:
+                # A new object, so consumers comparing index identity see the change
+                self._indexes[space_key] = index.with_page(page)
+
+    def titles(self, confluence, space_key: str) -> List[str]:
+        return self.get(confluence, space_key).titles()
+
+    def invalidate(self, space_key: Optional[str] = None):
+        with self._lock:
+            if space_key is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(space_key, None)
+
+
+page_index = PageIndexCache()
@@ -0,0 +1,183 @@
+"""
+One parse per page body, shared by every tool that reads a page.
+
+parse_page() turns a storage-format (or export_view) body into a PageBundle
+holding everything the tools extract from it: plain text, Confluence code
+macro bodies, <pre>/<code> blocks, image sources and attachment names, and
+table HTML. Bundles are cached by content hash, so search text, code
+extraction, impact analysis, classification and the image/table scan of the
+same page version all share a single parse.
+
+lxml is used when it is installed (several times faster than BeautifulSoup's
+pure-Python html.parser on large pages, see benchmark_page_parse.py);
+otherwise, or with PAGE_PARSE_BACKEND=html.parser, BeautifulSoup is used.
+libxml2's HTML parser drops CDATA sections, which is where storage format
+keeps code macro bodies, so they are escaped into plain text first. A body
+lxml rejects (control characters, malformed markup) is parsed with
+BeautifulSoup instead, on the request thread and on the CPU pool alike. Bodies
+of PAGE_PARSE_OFFLOAD_BYTES or more are parsed on the CPU pool (cpu_pool) so
+a huge page does not hold the GIL of the request workers.
+
+Tuning (environment variables):
+    PAGE_PARSE_BACKEND         lxml | html.parser (default lxml when installed)
+    PAGE_PARSE_CACHE_ENTRIES   parsed bundles kept in memory (default 256)
+    PAGE_PARSE_OFFLOAD_BYTES   bodies at least this large are parsed on the CPU pool (default 262144, 0 never)
+"""
+import hashlib
+import html
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+from bs4 import BeautifulSoup
+
+import cpu_tasks
+from cpu_pool import cpu_pool
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:  # optional speed-up
+    etree = None
+
+PAGE_PARSE_BACKEND = os.getenv("PAGE_PARSE_BACKEND", "lxml" if etree is not None else "html.parser")
+PAGE_PARSE_CACHE_ENTRIES = int(os.getenv("PAGE_PARSE_CACHE_ENTRIES", "256"))
+PAGE_PARSE_OFFLOAD_BYTES = int(os.getenv("PAGE_PARSE_OFFLOAD_BYTES", "262144"))
+
+CDATA_PATTERN = re.compile(r"<!\[CDATA\[(.*?)\]\]>", re.DOTALL)
+
+
+class PageBundle:
+    def __init__(self, text: str, code_macros: List[str], code_blocks: List[str],
+                 images: List[str], image_attachments: List[str], has_images: bool, tables: List[str]):
+        self.text = text
+        # Bodies of <ac:structured-macro ac:name="code"> macros
+        self.code_macros = code_macros
+        # Non-empty <pre>/<code> texts in document order (nested blocks appear twice, as with find_all)
+        self.code_blocks = code_blocks
+        # src of <img> tags (export_view) and ri:filename of <ac:image> attachments (storage)
+        self.images = images
+        self.image_attachments = image_attachments
+        # Any <img> or <ac:image>, including ones without a source
+        self.has_images = has_images
+        self.tables = tables
+
+    def code_or_text(self) -> str:
+        """Code macro bodies if the page has any, otherwise all of its text."""
+        if self.code_macros:
+            return '\n'.join(self.code_macros)
+        return self.text.strip()
+
+
+def _parse_with_soup(body: str) -> PageBundle:
+    soup = BeautifulSoup(body, "html.parser")
+    code_macros = [
+        block.find('ac:plain-text-body').text
+        for block in soup.find_all('ac:structured-macro', {'ac:name': 'code'})
+        if block.find('ac:plain-text-body')
+    ]
+    code_blocks = [t for t in (tag.get_text() for tag in soup.find_all(['pre', 'code'])) if t.strip()]
+    image_tags = soup.find_all(['ac:image', 'img'])
+    return PageBundle(
+        text=soup.get_text(separator="\n"),
+        code_macros=code_macros,
+        code_blocks=code_blocks,
+        images=[img["src"] for img in image_tags if img.name == "img" and img.get("src")],
+        image_attachments=[
+            att["ri:filename"] for img in image_tags if img.name == "ac:image"
+            for att in img.find_all("ri:attachment") if att.get("ri:filename")
+        ],
+        has_images=bool(image_tags),
+        tables=[str(table) for table in soup.find_all("table")],
+    )
+
+
+def _element_text(element) -> str:
+    return "".join(element.itertext())
+
+
+def _parse_with_lxml(body: str) -> PageBundle:
+    escaped = CDATA_PATTERN.sub(lambda m: html.escape(m.group(1), quote=False), body)
+    if not escaped.strip():
+        return PageBundle("", [], [], [], [], False, [])
+    root = lxml_html.fragment_fromstring(escaped, create_parent="div")
+    code_macros = []
+    for block in root.iter("ac:structured-macro"):
+        if block.get("ac:name") != "code":
+            continue
+        bodies = list(block.iter("ac:plain-text-body"))
+        if bodies:
+            code_macros.append(_element_text(bodies[0]))
+    code_blocks = [t for t in (_element_text(tag) for tag in root.iter("pre", "code")) if t.strip()]
+    images, image_attachments, has_images = [], [], False
+    for img in root.iter("img", "ac:image"):
+        has_images = True
+        if img.tag == "img":
+            if img.get("src"):
+                images.append(img.get("src"))
+        else:
+            image_attachments.extend(a.get("ri:filename") for a in img.iter("ri:attachment") if a.get("ri:filename"))
+    return PageBundle(
+        # Text nodes joined like BeautifulSoup's get_text(separator="\n")
+        text="\n".join(root.xpath(".//text()")),
+        code_macros=code_macros,
+        code_blocks=code_blocks,
+        images=images,
+        image_attachments=image_attachments,
+        has_images=has_images,
+        tables=[etree.tostring(t, method="html", encoding="unicode", with_tail=False) for t in root.iter("table")],
+    )
+
+
+def parse_body(body: str, backend: str) -> PageBundle:
+    """Parse with the given backend, falling back to BeautifulSoup when lxml rejects the body."""
+    if backend == "lxml" and etree is not None:
+        try:
+            return _parse_with_lxml(body)
+        except (ValueError, etree.LxmlError) as e:
+            print(f"lxml could not parse a page body ({e}); using html.parser")
+    return _parse_with_soup(body)
+
+
+class PageParseCache:
+    def __init__(self, backend: str = PAGE_PARSE_BACKEND, max_entries: int = PAGE_PARSE_CACHE_ENTRIES,
+                 offload_bytes: int = PAGE_PARSE_OFFLOAD_BYTES):
+        self.backend = backend if etree is not None else "html.parser"
+        self.max_entries = max_entries
+        self.offload_bytes = offload_bytes
+        self._bundles: "OrderedDict[str, PageBundle]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, body: str) -> PageBundle:
+        key = hashlib.sha1(body.encode("utf-8", "surrogatepass")).hexdigest()
+        with self._lock:
+            bundle = self._bundles.get(key)
+            if bundle is not None:
+                self._bundles.move_to_end(key)
+                self.hits += 1
+                return bundle
+            self.misses += 1
+        if self.offload_bytes and len(body) >= self.offload_bytes and cpu_pool.enabled:
+            bundle = cpu_pool.run("parse_page", cpu_tasks.parse_page_body, body, self.backend)
+        else:
+            bundle = parse_body(body, self.backend)
+        with self._lock:
+            self._bundles[key] = bundle
+            while len(self._bundles) > self.max_entries:
+                self._bundles.popitem(last=False)
+        return bundle
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": self.backend, "entries": len(self._bundles), "hits": self.hits, "misses": self.misses}
+
+
+page_parser = PageParseCache()
+
+
+def parse_page(body: str) -> PageBundle:
+    return page_parser.parse(body or "")
@@ -0,0 +1,253 @@
+"""
+Token-budgeted prompt assembly and per-call token usage reporting.
+
+Context placed into prompts (page text, transcripts, diffs, code) is sized in
+tokens against a per-endpoint budget instead of fixed character slices. Text
+over budget is split into chunks and the most valuable ones are kept, in
+their original order, with "[...]" marking gaps:
+
+- fit_relevant   chunks sharing the most terms with a question (search, Q&A)
+- fit_spread     chunks spread evenly over the text (summaries of a whole video)
+- fit_diff       diff hunks with the most changed lines
+- truncate_to_tokens  the head of the text, cut on a line boundary
+
+Tokens are estimated locally (PROMPT_CHARS_PER_TOKEN); with
+PROMPT_EXACT_COUNT=1 and a model passed in, the assembled context is also
+measured with Gemini's count_tokens and re-fitted once if it overshoots.
+
+token_usage collects prompt/output token counts reported by Gemini per
+endpoint (see /token-usage).
+
+Tuning (environment variables):
+    PROMPT_BUDGETS          per-endpoint context budgets, e.g. "search=16000,test_support=500"
+    PROMPT_DEFAULT_BUDGET   budget for endpoints without an entry (default 8000)
+    PROMPT_CHARS_PER_TOKEN  characters per token for the local estimate (default 4)
+    PROMPT_EXACT_COUNT      "1" to verify budgets with count_tokens (default "0")
+"""
+import math
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+PROMPT_DEFAULT_BUDGET = int(os.getenv("PROMPT_DEFAULT_BUDGET", "8000"))
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "4"))
+PROMPT_EXACT_COUNT = os.getenv("PROMPT_EXACT_COUNT", "0") == "1"
+
+# Context budgets in tokens. Where the old code sliced characters, the budget is that
+# slice at ~4 chars per token (transcripts 3000 chars, diffs 10000, test code and data
+# 2000); search and code assistant context had no limit before.
+DEFAULT_BUDGETS = {
+    "search": 16000,
+    "video_summarizer": 750,
+    "code_assistant": 8000,
+    "impact_analyzer": 2500,
+    "direct_code_impact_analyzer": 2500,
+    "test_support": 500,
+}
+CHUNK_TOKENS = 200
+GAP_MARKER = "[...]"
+WORD_PATTERN = re.compile(r"[a-z0-9_]{3,}")
+
+
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    budgets = {}
+    for item in raw.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            budgets[name.strip()] = int(value)
+    return budgets
+
+
+PROMPT_BUDGETS = {**DEFAULT_BUDGETS, **_parse_budgets(os.getenv("PROMPT_BUDGETS", ""))}
+
+
+def budget_for(endpoint: str) -> int:
+    return PROMPT_BUDGETS.get(endpoint, PROMPT_DEFAULT_BUDGET)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN)
+
+
+def count_tokens(text: str, model=None) -> int:
+    """Exact count from Gemini when enabled and a model is given, otherwise the local estimate."""
+    if PROMPT_EXACT_COUNT and model is not None and text:
+        try:
+            return model.count_tokens(text).total_tokens
+        except Exception as e:
+            print(f"count_tokens failed, using estimate: {e}")
+    return estimate_tokens(text)
+
+
+def split_chunks(text: str, chunk_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """Split on blank lines/lines, merging small paragraphs up to ~chunk_tokens each."""
+    chunks, current, size = [], [], 0
+    for line in text.splitlines():
+        line_tokens = estimate_tokens(line)
+        if current and (size + line_tokens > chunk_tokens or (not line.strip() and size >= chunk_tokens // 2)):
+            chunks.append("\n".join(current).strip("\n"))
+            current, size = [], 0
+        if line_tokens > chunk_tokens:
+            # A single huge line (minified code, one-line transcript): hard-split it
+            step = int(chunk_tokens * PROMPT_CHARS_PER_TOKEN)
+            chunks.extend(line[i:i + step] for i in range(0, len(line), step))
+            continue
+        current.append(line)
+        size += line_tokens
+    if current:
+        chunks.append("\n".join(current).strip("\n"))
+    return [c for c in chunks if c.strip()]
+
+
+def _keep(chunks: List[str], scores: List[float], max_tokens: int) -> set:
+    """Indexes of the highest-scoring chunks that fit in max_tokens (earlier chunks win ties)."""
+    order = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+    kept, used = set(), 0
+    for i in order:
+        cost = estimate_tokens(chunks[i]) + 1
+        if used + cost <= max_tokens:
+            kept.add(i)
+            used += cost
+    return kept
+
+
+def _join(indexed_chunks: List[Tuple[int, str]], kept: set) -> str:
+    parts = []
+    for i, chunk in indexed_chunks:
+        if i in kept:
+            parts.append(chunk)
+        elif not parts or parts[-1] != GAP_MARKER:
+            parts.append(GAP_MARKER)
+    return "\n".join(parts)
+
+
+def _select(chunks: List[str], scores: List[float], max_tokens: int) -> str:
+    return _join(list(enumerate(chunks)), _keep(chunks, scores, max_tokens))
+
+
+def _fit(text: str, max_tokens: int, model, build: Callable[[int], str]) -> str:
+    exact = PROMPT_EXACT_COUNT and model is not None
+    estimate = estimate_tokens(text)
+    if estimate <= max_tokens:
+        # Only texts close to the budget are worth an exact count
+        if not exact or estimate <= max_tokens * 0.8 or count_tokens(text, model) <= max_tokens:
+            return text
+    fitted = build(max_tokens)
+    if exact:
+        actual = count_tokens(fitted, model)
+        if actual > max_tokens:
+            fitted = build(int(max_tokens * max_tokens / actual * 0.95))
+    return fitted
+
+
+def _terms(text: str) -> set:
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def _relevance(chunk: str, query_terms: set) -> float:
+    if not query_terms:
+        return 0.0
+    return len(_terms(chunk) & query_terms) / len(query_terms)
+
+
+def query_coverage(query: str, text: str) -> float:
+    """Share of the query's terms that occur in `text` (1.0 for a query without terms)."""
+    query_terms = _terms(query)
+    if not query_terms:
+        return 1.0
+    return len(query_terms & _terms(text)) / len(query_terms)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model=None) -> str:
+    def build(limit: int) -> str:
+        cut = text[:int(limit * PROMPT_CHARS_PER_TOKEN)]
+        if "\n" in cut:
+            cut = cut[:cut.rfind("\n")]
+        return cut
+    return _fit(text, max_tokens, model, build)
+
+
+def fit_relevant(text: str, query: str, max_tokens: int, model=None) -> str:
+    chunks = split_chunks(text)
+    query_terms = _terms(query)
+    # Ties keep earlier chunks, so an unrelated question degrades to head truncation
+    scores = [_relevance(c, query_terms) for c in chunks]
+    return _fit(text, max_tokens, model, lambda limit: _select(chunks, scores, limit))
+
+
+def fit_spread(text: str, max_tokens: int, model=None) -> str:
+    chunks = split_chunks(text)
+
+    def build(limit: int) -> str:
+        keep = max(1, min(len(chunks), limit // CHUNK_TOKENS))
+        stride = len(chunks) / keep
+        picked = {int(i * stride) for i in range(keep)}
+        return _select(chunks, [1.0 if i in picked else 0.0 for i in range(len(chunks))], limit)
+    return _fit(text, max_tokens, model, build)
+
+
+def fit_diff(diff_text: str, max_tokens: int, model=None) -> str:
+    """Keep the file headers and the hunks with the most added/removed lines."""
+    hunks = re.split(r"(?m)^(?=@@)", diff_text)
+    scores = [
+        1e9 if not h.startswith("@@") else
+        sum(1 for l in h.splitlines() if l.startswith(("+", "-")) and not l.startswith(("+++", "---")))
+        for h in hunks
+    ]
+    hunks = [h.rstrip("\n") for h in hunks]
+    return _fit(diff_text, max_tokens, model, lambda limit: _select(hunks, scores, limit))
+
+
+def fit_documents(documents: List[Tuple[str, str]], query: str, max_tokens: int) -> List[Tuple[str, str]]:
+    """Share one budget across several (title, text) documents by relevance to `query`."""
+    total = sum(estimate_tokens(text) for _, text in documents)
+    if total <= max_tokens:
+        return documents
+    owners, chunks = [], []
+    for doc_index, (title, text) in enumerate(documents):
+        for chunk in split_chunks(text):
+            owners.append(doc_index)
+            chunks.append(chunk)
+    query_terms = _terms(query)
+    # Titles matching the question lift every chunk of that page a little
+    title_bonus = [0.25 * _relevance(title, query_terms) for title, _ in documents]
+    scores = [_relevance(c, query_terms) + title_bonus[owners[i]] for i, c in enumerate(chunks)]
+    kept = _keep(chunks, scores, max_tokens)
+    return [
+        (title, _join([(i, c) for i, c in enumerate(chunks) if owners[i] == doc_index], kept))
+        for doc_index, (title, _) in enumerate(documents)
+    ]
+
+
+class TokenUsage:
+    """Prompt/output token counts reported by Gemini, per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints: Dict[str, Dict[str, int]] = {}
+
+    def record(self, endpoint: str, usage_metadata, estimated_prompt_tokens: Optional[int] = None):
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage_metadata, "candidates_token_count", 0) or 0
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", 0) or 0
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "estimated_prompt_tokens": 0
+            })
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["cached_tokens"] += cached_tokens
+            stats["output_tokens"] += output_tokens
+            stats["estimated_prompt_tokens"] += estimated_prompt_tokens or 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "budgets": dict(PROMPT_BUDGETS),
+                "default_budget": PROMPT_DEFAULT_BUDGET,
+                "endpoints": {k: dict(v) for k, v in self.endpoints.items()},
+            }
+
+
+token_usage = TokenUsage()
@@ -0,0 +1,178 @@
+"""
+Failure handling primitives for Gemini calls: retry classification, jittered
+exponential backoff, per key/model circuit breakers and the latency window
+used to decide when to hedge.
+
+CachedModel retries 429/5xx/deadline errors with full-jitter backoff, moving
+to another key on each attempt. A key/model pair that keeps failing opens its
+breaker and is skipped until GEMINI_BREAKER_RESET has passed. The breaker
+then turns half-open: it admits a single probe call and keeps reporting open
+to every other caller until that probe succeeds (closing it) or fails
+(re-opening it). When every usable key is open the call fails fast with
+GeminiUnavailableError, which endpoints report as HTTP 503 with
+Retry-After. With GEMINI_HEDGE_ENABLED=1 a second request is sent on another
+key once the first has been outstanding longer than the observed p95 latency,
+and whichever answers first wins.
+
+Tuning (environment variables):
+    GEMINI_MAX_RETRIES        retries after the first attempt (default 3)
+    GEMINI_BACKOFF_BASE       first backoff ceiling in seconds (default 0.5)
+    GEMINI_BACKOFF_MAX        largest backoff ceiling in seconds (default 8)
+    GEMINI_BREAKER_FAILURES   consecutive failures that open a breaker (default 5)
+    GEMINI_BREAKER_RESET      seconds a breaker stays open (default 30)
+    GEMINI_HEDGE_ENABLED      "1" to hedge slow calls on a second key (default "0")
+    GEMINI_HEDGE_MIN_DELAY    lower bound / cold-start value for the hedge delay (default 2)
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Set, Tuple
+
+from google.api_core import exceptions as google_exceptions
+
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "8"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "0") == "1"
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "2"))
+
+class ProbeInFlightError(Exception):
+    """The key's breaker is half-open and another call holds its probe; retried on another key."""
+
+
+RETRYABLE_EXCEPTIONS = (
+    ProbeInFlightError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+
+class GeminiUnavailableError(Exception):
+    def __init__(self, message: str, retry_after: float = GEMINI_BREAKER_RESET):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(exc: Exception) -> bool:
+    return isinstance(exc, RETRYABLE_EXCEPTIONS) or getattr(exc, "code", None) in RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry number (0-based)."""
+    return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = GEMINI_BREAKER_FAILURES, reset_timeout: float = GEMINI_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # Set while the single half-open probe is outstanding
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        if self.opened_at is None:
+            return False
+        return self.probing or time.monotonic() - self.opened_at < self.reset_timeout
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        remaining = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        # A probe is deciding right now; ask clients to come back shortly
+        return max(remaining, 1.0) if self.probing else remaining
+
+    def allow_request(self) -> Optional[str]:
+        """"closed" when calls flow normally, "probe" when this caller holds the half-open probe, None if refused."""
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return None
+            self.probing = True
+            return "probe"
+
+    def release_probe(self):
+        """End a probe that gave no verdict (non-retryable error, abandoned stream) so the next call probes."""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            # A failed probe re-opens the breaker at once; otherwise it opens past the threshold
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class CircuitBreakers:
+    def __init__(self):
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key_name: str, model_name: str) -> CircuitBreaker:
+        with self._lock:
+            return self._breakers.setdefault((key_name, model_name), CircuitBreaker())
+
+    def open_keys(self, model_name: str) -> Set[str]:
+        with self._lock:
+            return {k for (k, m), b in self._breakers.items() if m == model_name and b.is_open()}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                f"{k}/{m}": {"failures": b.failures, "open": b.is_open(), "probing": b.probing,
+                             "retry_after": round(b.retry_after(), 1)}
+                for (k, m), b in self._breakers.items()
+            }
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies per model, for the hedge delay."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model_name, deque(maxlen=self.window)).append(seconds)
+
+    def p95(self, model_name: str):
+        with self._lock:
+            samples = sorted(self._samples.get(model_name, ()))
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def hedge_delay(self, model_name: str) -> float:
+        p95 = self.p95(model_name)
+        return max(GEMINI_HEDGE_MIN_DELAY, p95 or 0.0)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            models = list(self._samples)
+        return {m: {"p95": self.p95(m), "samples": len(self._samples[m])} for m in models}
+
+
+breakers = CircuitBreakers()
+latencies = LatencyTracker()
@@ -0,0 +1,62 @@
+"""
+Server-Sent Events helpers for the streaming (`/.../stream`) endpoints.
+
+A streaming tool is a generator of SSE frames. Every long Gemini generation
+is a "section" whose text is pushed as `delta` frames while Gemini streams
+tokens, so the UI can render output as it arrives instead of waiting for the
+whole response. Frames sent:
+
+    event: status         {"message": ...}                 progress of non-LLM work
+    event: section_start  {"section": ...}
+    event: delta          {"section": ..., "text": ...}    partial text
+    event: section_end    {"section": ..., "text": ...}    full text of the section
+    event: done           same JSON body as the non-streaming endpoint
+    event: error          {"detail": ..., "status_code": ...}
+    event: job            job status and stages (/jobs/{id}/events only)
+"""
+import json
+from typing import Any, Generator, Iterator
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from resilience import GeminiUnavailableError
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # Stop nginx-style proxies from buffering the stream
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_section(ai_model, section: str, prompt) -> Generator[str, None, str]:
+    """Stream one generation as section frames; `yield from` returns the full text."""
+    yield sse_event("section_start", {"section": section})
+    parts = []
+    for piece in ai_model.stream_text(prompt):
+        parts.append(piece)
+        yield sse_event("delta", {"section": section, "text": piece})
+    text = "".join(parts).strip()
+    yield sse_event("section_end", {"section": section, "text": text})
+    return text
+
+
+def sse_response(events: Iterator[str]) -> StreamingResponse:
+    """Wrap an event generator; failures after the stream started become an `error` frame."""
+    def guarded():
+        try:
+            yield from events
+        except HTTPException as e:
+            yield sse_event("error", {"detail": e.detail, "status_code": e.status_code})
+        except GeminiUnavailableError as e:
+            yield sse_event("error", {"detail": str(e), "status_code": 503, "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"Streaming response failed: {e}")
+            yield sse_event("error", {"detail": str(e), "status_code": 500})
+
+    return StreamingResponse(guarded(), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,123 @@
+"""sync_space against a stub Confluence client: full crawl, delta window, cursor paging, delete reconcile."""
+import math
+import os
+import tempfile
+import time
+import unittest
+
+import confluence_mirror
+from confluence_mirror import DELTA_OVERLAP_MINUTES, ConfluenceMirror
+
+
+def make_page(page_id, title, version, body, attachments=()):
+    return {
+        "id": page_id,
+        "title": title,
+        "version": {"number": version, "when": "2026-01-01T00:00:00.000Z"},
+        "body": {"storage": {"value": body}},
+        "children": {"attachment": {"results": list(attachments), "_links": {}}},
+    }
+
+
+class StubConfluence:
+    """Serves CQL searches from `search_results`, two results per response, linked by a next cursor."""
+
+    page_size = 2
+
+    def __init__(self, pages):
+        self.pages = {p["id"]: p for p in pages}
+        self.search_results = list(pages)
+        self.cql = []
+        self.gets = []
+
+    def _search_response(self, offset):
+        batch = self.search_results[offset:offset + self.page_size]
+        links = {}
+        if offset + self.page_size < len(self.search_results):
+            links["next"] = f"rest/api/content/search?cursor={offset + self.page_size}"
+        return {"results": batch, "_links": links}
+
+    def get(self, path, params=None):
+        self.gets.append(path)
+        if path == "rest/api/content/search":
+            self.cql.append(params["cql"])
+            return self._search_response(0)
+        return self._search_response(int(path.rsplit("=", 1)[1]))
+
+    def get_all_pages_from_space(self, space, start=0, limit=100, expand=None):
+        listing = sorted(self.pages.values(), key=lambda p: p["id"])
+        return listing[start:start + limit]
+
+
+class SyncSpaceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.mirror = ConfluenceMirror(os.path.join(self.tmp.name, "mirror.db"))
+        attachment = {"id": "att1", "title": "demo.mp4", "extensions": {"mediaType": "video/mp4", "fileSize": 10},
+                      "version": {"number": 2}, "_links": {"download": "/download/demo.mp4"}}
+        self.confluence = StubConfluence([
+            make_page("1", "One", 1, "<p>one</p>", [attachment]),
+            make_page("2", "Two", 1, "<p>two</p>"),
+            make_page("3", "Three", 1, "<p>three</p>"),
+        ])
+
+    def tearDown(self):
+        self.mirror._conn.close()
+        self.tmp.cleanup()
+
+    def test_first_sync_crawls_the_space_following_the_cursor(self):
+        result = self.mirror.sync_space(self.confluence, "DOC")
+
+        self.assertEqual(result["mode"], "full")
+        self.assertEqual(result["pages_updated"], 3)
+        self.assertEqual(self.confluence.cql, ['space = "DOC" and type = page'])
+        self.assertIn("rest/api/content/search?cursor=2", self.confluence.gets)
+        self.assertEqual([p["title"] for p in self.mirror.get_pages("DOC")], ["One", "Three", "Two"])
+        self.assertEqual(self.mirror.get_page("1")["body_storage"], "<p>one</p>")
+        attachments = self.mirror.get_attachments("1")
+        self.assertEqual([(a["title"], a["media_type"], a["version"]) for a in attachments], [("demo.mp4", "video/mp4", 2)])
+        self.assertTrue(self.mirror.is_fresh("DOC"))
+
+    def test_later_syncs_only_ask_for_the_delta_window(self):
+        self.mirror.sync_space(self.confluence, "DOC")
+        last_started = self.mirror.space_info("DOC")["last_sync_started"]
+        self.confluence.search_results = [make_page("2", "Two", 2, "<p>two, edited</p>")]
+
+        result = self.mirror.sync_space(self.confluence, "DOC")
+
+        minutes = math.ceil((time.time() - last_started) / 60) + DELTA_OVERLAP_MINUTES
+        self.assertEqual(result["mode"], "delta")
+        self.assertEqual(result["pages_updated"], 1)
+        self.assertEqual(self.confluence.cql[-1], f'space = "DOC" and type = page and lastmodified >= now("-{minutes}m")')
+        page = self.mirror.get_page("2")
+        self.assertEqual((page["version"], page["body_storage"]), (2, "<p>two, edited</p>"))
+
+    def test_reconcile_drops_deleted_pages(self):
+        self.mirror.sync_space(self.confluence, "DOC")
+        del self.confluence.pages["1"]
+        self.confluence.search_results = list(self.confluence.pages.values())
+
+        result = self.mirror.sync_space(self.confluence, "DOC", full=True)
+
+        self.assertEqual(result["pages_removed"], 1)
+        self.assertIsNone(self.mirror.get_page("1"))
+        self.assertEqual(self.mirror.get_attachments("1"), [])
+
+    def test_delta_sync_reconciles_only_after_the_interval(self):
+        self.mirror.sync_space(self.confluence, "DOC")
+        del self.confluence.pages["3"]
+        self.confluence.search_results = []
+
+        self.assertEqual(self.mirror.sync_space(self.confluence, "DOC")["pages_removed"], 0)
+        self.mirror._conn.execute("UPDATE spaces SET last_reconciled = ?", (time.time() - confluence_mirror.MIRROR_RECONCILE - 1,))
+        self.assertEqual(self.mirror.sync_space(self.confluence, "DOC")["pages_removed"], 1)
+
+    def test_space_keys_that_could_break_out_of_cql_are_rejected(self):
+        for space_key in ['DOC" or space = "HR', "DOC OR 1=1", ""]:
+            with self.assertRaises(ValueError):
+                self.mirror.sync_space(self.confluence, space_key)
+        self.assertEqual(self.confluence.cql, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Persistent AssemblyAI transcripts per video attachment version.
+
+A transcript (text, words, chapters, highlights, speaker turns) is stored in
+SQLite under (attachment id, attachment version), so /video-summarizer
+questions and re-summaries after a restart or after the in-memory context
+session expired skip the download, ffmpeg, upload and transcription and go
+straight to Gemini. Concurrent requests for a video that is not stored yet
+wait for a single transcription. Storing a new version of an attachment drops
+its older versions; videos without a version number are not stored.
+
+Tuning (environment variables):
+    TRANSCRIPT_CACHE_DB   SQLite file (default .cache/transcripts.db)
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from cache_db import CACHE_DIR, open_cache_db
+
+TRANSCRIPT_CACHE_DB = os.getenv("TRANSCRIPT_CACHE_DB", os.path.join(CACHE_DIR, "transcripts.db"))
+
+TRANSCRIPT_FIELDS = ("text", "words", "chapters", "highlights", "speakers")
+
+
+class TranscriptCache:
+    def __init__(self, db_path: str = TRANSCRIPT_CACHE_DB):
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.transcriptions = 0
+        self._conn = open_cache_db(db_path)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                "attachment_id TEXT, version INTEGER, text TEXT, words TEXT, chapters TEXT, "
+                "highlights TEXT, speakers TEXT, created_at REAL, PRIMARY KEY (attachment_id, version))"
+            )
+            self._conn.commit()
+
+    def _load(self, attachment_id: str, version: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(TRANSCRIPT_FIELDS)} FROM transcripts WHERE attachment_id = ? AND version = ?",
+                (str(attachment_id), version),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"text": row[0], **{field: json.loads(value) for field, value in zip(TRANSCRIPT_FIELDS[1:], row[1:])}}
+
+    def get(self, attachment_id: str, version: Optional[int]) -> Optional[Dict]:
+        if version is None:
+            return None
+        transcript = self._load(attachment_id, version)
+        with self._lock:
+            if transcript is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return transcript
+
+    def put(self, attachment_id: str, version: Optional[int], transcript: Dict):
+        if version is None:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM transcripts WHERE attachment_id = ?", (str(attachment_id),))
+            self._conn.execute(
+                "INSERT INTO transcripts (attachment_id, version, text, words, chapters, highlights, speakers, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(attachment_id), version, transcript["text"],
+                 *(json.dumps(transcript.get(field) or []) for field in TRANSCRIPT_FIELDS[1:]), time.time()),
+            )
+            self._conn.commit()
+
+    def transcribe_once(self, attachment_id: str, version: Optional[int], transcribe: Callable[[], Dict]) -> Dict:
+        """Transcribe and store this attachment version; concurrent callers share one transcription."""
+        if version is None:
+            self.transcriptions += 1
+            return transcribe()
+        key = f"{attachment_id}:{version}"
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another request may have stored it while we waited
+            transcript = self._load(attachment_id, version)
+            if transcript is None:
+                transcript = transcribe()
+                self.transcriptions += 1
+                self.put(attachment_id, version, transcript)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return transcript
+
+    def get_or_transcribe(self, attachment_id: str, version: Optional[int], transcribe: Callable[[], Dict]) -> Dict:
+        """Stored transcript of this attachment version, transcribing it when missing."""
+        return self.get(attachment_id, version) or self.transcribe_once(attachment_id, version, transcribe)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+            return {"entries": entries, "hits": self.hits, "misses": self.misses, "transcriptions": self.transcriptions}
+
+
+transcript_cache = TranscriptCache()
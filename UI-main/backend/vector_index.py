@@ -0,0 +1,258 @@
+"""
+Chunked embedding index over page text for retrieval-augmented /search.
+
+Each page version is split into chunks (prompt_budget.split_chunks) and
+embedded once; the unit-normalized vectors are stored as a NumPy .npy file
+per page version (chunk texts in a .json sidecar) under VECTOR_INDEX_DIR, one
+directory per embedding model so models never mix. A query is embedded once
+and scored against the selected pages' matrices with a single dot product,
+so answering cost no longer grows with the size of the pages, only the
+one-off embedding of a page version nobody has searched before.
+
+Embedders are pluggable (EMBEDDERS):
+    gemini  Gemini embedding API on the key pool (default, models/text-embedding-004)
+    local   sentence-transformers model run in-process (pip install sentence-transformers)
+
+Tuning (environment variables):
+    EMBEDDING_BACKEND           gemini | local (default gemini)
+    EMBEDDING_MODEL             model name for the backend (defaults above / all-MiniLM-L6-v2)
+    EMBEDDING_BATCH_SIZE        chunks per embedding request (default 100)
+    VECTOR_CHUNK_TOKENS         tokens per indexed chunk (default 200)
+    VECTOR_INDEX_DIR            directory of the vector files (default .cache/vectors)
+    VECTOR_INDEX_MEMORY_PAGES   page matrices kept in memory (default 512)
+    SEARCH_TOP_K                chunks sent to Gemini per search question (default 24)
+    HYBRID_LEXICAL_WEIGHT       share of a chunk's score taken from its page's BM25 score
+                                when pages were found lexically (default 0.3)
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import google.generativeai as genai
+
+from cache_db import CACHE_DIR
+from key_pool import key_pool
+from prompt_budget import GAP_MARKER, estimate_tokens, split_chunks
+from resilience import GEMINI_MAX_RETRIES, backoff_delay, is_retryable
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+VECTOR_CHUNK_TOKENS = int(os.getenv("VECTOR_CHUNK_TOKENS", "200"))
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(CACHE_DIR, "vectors"))
+VECTOR_INDEX_MEMORY_PAGES = int(os.getenv("VECTOR_INDEX_MEMORY_PAGES", "512"))
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", "24"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "0.3"))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class GeminiEmbedder:
+    def __init__(self, model: Optional[str] = None):
+        self.model = model or "models/text-embedding-004"
+        self.name = f"gemini-{self.model}"
+
+    def _embed(self, texts: List[str], task_type: str) -> np.ndarray:
+        vectors = []
+        for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[i:i + EMBEDDING_BATCH_SIZE]
+            for attempt in range(GEMINI_MAX_RETRIES + 1):
+                try:
+                    with key_pool.lease() as key:
+                        result = genai.embed_content(
+                            model=self.model, content=batch, task_type=task_type,
+                            client=key.client("generative")
+                        )
+                    break
+                except Exception as e:
+                    if not is_retryable(e) or attempt == GEMINI_MAX_RETRIES:
+                        raise
+                    time.sleep(backoff_delay(attempt))
+            vectors.extend(result["embedding"])
+        return _normalize(vectors)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts, "retrieval_document")
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed([text], "retrieval_query")[0]
+
+
+class LocalEmbedder:
+    def __init__(self, model: Optional[str] = None):
+        # Optional dependency, only needed when EMBEDDING_BACKEND=local
+        from sentence_transformers import SentenceTransformer
+        self.model = model or "all-MiniLM-L6-v2"
+        self.name = f"local-{self.model}"
+        self._encoder = SentenceTransformer(self.model)
+        self._lock = threading.Lock()
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        with self._lock:
+            return _normalize(self._encoder.encode(texts, batch_size=EMBEDDING_BATCH_SIZE))
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed([text])[0]
+
+
+EMBEDDERS = {"gemini": GeminiEmbedder, "local": LocalEmbedder}
+
+
+class PageVectors:
+    def __init__(self, chunks: List[str], vectors: np.ndarray):
+        self.chunks = chunks
+        self.vectors = vectors
+
+
+class VectorIndex:
+    def __init__(self, backend: str = EMBEDDING_BACKEND, model: str = EMBEDDING_MODEL,
+                 index_dir: str = VECTOR_INDEX_DIR, memory_pages: int = VECTOR_INDEX_MEMORY_PAGES):
+        self.backend = backend
+        self.model = model or None
+        self.index_dir = index_dir
+        self.memory_pages = memory_pages
+        self._embedder = None
+        self._pages: "OrderedDict[str, PageVectors]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._page_locks: Dict[str, threading.Lock] = {}
+        self.embedded_pages = 0
+        self.embedded_chunks = 0
+        self.disk_loads = 0
+        self.queries = 0
+
+    @property
+    def embedder(self):
+        # Created on first use, so a local model is only loaded when search needs it
+        with self._lock:
+            if self._embedder is None:
+                self._embedder = EMBEDDERS[self.backend](self.model)
+            return self._embedder
+
+    def _dir(self) -> str:
+        path = os.path.join(self.index_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", self.embedder.name))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _page_lock(self, page_key: str) -> threading.Lock:
+        with self._lock:
+            return self._page_locks.setdefault(page_key, threading.Lock())
+
+    def _remember(self, page_key: str, page: PageVectors):
+        with self._lock:
+            self._pages[page_key] = page
+            self._pages.move_to_end(page_key)
+            while len(self._pages) > self.memory_pages:
+                evicted, _ = self._pages.popitem(last=False)
+                self._page_locks.pop(evicted, None)
+
+    def page_vectors(self, page_id, version, text: str) -> PageVectors:
+        """Chunk vectors of one page version, embedding it on first use."""
+        page_key = f"{page_id}-{version}"
+        with self._lock:
+            page = self._pages.get(page_key)
+            if page is not None:
+                self._pages.move_to_end(page_key)
+                return page
+        with self._page_lock(page_key):
+            with self._lock:
+                page = self._pages.get(page_key)
+            if page is not None:
+                return page
+            base = os.path.join(self._dir(), page_key)
+            if version is not None and os.path.exists(base + ".npy") and os.path.exists(base + ".json"):
+                with open(base + ".json", encoding="utf-8") as f:
+                    page = PageVectors(json.load(f), np.load(base + ".npy"))
+                self.disk_loads += 1
+            else:
+                chunks = split_chunks(text, VECTOR_CHUNK_TOKENS)
+                vectors = self.embedder.embed_documents(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+                page = PageVectors(chunks, vectors)
+                self.embedded_pages += 1
+                self.embedded_chunks += len(chunks)
+                # Unversioned text can change under the same id, so it is not kept at all
+                if version is not None and chunks:
+                    with open(base + ".json", "w", encoding="utf-8") as f:
+                        json.dump(chunks, f)
+                    np.save(base + ".npy", vectors)
+            if version is not None:
+                self._remember(page_key, page)
+            return page
+
+    def search(self, pages: List[Tuple[object, object, str]], query: str,
+               top_k: int = SEARCH_TOP_K, page_scores: Optional[List[float]] = None,
+               query_vector: Optional[np.ndarray] = None) -> List[Tuple[int, int, str, float]]:
+        """Top chunks for `query` over (page_id, version, text) pages.
+
+        With `page_scores` (lexical scores of the pages) each chunk's cosine
+        similarity is blended with its page's max-normalized score. A
+        `query_vector` already computed with this embedder skips embedding the query.
+        Returns (page index, chunk index, chunk text, score), best first.
+        """
+        indexed = [self.page_vectors(page_id, version, text) for page_id, version, text in pages]
+        owners = [(p, c) for p, page in enumerate(indexed) for c in range(len(page.chunks))]
+        if not owners:
+            return []
+        matrix = np.concatenate([page.vectors for page in indexed if page.chunks])
+        if query_vector is None:
+            query_vector = self.embedder.embed_query(query)
+        scores = matrix @ query_vector
+        if page_scores:
+            lexical = np.asarray([page_scores[p] for p, _ in owners], dtype=np.float32)
+            lexical /= max(float(lexical.max()), 1e-9)
+            scores = (1 - HYBRID_LEXICAL_WEIGHT) * scores + HYBRID_LEXICAL_WEIGHT * lexical
+        k = min(top_k, len(owners))
+        best = np.argpartition(-scores, k - 1)[:k]
+        self.queries += 1
+        return [
+            (owners[i][0], owners[i][1], indexed[owners[i][0]].chunks[owners[i][1]], float(scores[i]))
+            for i in sorted(best, key=lambda i: -scores[i])
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "memory_pages": len(self._pages),
+                "embedded_pages": self.embedded_pages,
+                "embedded_chunks": self.embedded_chunks,
+                "disk_loads": self.disk_loads,
+                "queries": self.queries,
+            }
+
+
+def retrieve_documents(index: VectorIndex, pages: List[Dict], documents: List[Tuple[str, str]],
+                       query: str, max_tokens: int, top_k: int = SEARCH_TOP_K,
+                       page_scores: Optional[List[float]] = None,
+                       query_vector: Optional[np.ndarray] = None) -> List[Tuple[str, str]]:
+    """The top-k chunks for `query`, grouped per page in document order and capped at max_tokens."""
+    hits = index.search(
+        [(page["id"], page.get("version"), text) for page, (_, text) in zip(pages, documents)], query, top_k,
+        page_scores, query_vector
+    )
+    kept: Dict[int, List[Tuple[int, str]]] = {}
+    used = 0
+    for page_index, chunk_index, text, _ in hits:
+        cost = estimate_tokens(text) + 1
+        if used + cost > max_tokens:
+            continue
+        used += cost
+        kept.setdefault(page_index, []).append((chunk_index, text))
+    return [
+        (documents[page_index][0], f"\n{GAP_MARKER}\n".join(text for _, text in sorted(kept[page_index])))
+        for page_index in sorted(kept)
+    ]
+
+
+vector_index = VectorIndex()
@@ -0,0 +1,104 @@
+"""
+Cache of Google Custom Search results used by the hybrid_rag web fallback.
+
+Results are keyed by the normalized query (case, whitespace and trailing
+punctuation ignored) and the number of results, kept in memory and in
+SQLite next to the other caches, and reused for WEB_SEARCH_CACHE_TTL
+seconds. The in-memory tier keeps the WEB_SEARCH_CACHE_MEMORY_ENTRIES most
+recently used queries and drops an entry once it has expired. Failed lookups
+are never stored.
+
+Tuning (environment variables):
+    WEB_SEARCH_CACHE_TTL              seconds search results are reused (default 21600)
+    WEB_SEARCH_CACHE_MEMORY_ENTRIES   size of the in-memory tier (default 256)
+    WEB_SEARCH_CACHE_DB               SQLite file (default .cache/web_search.db)
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from cache_db import CACHE_DIR, open_cache_db
+
+WEB_SEARCH_CACHE_TTL = float(os.getenv("WEB_SEARCH_CACHE_TTL", str(6 * 3600)))
+WEB_SEARCH_CACHE_MEMORY_ENTRIES = int(os.getenv("WEB_SEARCH_CACHE_MEMORY_ENTRIES", "256"))
+WEB_SEARCH_CACHE_DB = os.getenv("WEB_SEARCH_CACHE_DB", os.path.join(CACHE_DIR, "web_search.db"))
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?!.").strip()
+
+
+class WebSearchCache:
+    def __init__(self, db_path: str = WEB_SEARCH_CACHE_DB, ttl: float = WEB_SEARCH_CACHE_TTL,
+                 memory_entries: int = WEB_SEARCH_CACHE_MEMORY_ENTRIES):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn = open_cache_db(db_path)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS web_search ("
+                "key TEXT PRIMARY KEY, query TEXT, results TEXT, created_at REAL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _key(query: str, num_results: int) -> str:
+        return hashlib.sha256(f"{num_results}:{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, query: str, num_results: int) -> Optional[str]:
+        key = self._key(query, num_results)
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is None:
+                row = self._conn.execute(
+                    "SELECT results, created_at FROM web_search WHERE key = ?", (key,)
+                ).fetchone()
+                item = tuple(row) if row else None
+            if item is not None and now - item[1] <= self.ttl:
+                self._remember(key, item)
+                self.hits += 1
+                return item[0]
+            self._memory.pop(key, None)
+            self.misses += 1
+        return None
+
+    def _remember(self, key: str, item: tuple):
+        self._memory[key] = item
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, query: str, num_results: int, results: str):
+        key = self._key(query, num_results)
+        now = time.time()
+        with self._lock:
+            self._remember(key, (results, now))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO web_search (key, query, results, created_at) VALUES (?, ?, ?, ?)",
+                (key, normalize_query(query), results, now),
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for key in [k for k, v in self._memory.items() if v[1] < cutoff]:
+                del self._memory[key]
+            self._conn.execute("DELETE FROM web_search WHERE created_at < ?", (cutoff,))
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"memory_entries": len(self._memory), "hits": self.hits, "misses": self.misses}
+
+
+web_search_cache = WebSearchCache()
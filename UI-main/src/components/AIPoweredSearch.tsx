@@ -149,12 +149,26 @@ const AIPoweredSearch: React.FC<AIPoweredSearchProps> = ({
 
     setIsLoading(true);
     setError('');
+    setResponse('');
+    setResponseSource('');
 
     try {
-      const result = await apiService.search({
+      // Stream the answer so it renders as Gemini writes it
+      const result = await apiService.searchStream({
         space_key: selectedSpace,
         page_titles: selectedPages,
         query: query
+      }, {
+        onDelta: (section, text) => {
+          if (section === 'response') setResponse(prev => prev + text);
+        },
+        onSectionStart: (section) => {
+          // The pages and Gemini could not answer; the web fallback's answer replaces the draft
+          if (section === 'hybrid_rag') setResponse('');
+        },
+        onSectionEnd: (section, text) => {
+          if (section === 'response' || section === 'hybrid_rag') setResponse(text);
+        },
       });
 
       setResponse(result.response);
@@ -171,6 +171,29 @@ const TestSupportTool: React.FC<TestSupportToolProps> = ({ onClose, onFeatureSel
     }
   };
 
+  // Report field each streamed Test Support section fills in
+  const reportFields: Record<string, keyof TestReport> = {
+    test_strategy: 'strategy',
+    cross_platform_testing: 'crossPlatform',
+    sensitivity_analysis: 'sensitivity',
+  };
+
+  // Stream the Test Support sections, rendering `field` in the report as its text arrives
+  const streamTestSupport = (field: keyof TestReport) => {
+    setTestReport(prev => ({ ...prev, [field]: '' } as TestReport));
+    return apiService.testSupportStream({
+      space_key: selectedSpace,
+      code_page_title: codePage,
+      test_input_page_title: testInputPage || undefined
+    }, {
+      onDelta: (section, text) => {
+        if (reportFields[section] === field) {
+          setTestReport(prev => ({ ...prev, [field]: (prev?.[field] || '') + text } as TestReport));
+        }
+      },
+    });
+  };
+
   const generateTestStrategy = async () => {
     if (!selectedSpace || !codePage) {
       setError('Please select a space and code page.');
@@ -182,11 +205,7 @@ const TestSupportTool: React.FC<TestSupportToolProps> = ({ onClose, onFeatureSel
 
     try {
       console.log('Calling test support API for strategy...');
-      const result = await apiService.testSupport({
-        space_key: selectedSpace,
-        code_page_title: codePage,
-        test_input_page_title: testInputPage || undefined
-      });
+      const result = await streamTestSupport('strategy');
 
       console.log('Test support API response:', result);
 
@@ -214,11 +233,7 @@ const TestSupportTool: React.FC<TestSupportToolProps> = ({ onClose, onFeatureSel
 
     try {
       console.log('Calling test support API for cross-platform...');
-      const result = await apiService.testSupport({
-        space_key: selectedSpace,
-        code_page_title: codePage,
-        test_input_page_title: testInputPage || undefined
-      });
+      const result = await streamTestSupport('crossPlatform');
 
       console.log('Cross-platform API response:', result);
 
@@ -247,11 +262,7 @@ const TestSupportTool: React.FC<TestSupportToolProps> = ({ onClose, onFeatureSel
 
     try {
       console.log('Calling test support API for sensitivity...');
-      const result = await apiService.testSupport({
-        space_key: selectedSpace,
-        code_page_title: codePage,
-        test_input_page_title: testInputPage || undefined
-      });
+      const result = await streamTestSupport('sensitivity');
 
       console.log('Sensitivity API response:', result);
 
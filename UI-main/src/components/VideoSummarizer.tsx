@@ -146,7 +146,7 @@ const VideoSummarizer: React.FC<VideoSummarizerProps> = ({ onClose, onFeatureSel
         const page = selectedPages[i];
         
         try {
-          const result = await apiService.videoSummarizer({
+          const result = await apiService.videoSummarizerJob({
             space_key: selectedSpace,
             page_title: page
           });
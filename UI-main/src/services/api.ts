@@ -2,7 +2,8 @@ const API_BASE_URL = 'https://finalcode-backend.onrender.com';
 
 export interface SearchRequest {
   space_key: string;
-  page_titles: string[];
+  // Omit to search the whole space
+  page_titles?: string[];
   query: string;
 }
 
@@ -19,6 +20,7 @@ export interface ImpactRequest {
   new_page_title: string;
   question?: string;
   enable_stack_overflow_check?: boolean;
+  structured_output?: boolean;
 }
 
 export interface DirectCodeImpactRequest {
@@ -26,6 +28,7 @@ export interface DirectCodeImpactRequest {
   new_code: string;
   question?: string;
   enable_stack_overflow_check?: boolean;
+  structured_output?: boolean;
 }
 
 export interface PushToJiraConfluenceSlackRequest {
@@ -64,6 +67,8 @@ export interface SearchResponse {
   pages_analyzed: number;
   page_titles: string[];
   source?: string;
+  context_id?: string;
+  context_reused?: boolean;
 }
 
 export interface CodeResponse {
@@ -89,6 +94,13 @@ export interface ImpactResponse {
   answer?: string;
   diff: string;
   stack_overflow_risks?: StackOverflowRisk[];
+  change_severities?: ChangeSeverity[] | null;
+}
+
+export interface ChangeSeverity {
+  change: string;
+  severity: 'Low' | 'Medium' | 'High';
+  reason: string;
 }
 
 export interface StackOverflowRisk {
@@ -218,6 +230,36 @@ export interface PageWithType {
   content_type: string;
 }
 
+export interface JobStage {
+  name: string;
+  status: 'pending' | 'running' | 'done' | 'skipped' | 'failed';
+  started_at: number | null;
+  finished_at: number | null;
+}
+
+export interface JobStatus<T = unknown> {
+  job_id: string;
+  kind: string;
+  status: 'queued' | 'running' | 'completed' | 'failed';
+  stage: string | null;
+  stages: JobStage[];
+  attempts: number;
+  created_at: number;
+  started_at: number | null;
+  finished_at: number | null;
+  result: T | null;
+  error: string | null;
+  status_code: number | null;
+  deduplicated?: boolean;
+}
+
+export interface StreamHandlers {
+  onStatus?: (message: string) => void;
+  onSectionStart?: (section: string) => void;
+  onDelta?: (section: string, text: string) => void;
+  onSectionEnd?: (section: string, text: string) => void;
+}
+
 class ApiService {
   private getSelectedApiKey(): string | undefined {
     if (typeof window !== 'undefined' && localStorage.getItem('selectedApiKeyId')) {
@@ -247,6 +289,70 @@ class ApiService {
     return response.json();
   }
 
+  // POST to a Server-Sent Events endpoint, dispatching frames to the handlers.
+  // Resolves with the payload of the final `done` frame.
+  private async streamRequest<T>(endpoint: string, body: unknown, handlers: StreamHandlers = {}): Promise<T> {
+    const apiKey = this.getSelectedApiKey();
+    const headers: Record<string, string> = {
+      'Content-Type': 'application/json',
+      'Accept': 'text/event-stream',
+    };
+    if (apiKey) {
+      headers['x-api-key'] = apiKey;
+    }
+    const response = await fetch(`${API_BASE_URL}${endpoint}`, {
+      method: 'POST',
+      headers,
+      body: JSON.stringify(body),
+    });
+    if (!response.ok || !response.body) {
+      const error = await response.json().catch(() => ({}));
+      throw new Error(error.detail || 'API request failed');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const frame = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        let event = 'message';
+        let data = '';
+        for (const line of frame.split('\n')) {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        const payload = data ? JSON.parse(data) : {};
+        switch (event) {
+          case 'status':
+            handlers.onStatus?.(payload.message);
+            break;
+          case 'section_start':
+            handlers.onSectionStart?.(payload.section);
+            break;
+          case 'delta':
+            handlers.onDelta?.(payload.section, payload.text);
+            break;
+          case 'section_end':
+            handlers.onSectionEnd?.(payload.section, payload.text);
+            break;
+          case 'error':
+            throw new Error(payload.detail || 'Streaming request failed');
+          case 'done':
+            return payload as T;
+        }
+      }
+    }
+    throw new Error('Stream ended before completion');
+  }
+
   async getSpaces(): Promise<{ spaces: Space[] }> {
     return this.makeRequest<{ spaces: Space[] }>('/spaces');
   }
@@ -262,6 +368,10 @@ class ApiService {
     });
   }
 
+  async searchStream(request: SearchRequest, handlers?: StreamHandlers): Promise<SearchResponse> {
+    return this.streamRequest<SearchResponse>('/search/stream', request, handlers);
+  }
+
   async videoSummarizer(request: VideoRequest): Promise<VideoResponse> {
     return this.makeRequest<VideoResponse>('/video-summarizer', {
       method: 'POST',
@@ -269,6 +379,38 @@ class ApiService {
     });
   }
 
+  async videoSummarizerStream(request: VideoRequest, handlers?: StreamHandlers): Promise<VideoResponse> {
+    return this.streamRequest<VideoResponse>('/video-summarizer/stream', request, handlers);
+  }
+
+  async submitVideoSummarizerJob(request: VideoRequest): Promise<JobStatus<VideoResponse>> {
+    return this.makeRequest<JobStatus<VideoResponse>>('/video-summarizer/jobs', {
+      method: 'POST',
+      body: JSON.stringify(request),
+    });
+  }
+
+  async getJob<T>(jobId: string): Promise<JobStatus<T>> {
+    return this.makeRequest<JobStatus<T>>(`/jobs/${jobId}`);
+  }
+
+  // Poll a background job until it finishes, resolving with its result.
+  async waitForJob<T>(jobId: string, onProgress?: (job: JobStatus<T>) => void, intervalMs = 2000): Promise<T> {
+    while (true) {
+      const job = await this.getJob<T>(jobId);
+      onProgress?.(job);
+      if (job.status === 'completed') return job.result as T;
+      if (job.status === 'failed') throw new Error(job.error || 'Job failed');
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+  }
+
+  // Video summary as a background job, so long transcriptions don't hold the request open.
+  async videoSummarizerJob(request: VideoRequest, onProgress?: (job: JobStatus<VideoResponse>) => void): Promise<VideoResponse> {
+    const job = await this.submitVideoSummarizerJob(request);
+    return this.waitForJob<VideoResponse>(job.job_id, onProgress);
+  }
+
   async codeAssistant(request: CodeRequest): Promise<CodeResponse> {
     return this.makeRequest<CodeResponse>('/code-assistant', {
       method: 'POST',
@@ -276,6 +418,10 @@ class ApiService {
     });
   }
 
+  async codeAssistantStream(request: CodeRequest, handlers?: StreamHandlers): Promise<CodeResponse> {
+    return this.streamRequest<CodeResponse>('/code-assistant/stream', request, handlers);
+  }
+
   async impactAnalyzer(request: ImpactRequest): Promise<ImpactResponse> {
     return this.makeRequest<ImpactResponse>('/impact-analyzer', {
       method: 'POST',
@@ -304,6 +450,10 @@ class ApiService {
     });
   }
 
+  async testSupportStream(request: TestRequest, handlers?: StreamHandlers): Promise<TestResponse> {
+    return this.streamRequest<TestResponse>('/test-support/stream', request, handlers);
+  }
+
   async getImages(spaceKey: string, pageTitle: string): Promise<InsightSourcesResponse> {
     return this.makeRequest<InsightSourcesResponse>(`/images/${spaceKey}/${encodeURIComponent(pageTitle)}`);
   }
@@ -398,14 +548,14 @@ class ApiService {
 
 export const apiService = new ApiService(); 
 
-export async function analyzeGoal(goal: string, availablePages: string[]) {
+export async function analyzeGoal(goal: string, availablePages: string[], spaceKey?: string) {
   const res = await fetch(`${API_BASE_URL}/analyze-goal`, {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
       'x-api-key': localStorage.getItem('selectedApiKeyId') || '',
     },
-    body: JSON.stringify({ goal, available_pages: availablePages }),
+    body: JSON.stringify({ goal, available_pages: availablePages, space_key: spaceKey }),
   });
   if (!res.ok) throw new Error('Failed to analyze goal');
   return res.json();